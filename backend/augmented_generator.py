@@ -1,13 +1,18 @@
-from litellm import completion
 import os
+import time
+import asyncio
 
-def llm_response(prompt_system: str, prompt_user: str, stream: bool = False) -> dict:
-    """
-    Genera una respuesta utilizando un modelo de lenguaje LLM a través de litellm.
+from litellm import completion, acompletion, ModelResponse
 
+from llm_cache import get_llm_cache, cache_key, record_lookup
+from metrics import span, record_span, record_tokens, increment
+from utils import count_tokens
 
-def llm_response(prompt_system, prompt_user, stream=False):
-  """
+# Streamed calls ask the API to report their usage in the last chunk
+STREAM_OPTIONS = {"stream": True, "stream_options": {"include_usage": True}}
+
+def llm_response(prompt_system: str, prompt_user: str, stream: bool = False, json_output: bool = False, max_tokens: int = 512) -> dict:
+    """
     Genera una respuesta utilizando un modelo de lenguaje LLM a través de litellm.
 
     Esta función configura y realiza una llamada al modelo GPT-4o mini usando la API de OpenAI,
@@ -19,15 +24,21 @@ def llm_response(prompt_system, prompt_user, stream=False):
         prompt_user (str): El mensaje o consulta del usuario que el modelo debe responder
         stream (bool, optional): Indica si la respuesta debe ser transmitida en tiempo real.
             Por defecto es False
+        json_output (bool, optional): Indica si el modelo debe responder con un objeto JSON.
+            Por defecto es False
+        max_tokens (int, optional): Límite de tokens de la respuesta. Por defecto es 512
 
     Returns:
         dict: Respuesta del modelo que incluye el texto generado y metadatos adicionales
 
     Note:
-        - Requiere que la variable de entorno OPENAI_API_KEY esté configurada
+        - Requiere que la variable de entorno OPENAI_API_KEY esté configurada (se carga una
+          única vez con utils.init_runtime)
         - Utiliza el modelo 'gpt-4o-mini-2024-07-18'
         - La temperatura está configurada en 0 para respuestas deterministas
-        - El límite de tokens está establecido en 512
+        - El límite de tokens por defecto está establecido en 512
+        - Si LLM_CACHE_BACKEND está activo, las peticiones idénticas se sirven desde la
+          caché (ver llm_cache.py), también en modo streaming
 
     Example:
         response = llm_response(
@@ -37,18 +48,346 @@ def llm_response(prompt_system, prompt_user, stream=False):
         )
     """
 
-    
+    request = build_llm_request(prompt_system, prompt_user, json_output=json_output, max_tokens=max_tokens)
+    if stream:
+        return _stream_llm_response(request)
+
+    with span("llm_response"):
+        cache = get_llm_cache()
+        if cache is None:
+            return record_usage(completion(**request), request)
+
+        key = cache_key(request)
+        cached_response = cache.get(key)
+        record_lookup(cached_response is not None)
+
+        if cached_response is not None:
+            record_cached_usage(cached_response, request)
+            return cached_model_response(cached_response)
+
+        response = record_usage(completion(**request), request)
+        cache.set(key, response.model_dump())
+        return response
+
+async def allm_response(prompt_system: str, prompt_user: str, stream: bool = False, json_output: bool = False, max_tokens: int = 512):
+    """
+    Versión asíncrona de llm_response basada en litellm.acompletion.
+
+    No bloquea el event loop: la llamada al modelo, el streaming de la respuesta y los
+    accesos a la caché de respuestas se realizan sin bloquear otras peticiones.
+
+    Args:
+        prompt_system (str): El mensaje de sistema que establece el contexto o comportamiento
+            del modelo
+        prompt_user (str): El mensaje o consulta del usuario que el modelo debe responder
+        stream (bool, optional): Indica si la respuesta debe ser transmitida en tiempo real.
+            Por defecto es False
+        json_output (bool, optional): Indica si el modelo debe responder con un objeto JSON.
+            Por defecto es False
+        max_tokens (int, optional): Límite de tokens de la respuesta. Por defecto es 512
+
+    Returns:
+        Respuesta del modelo o, con stream=True, un iterador asíncrono de fragmentos
+    """
+
+    request = build_llm_request(prompt_system, prompt_user, json_output=json_output, max_tokens=max_tokens)
+    if stream:
+        return await _astream_llm_response(request)
+
+    with span("llm_response"):
+        cache = get_llm_cache()
+        if cache is None:
+            return record_usage(await acompletion(**request), request)
+
+        key = cache_key(request)
+        cached_response = await asyncio.to_thread(cache.get, key)
+        record_lookup(cached_response is not None)
+
+        if cached_response is not None:
+            record_cached_usage(cached_response, request)
+            return cached_model_response(cached_response)
+
+        response = record_usage(await acompletion(**request), request)
+        await asyncio.to_thread(cache.set, key, response.model_dump())
+        return response
+
+def _stream_llm_response(request: dict):
+    # The 'llm_response' span of a streamed call ends when the stream has been consumed (see track_stream_usage)
+    started = time.perf_counter()
+    try:
+        cache = get_llm_cache()
+        if cache is None:
+            return track_stream_usage(completion(**request, **STREAM_OPTIONS), request, started)
+
+        key = cache_key(request)
+        cached_response = cache.get(key)
+        record_lookup(cached_response is not None)
 
-    os.environ["OPENAI_API_KEY"] = os.getenv("OPENAI_API_KEY")
+        if cached_response is not None:
+            record_cached_usage(cached_response, request)
+            record_span("llm_response", time.perf_counter() - started)
+            return replay_stream(cached_response)
+        return cache_stream(track_stream_usage(completion(**request, **STREAM_OPTIONS), request, started), cache, key, request["model"])
+    except BaseException:
+        record_span("llm_response", time.perf_counter() - started)
+        raise
 
-    return completion(
-        model="gpt-4o-mini-2024-07-18",
-        messages=[
+async def _astream_llm_response(request: dict):
+    started = time.perf_counter()
+    try:
+        cache = get_llm_cache()
+        if cache is None:
+            return atrack_stream_usage(await acompletion(**request, **STREAM_OPTIONS), request, started)
+
+        key = cache_key(request)
+        cached_response = await asyncio.to_thread(cache.get, key)
+        record_lookup(cached_response is not None)
+
+        if cached_response is not None:
+            record_cached_usage(cached_response, request)
+            record_span("llm_response", time.perf_counter() - started)
+            return areplay_stream(cached_response)
+        return acache_stream(atrack_stream_usage(await acompletion(**request, **STREAM_OPTIONS), request, started), cache, key, request["model"])
+    except BaseException:
+        record_span("llm_response", time.perf_counter() - started)
+        raise
+
+def build_llm_request(prompt_system: str, prompt_user: str, json_output: bool = False, max_tokens: int = 512) -> dict:
+    """
+    Construye los parámetros de la llamada a litellm.
+
+    Args:
+        prompt_system (str): Mensaje de sistema
+        prompt_user (str): Mensaje del usuario
+        json_output (bool, optional): Indica si el modelo debe responder con un objeto JSON
+        max_tokens (int, optional): Límite de tokens de la respuesta
+
+    Returns:
+        dict: Parámetros de la llamada (sin 'stream')
+    """
+
+    request = {
+        "model": "gpt-4o-mini-2024-07-18",
+        "messages": [
             {"content": prompt_system, "role": "system"},
             {"content": prompt_user, "role": "user"}
         ],
-        stream=stream,
-        temperature=0,
-        max_tokens=512,
-    )
+        "temperature": 0,
+        "max_tokens": max_tokens,
+    }
+    if json_output:
+        request["response_format"] = {"type": "json_object"}
+    return request
+
+def count_prompt_tokens(request: dict) -> int:
+    """
+    Cuenta los tokens de los mensajes de una petición antes de enviarla al modelo.
+
+    Args:
+        request (dict): Parámetros de la llamada a litellm
+
+    Returns:
+        int: Tokens de los mensajes (estimación local con tiktoken)
+    """
+
+    return sum(count_tokens(message["content"]) for message in request["messages"])
+
+def response_usage(response) -> dict:
+    """
+    Retorna el consumo de tokens informado por litellm para una respuesta.
+
+    Args:
+        response: Respuesta de litellm
+
+    Returns:
+        dict: Tokens de prompt, de respuesta y totales, o None si la respuesta no lo
+            informa (streaming)
+    """
+
+    usage = getattr(response, "usage", None) if isinstance(response, ModelResponse) else None
+    if usage is None:
+        return None
+    prompt_tokens = getattr(usage, "prompt_tokens", 0) or 0
+    completion_tokens = getattr(usage, "completion_tokens", 0) or 0
+    return {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens, "total_tokens": prompt_tokens + completion_tokens}
+
+def record_usage(response, request: dict):
+    """
+    Suma los tokens de una llamada al modelo a las métricas. Si la respuesta no informa de
+    su consumo se contabilizan los tokens del prompt contados localmente.
+
+    Args:
+        response: Respuesta de litellm
+        request (dict): Parámetros de la llamada
+
+    Returns:
+        La misma respuesta
+    """
+
+    usage = response_usage(response)
+    if usage is not None:
+        record_tokens(usage["prompt_tokens"], usage["completion_tokens"])
+    else:
+        record_tokens(count_prompt_tokens(request))
+    return response
+
+def _chunk_usage(chunk):
+    usage = getattr(chunk, "usage", None)
+    if usage is None:
+        return None
+    return getattr(usage, "prompt_tokens", 0) or 0, getattr(usage, "completion_tokens", 0) or 0
+
+def _record_stream_usage(usage, request: dict, stream_chunks):
+    # Without the usage chunk (stream cut short, or not reported) the tokens are counted locally
+    if usage is None:
+        usage = count_prompt_tokens(request), count_tokens("".join(stream_chunks))
+    record_tokens(*usage)
+
+def track_stream_usage(stream_response, request: dict, started: float = None):
+    """
+    Transmite una respuesta en streaming y suma a las métricas su consumo de tokens al
+    terminar (el informado en el último fragmento o, si falta, el contado localmente).
+
+    Args:
+        stream_response: Stream de litellm
+        request (dict): Parámetros de la llamada
+        started (float, optional): Inicio de la llamada (time.perf_counter). Si se indica,
+            al terminar el stream se registra la duración de la etapa 'llm_response'
+
+    Yields:
+        Fragmentos del stream original
+    """
+
+    usage, stream_chunks = None, []
+    try:
+        for chunk in stream_response:
+            usage = _chunk_usage(chunk) or usage
+            stream_chunks.append(_chunk_content(chunk))
+            yield chunk
+    finally:
+        _record_stream_usage(usage, request, stream_chunks)
+        if started is not None:
+            record_span("llm_response", time.perf_counter() - started)
+
+async def atrack_stream_usage(stream_response, request: dict, started: float = None):
+    """
+    Versión asíncrona de track_stream_usage.
+    """
+
+    usage, stream_chunks = None, []
+    try:
+        async for chunk in stream_response:
+            usage = _chunk_usage(chunk) or usage
+            stream_chunks.append(_chunk_content(chunk))
+            yield chunk
+    finally:
+        _record_stream_usage(usage, request, stream_chunks)
+        if started is not None:
+            record_span("llm_response", time.perf_counter() - started)
+
+def record_cached_usage(cached_response: dict, request: dict):
+    """
+    Suma a 'rag_llm_cached_tokens_total' los tokens de una respuesta servida desde la caché,
+    que no se consumen y por tanto no cuentan en 'rag_llm_tokens_total'.
+
+    Args:
+        cached_response (dict): Respuesta guardada en la caché
+        request (dict): Parámetros de la llamada
+    """
+
+    usage = cached_response.get("usage") or {}
+    prompt_tokens = usage.get("prompt_tokens") or count_prompt_tokens(request)
+    completion_tokens = usage.get("completion_tokens") or count_tokens(cached_response["choices"][0]["message"]["content"] or "")
+    increment("rag_llm_cached_tokens_total", prompt_tokens, direction="prompt")
+    increment("rag_llm_cached_tokens_total", completion_tokens, direction="completion")
+
+def cached_model_response(cached_response: dict) -> ModelResponse:
+    """
+    Reconstruye una respuesta de litellm guardada en la caché, marcada como acierto de caché
+    (ver is_cache_hit).
+    """
+
+    response = ModelResponse(**{field: value for field, value in cached_response.items() if field != "stream_chunks"})
+    response._hidden_params["cache_hit"] = True
+    return response
+
+def is_cache_hit(response) -> bool:
+    """
+    Indica si una respuesta se ha servido desde la caché de respuestas (sin consumir tokens).
+    """
+
+    return bool((getattr(response, "_hidden_params", None) or {}).get("cache_hit"))
+
+def _cached_stream_chunks(cached_response: dict):
+    return cached_response.get("stream_chunks") or [cached_response["choices"][0]["message"]["content"]]
+
+def _chunk_content(chunk) -> str:
+    return (chunk['choices'][0]['delta'].get('content', '') if chunk['choices'] else '') or ''
+
+def _stream_cache_entry(model: str, stream_chunks) -> dict:
+    return {
+        "model": model,
+        "choices": [{"index": 0, "finish_reason": "stop", "message": {"role": "assistant", "content": "".join(stream_chunks)}}],
+        "stream_chunks": stream_chunks,
+    }
+
+def replay_stream(cached_response: dict):
+    """
+    Reproduce una respuesta cacheada con el mismo formato de fragmentos que el streaming de litellm.
+
+    Args:
+        cached_response (dict): Respuesta guardada en la caché
+
+    Yields:
+        dict: Fragmentos con la forma {'choices': [{'delta': {'content': ...}}]}
+    """
+
+    for chunk_content in _cached_stream_chunks(cached_response):
+        yield {"choices": [{"index": 0, "delta": {"content": chunk_content}}]}
+
+async def areplay_stream(cached_response: dict):
+    """
+    Versión asíncrona de replay_stream.
+    """
+
+    for chunk_content in _cached_stream_chunks(cached_response):
+        yield {"choices": [{"index": 0, "delta": {"content": chunk_content}}]}
+
+def cache_stream(stream_response, cache, key: str, model: str):
+    """
+    Transmite una respuesta en streaming y la guarda en la caché al completarse.
+
+    Si el consumidor abandona el stream antes del final, la respuesta no se cachea.
+
+    Args:
+        stream_response: Stream de litellm
+        cache: Caché de respuestas
+        key (str): Clave de la petición en la caché
+        model (str): Modelo utilizado
+
+    Yields:
+        Fragmentos del stream original
+    """
+
+    stream_chunks = []
+    for chunk in stream_response:
+        chunk_content = _chunk_content(chunk)
+        if chunk_content:
+            stream_chunks.append(chunk_content)
+        yield chunk
+
+    cache.set(key, _stream_cache_entry(model, stream_chunks))
+
+async def acache_stream(stream_response, cache, key: str, model: str):
+    """
+    Versión asíncrona de cache_stream.
+    """
+
+    stream_chunks = []
+    async for chunk in stream_response:
+        chunk_content = _chunk_content(chunk)
+        if chunk_content:
+            stream_chunks.append(chunk_content)
+        yield chunk
 
+    await asyncio.to_thread(cache.set, key, _stream_cache_entry(model, stream_chunks))
@@ -0,0 +1,101 @@
+import os
+import time
+import uuid
+import threading
+from collections import OrderedDict
+
+
+_sessions = OrderedDict()
+_sessions_lock = threading.Lock()
+
+
+def _evict_sessions(now: float):
+    # Sessions are kept in last-use order, so idle ones are always at the front
+    idle_seconds = float(os.getenv("CHAT_SESSION_IDLE_SECONDS", "1800"))
+    max_sessions = int(os.getenv("CHAT_SESSIONS_MAX", "1000"))
+    while _sessions:
+        oldest = next(iter(_sessions.values()))
+        if len(_sessions) <= max_sessions and now - oldest["last_used"] <= idle_seconds:
+            break
+        _sessions.popitem(last=False)
+
+def get_session(session_id: str, vectorstore_name: str, chat_history=None) -> dict:
+    """
+    Retorna la sesión de chat indicada o crea una nueva.
+
+    Se crea una sesión nueva si no se indica ninguna, si ha caducado por inactividad o si
+    pertenece a otro vectorstore.
+
+    Args:
+        session_id (str): Id de la sesión devuelto en la respuesta anterior, o None
+        vectorstore_name (str): Nombre del vectorstore de la conversación
+        chat_history (List[str], optional): Historial enviado por el cliente, con el que se
+            inicia una sesión nueva (p. ej. si la anterior caducó)
+
+    Returns:
+        dict: Sesión con su id, el historial ('history', preguntas y respuestas alternadas),
+            la última pregunta y el último contexto recuperado
+
+    Note:
+        Las sesiones se guardan en memoria del proceso: como máximo CHAT_SESSIONS_MAX
+        sesiones, que se eliminan tras CHAT_SESSION_IDLE_SECONDS segundos sin uso.
+    """
+
+    now = time.time()
+    with _sessions_lock:
+        _evict_sessions(now)
+        session = _sessions.get(session_id) if session_id else None
+        if session is None or session["vectorstore_name"] != vectorstore_name:
+            session = {
+                "session_id": uuid.uuid4().hex,
+                "vectorstore_name": vectorstore_name,
+                "history": list(chat_history or [])[-2 * int(os.getenv("CHAT_SESSION_MAX_TURNS", "10")):],
+                "last_question": None,
+                "context": None,
+                "last_used": now,
+            }
+            _sessions[session["session_id"]] = session
+        session["last_used"] = now
+        _sessions.move_to_end(session["session_id"])
+        _evict_sessions(now)
+        return session
+
+def update_context(session: dict, user_question: str, context: str):
+    """
+    Guarda en la sesión la pregunta (reformulada) y el contexto recuperado para ella.
+    """
+
+    with _sessions_lock:
+        session["last_question"] = user_question
+        session["context"] = context
+
+def record_turn(session: dict, input_text: str, answer: str):
+    """
+    Añade una pregunta y su respuesta al historial de la sesión.
+
+    El historial conserva como máximo los últimos CHAT_SESSION_MAX_TURNS turnos.
+
+    Args:
+        session (dict): Sesión de chat
+        input_text (str): Pregunta del usuario
+        answer (str): Respuesta generada
+    """
+
+    max_turns = int(os.getenv("CHAT_SESSION_MAX_TURNS", "10"))
+    with _sessions_lock:
+        session["history"] = (session["history"] + [input_text, answer])[-2 * max_turns:]
+        session["last_used"] = time.time()
+
+def delete_session(session_id: str) -> bool:
+    """
+    Elimina una sesión de chat.
+
+    Args:
+        session_id (str): Id de la sesión
+
+    Returns:
+        bool: True si la sesión existía
+    """
+
+    with _sessions_lock:
+        return _sessions.pop(session_id, None) is not None
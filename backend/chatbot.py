@@ -1,10 +1,26 @@
 import os
+import re
+import asyncio
 from typing import List
-from utils import load_secrets, get_embeddings_model
-from retriever import load_vectorstore, extract_top_documents, parse_document
-from augmented_generator import llm_response
+from utils import init_runtime, get_embeddings_model
+from retriever import load_vectorstore_by_name, extract_top_documents, parse_document
+from augmented_generator import llm_response, allm_response
+from context_builder import context_token_budget
+from lexical_index import tokenize
+from chat_sessions import update_context
 from prompt_engineering import GET_CONTEXT_PROMPT_SYSTEM, GET_CONTEXT_PROMPT_USER, CHATBOT_PROMPT_SYSTEM, CHATBOT_PROMPT_USER
 
+# A leading connector continues the previous turn ("¿y el plazo?", "pero ¿cuánto cuesta?")
+FOLLOW_UP_CONNECTOR = re.compile(r"^\W*(y|pero|entonces|tambi[eé]n|adem[aá]s)\b", re.IGNORECASE)
+# Pronouns that cannot take a noun ("¿cuánto cuesta eso?") and demonstratives used without one
+# ("¿quién firma este?"); determiners followed by a noun ("el plazo de este contrato") do not count
+ANAPHORIC_PRONOUN = re.compile(
+    r"\b(eso|esto|ello|aquello|él|ella|ellos|ellas|lo mismo)\b"
+    r"|\b(este|esta|estos|estas|ese|esa|esos|esas|aquel|aquella|aquellos|aquellas)\s*(?=[?!.,;:]|$)",
+    re.IGNORECASE,
+)
+
+
 def chatbot_response(vectorstore_name: str, input_text: str, chat_history: List[str]):
     """
     Genera una respuesta del chatbot basada en el contexto del documento y el historial de chat.
@@ -26,11 +42,11 @@ def chatbot_response(vectorstore_name: str, input_text: str, chat_history: List[
         - DOCUMENTS_TO_FETCH: Número de documentos a filtrar
     """
     
-    # First, load the secrets files to access environmental variables
-    load_secrets([".env.file", ".env.secrets"])
+    # Make sure secrets and shared clients are loaded (no-op after app startup)
+    init_runtime()
 
-    vectorstore = load_vectorstore(embeddings_model=get_embeddings_model(),
-                                 pdf_file_path=f"{vectorstore_name}.pdf")
+    vectorstore = load_vectorstore_by_name(embeddings_model=get_embeddings_model(),
+                                          vectorstore_name=vectorstore_name)
 
     user_question = reformulate_user_question(input_text, chat_history)
 
@@ -40,6 +56,54 @@ def chatbot_response(vectorstore_name: str, input_text: str, chat_history: List[
     return generate_chatbot_response(user_question, vectorstore, top_k, fetch_k)
 
 
+async def achatbot_response(vectorstore_name: str, input_text: str, chat_history: List[str], session: dict = None):
+    """
+    Versión asíncrona de chatbot_response que no bloquea el event loop.
+
+    La carga del vectorstore, la recuperación de documentos y la construcción del contexto
+    se ejecutan en un hilo; la reformulación y la respuesta final usan litellm asíncrono.
+
+    Con una sesión de chat (ver chat_sessions.py) el historial se toma de la sesión y, si la
+    pregunta es de seguimiento y el contexto de la pregunta anterior ya cubre sus términos
+    (ver context_covers), se reutiliza ese contexto sin volver a consultar el vectorstore.
+
+    Args:
+        vectorstore_name (str): Nombre del archivo del vectorstore (sin extensión .pdf)
+        input_text (str): Texto de entrada o pregunta del usuario
+        chat_history (List[str]): Historial de conversaciones previas (sin sesión)
+        session (dict, optional): Sesión de chat de la conversación
+
+    Returns:
+        Iterador asíncrono con la respuesta del modelo LLM en formato streaming
+    """
+    
+    # Make sure secrets and shared clients are loaded (no-op after app startup)
+    init_runtime()
+
+    if session is not None:
+        chat_history = session["history"]
+
+    user_question = await areformulate_user_question(input_text, chat_history)
+
+    previous_context = session["context"] if session is not None else None
+    if previous_context and is_follow_up(input_text) and context_covers(user_question, previous_context):
+        llm_context = previous_context
+    else:
+        vectorstore = await asyncio.to_thread(load_vectorstore_by_name, get_embeddings_model(), vectorstore_name)
+        fetch_k = int(os.getenv("DOCUMENTS_TO_RETRIEVE"))
+        top_k = int(os.getenv("DOCUMENTS_TO_FETCH"))
+        llm_context = await asyncio.to_thread(chatbot_context, user_question, vectorstore, top_k, fetch_k)
+
+    if session is not None:
+        update_context(session, user_question, llm_context)
+
+    return await allm_response(
+        prompt_system=CHATBOT_PROMPT_SYSTEM,
+        prompt_user=CHATBOT_PROMPT_USER.format(question=user_question, context=llm_context),
+        stream=True
+    )
+
+
 def reformulate_user_question(input_text: str, chat_history: List[str]) -> str:
     """
     Reformula la pregunta del usuario considerando el contexto del historial de chat.
@@ -55,29 +119,143 @@ def reformulate_user_question(input_text: str, chat_history: List[str]) -> str:
         str: Pregunta reformulada considerando el contexto histórico
 
     Note:
-        - Si no hay historial, retorna la pregunta original
+        - Si no hay historial o la pregunta no depende de él (ver is_follow_up), retorna
+          la pregunta original sin llamar al LLM
         - Considera hasta las últimas 5 preguntas del historial
     """
     
-    if len(chat_history) == 0:
+    prompt_user = reformulation_prompt(input_text, chat_history)
+    if prompt_user is None:
         return input_text
 
-    user_questions = chat_history[::2]
-    if len(user_questions) > 5:
-        user_questions = user_questions[-5:]
-    else:
-        user_questions = chat_history
+    llm_answer = llm_response(
+        prompt_system=GET_CONTEXT_PROMPT_SYSTEM,
+        prompt_user=prompt_user
+    ).choices[0].message.content
+
+    return llm_answer
+
+
+def reformulation_prompt(input_text: str, chat_history: List[str]):
+    """
+    Construye el prompt de reformulación de la pregunta del usuario.
+
+    Args:
+        input_text (str): Pregunta original del usuario
+        chat_history (List[str]): Historial de conversaciones previas
+
+    Returns:
+        str: Prompt de reformulación, o None si no hay historial o la pregunta no lo necesita
+    """
+    
+    if len(chat_history) == 0 or not is_follow_up(input_text):
+        return None
 
-    prompt_user = GET_CONTEXT_PROMPT_USER.format(
+    # The history alternates user questions and answers: keep the last 5 questions
+    user_questions = chat_history[::2][-5:]
+
+    return GET_CONTEXT_PROMPT_USER.format(
         question=input_text,
         history_questions=user_questions
     )
-    llm_answer = llm_response(
+
+
+def is_follow_up(input_text: str) -> bool:
+    """
+    Indica, con una heurística sin llamadas al LLM, si una pregunta depende del historial.
+
+    Se considera de seguimiento si es muy corta (menos de CHAT_STANDALONE_MIN_WORDS
+    palabras), si empieza por un conector ("y", "pero", "también"...) o si contiene un
+    pronombre sin antecedente en la propia pregunta ("eso", "ella", "¿quién firma este?").
+    Los determinantes seguidos de un sustantivo ("el plazo de este contrato", "su
+    presupuesto") no la convierten en pregunta de seguimiento.
+
+    Args:
+        input_text (str): Pregunta del usuario
+
+    Returns:
+        bool: True si la pregunta debe reformularse con el historial
+    """
+
+    if len(input_text.split()) < int(os.getenv("CHAT_STANDALONE_MIN_WORDS", "4")):
+        return True
+    return FOLLOW_UP_CONNECTOR.search(input_text) is not None or ANAPHORIC_PRONOUN.search(input_text) is not None
+
+def context_covers(user_question: str, context: str) -> bool:
+    """
+    Indica si un contexto recuperado anteriormente cubre los términos de una pregunta.
+
+    Args:
+        user_question (str): Pregunta (reformulada) del usuario
+        context (str): Contexto recuperado para la pregunta anterior
+
+    Returns:
+        bool: True si al menos CHAT_CONTEXT_REUSE_OVERLAP de los términos significativos de
+            la pregunta aparecen en el contexto
+    """
+
+    question_terms = {term for term in tokenize(user_question) if len(term) > 3 or term.isdigit()}
+    if not question_terms:
+        return False
+    context_terms = set(tokenize(context))
+    return len(question_terms & context_terms) / len(question_terms) >= float(os.getenv("CHAT_CONTEXT_REUSE_OVERLAP", "0.7"))
+
+
+async def areformulate_user_question(input_text: str, chat_history: List[str]) -> str:
+    """
+    Versión asíncrona de reformulate_user_question.
+    """
+    
+    prompt_user = reformulation_prompt(input_text, chat_history)
+    if prompt_user is None:
+        return input_text
+
+    response = await allm_response(
         prompt_system=GET_CONTEXT_PROMPT_SYSTEM,
         prompt_user=prompt_user
-    ).choices[0].message.content
+    )
+    return response.choices[0].message.content
 
-    return llm_answer
+
+def chatbot_prompt(user_question: str, vectorstore, top_k: int, fetch_k: int) -> str:
+    """
+    Recupera los documentos relevantes y construye el prompt del chatbot.
+
+    Args:
+        user_question (str): Pregunta reformulada del usuario
+        vectorstore: Instancia del almacén de vectores FAISS
+        top_k (int): Número de documentos a retornar
+        fetch_k (int): Número de documentos a recuperar antes de filtrar
+
+    Returns:
+        str: Prompt de usuario con la pregunta y el contexto recuperado
+    """
+    
+    return CHATBOT_PROMPT_USER.format(
+        question=user_question,
+        context=chatbot_context(user_question, vectorstore, top_k, fetch_k)
+    )
+
+
+def chatbot_context(user_question: str, vectorstore, top_k: int, fetch_k: int) -> str:
+    """
+    Recupera los documentos relevantes para una pregunta y construye el contexto del chatbot.
+
+    Args:
+        user_question (str): Pregunta reformulada del usuario
+        vectorstore: Instancia del almacén de vectores FAISS
+        top_k (int): Número de documentos a retornar
+        fetch_k (int): Número de documentos a recuperar antes de filtrar
+
+    Returns:
+        str: Contexto recuperado
+    """
+    
+    top_documents = extract_top_documents(vectorstore, prompt_request=user_question, top_k=top_k, fetch_k=fetch_k)
+
+    # Context trimmed to what fits in LLM_MAX_PROMPT_TOKENS, dropping the least relevant chunks first
+    max_context_tokens = context_token_budget(CHATBOT_PROMPT_SYSTEM, CHATBOT_PROMPT_USER.format(question=user_question, context=""))
+    return parse_document(top_documents, max_tokens=max_context_tokens)
 
 
 def generate_chatbot_response(user_question: str, vectorstore, top_k: int, fetch_k: int):
@@ -96,13 +274,7 @@ def generate_chatbot_response(user_question: str, vectorstore, top_k: int, fetch
     Returns:
         dict: Respuesta del modelo LLM en formato streaming
     """    
-    top_documents = extract_top_documents(vectorstore, prompt_request=user_question, top_k=top_k, fetch_k=fetch_k)
-    llm_context = parse_document(top_documents)
-
-    prompt_user = CHATBOT_PROMPT_USER.format(
-        question=user_question,
-        context=llm_context
-    )
+    prompt_user = chatbot_prompt(user_question, vectorstore, top_k, fetch_k)
     return llm_response(
         prompt_system=CHATBOT_PROMPT_SYSTEM,
         prompt_user=prompt_user,
@@ -0,0 +1,100 @@
+import os
+
+from langchain_text_splitters import RecursiveCharacterTextSplitter
+
+from utils import count_tokens
+
+
+# Boundaries tried in order: section headings of a tender document first, then paragraphs,
+# lines, sentences and words.
+HEADING_SEPARATORS = [
+    r"\n(?=(?:CAPÍTULO|Capítulo|CAPITULO|Capitulo|TÍTULO|Título|TITULO|Titulo)\s+\w+)",
+    r"\n(?=(?:CLÁUSULA|Cláusula|CLAUSULA|Clausula|ARTÍCULO|Artículo|ARTICULO|Articulo|ANEXO|Anexo)\s+\w+)",
+    r"\n(?=\d{1,2}(?:\.\d{1,2})*\.?\s+[A-ZÁÉÍÓÚÑ][A-ZÁÉÍÓÚÑ ,]{3,})",
+    r"\n\n",
+    r"\n",
+    r"\. ",
+    r" ",
+    r"",
+]
+
+# Default chunk size and overlap of each strategy (characters or tokens, see length function)
+CHUNKING_STRATEGIES = {
+    "characters": {"chunk_size": 4500, "chunk_overlap": 1000},
+    "tokens": {"chunk_size": 800, "chunk_overlap": 80},
+}
+
+
+def get_chunking_config(strategy=None, chunk_size=None, chunk_overlap=None) -> dict:
+    """
+    Retorna la configuración de fragmentación a utilizar.
+
+    Los valores no indicados se toman de las variables de entorno CHUNKING_STRATEGY,
+    CHUNK_SIZE y CHUNK_OVERLAP y, en su defecto, de los valores por defecto de la estrategia.
+
+    Args:
+        strategy (str, optional): 'characters' (fragmentos de tamaño fijo en caracteres) o
+            'tokens' (fragmentos medidos en tokens que respetan cláusulas y apartados)
+        chunk_size (int, optional): Tamaño máximo de cada fragmento
+        chunk_overlap (int, optional): Solapamiento entre fragmentos consecutivos
+
+    Returns:
+        dict: Diccionario con 'strategy', 'chunk_size' y 'chunk_overlap'
+
+    Raises:
+        ValueError: Si la estrategia no existe
+    """
+
+    strategy = strategy or os.getenv("CHUNKING_STRATEGY", "characters")
+    if strategy not in CHUNKING_STRATEGIES:
+        raise ValueError(f"Estrategia de fragmentación desconocida: '{strategy}'")
+    defaults = CHUNKING_STRATEGIES[strategy]
+    return {
+        "strategy": strategy,
+        "chunk_size": int(chunk_size or os.getenv("CHUNK_SIZE") or defaults["chunk_size"]),
+        "chunk_overlap": int(chunk_overlap if chunk_overlap is not None else os.getenv("CHUNK_OVERLAP") or defaults["chunk_overlap"]),
+    }
+
+def chunking_identity(chunking_config: dict) -> str:
+    """
+    Retorna una cadena que identifica una configuración de fragmentación.
+
+    Args:
+        chunking_config (dict): Configuración retornada por get_chunking_config
+
+    Returns:
+        str: Identificador (p. ej. 'tokens-800-80')
+    """
+
+    return f"{chunking_config['strategy']}-{chunking_config['chunk_size']}-{chunking_config['chunk_overlap']}"
+
+def get_text_splitter(chunking_config: dict) -> RecursiveCharacterTextSplitter:
+    """
+    Construye el divisor de texto de una configuración de fragmentación.
+
+    Ambas estrategias guardan en los metadatos de cada fragmento la página de origen
+    (heredada del documento de la página) y su posición en ella ('start_index').
+
+    Args:
+        chunking_config (dict): Configuración retornada por get_chunking_config
+
+    Returns:
+        RecursiveCharacterTextSplitter: Divisor de texto configurado
+    """
+
+    if chunking_config["strategy"] == "tokens":
+        return RecursiveCharacterTextSplitter(
+            chunk_size=chunking_config["chunk_size"],
+            chunk_overlap=chunking_config["chunk_overlap"],
+            length_function=count_tokens,
+            separators=HEADING_SEPARATORS,
+            is_separator_regex=True,
+            add_start_index=True,
+        )
+    return RecursiveCharacterTextSplitter(
+        chunk_size=chunking_config["chunk_size"],
+        chunk_overlap=chunking_config["chunk_overlap"],
+        length_function=len,
+        is_separator_regex=False,
+        add_start_index=True,
+    )
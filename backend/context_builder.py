@@ -0,0 +1,204 @@
+import os
+import threading
+from typing import List
+
+from langchain_core.documents import Document
+
+from utils import count_tokens, truncate_tokens
+
+
+def merge_spans(docs: List[Document]) -> List[dict]:
+    """
+    Reconstruye los tramos de texto originales a partir de fragmentos recuperados.
+
+    Los fragmentos de una misma página que son adyacentes o se solapan (por el solapamiento
+    del divisor de texto) se fusionan en un único tramo sin repetir el texto común. Los
+    fragmentos sin posición en los metadatos (vectorstores antiguos) se conservan como
+    tramos independientes, descartando los duplicados o contenidos en otro tramo.
+
+    Args:
+        docs (List[Document]): Fragmentos recuperados, ordenados por relevancia
+
+    Returns:
+        List[dict]: Tramos ordenados por posición en el documento, con las claves 'text',
+            'page', 'start' y 'rank' (mejor posición de relevancia de sus fragmentos)
+    """
+
+    positioned, unpositioned = [], []
+    for rank, doc in enumerate(docs):
+        page, start = doc.metadata.get("page"), doc.metadata.get("start_index")
+        if page is not None and start is not None and start >= 0:
+            positioned.append({"text": doc.page_content, "page": page, "start": start, "rank": rank})
+        else:
+            unpositioned.append({"text": doc.page_content, "page": page, "start": None, "rank": rank})
+
+    spans = []
+    for chunk in sorted(positioned, key=lambda chunk: (chunk["page"], chunk["start"])):
+        if spans and spans[-1]["page"] == chunk["page"] and chunk["start"] <= spans[-1]["start"] + len(spans[-1]["text"]):
+            span = spans[-1]
+            span_end = span["start"] + len(span["text"])
+            chunk_end = chunk["start"] + len(chunk["text"])
+            if chunk_end > span_end:
+                span["text"] += chunk["text"][span_end - chunk["start"]:]
+            span["rank"] = min(span["rank"], chunk["rank"])
+        else:
+            spans.append(dict(chunk))
+
+    for chunk in unpositioned:
+        if not any(chunk["text"] in span["text"] for span in spans):
+            spans.append(chunk)
+    return spans
+
+def build_context(docs: List[Document], max_tokens: int = None) -> str:
+    """
+    Construye el contexto para el LLM a partir de los fragmentos recuperados.
+
+    Fusiona los fragmentos solapados en tramos (ver merge_spans), selecciona los tramos por
+    orden de relevancia mientras quepan en el presupuesto de tokens y los devuelve en el
+    orden en que aparecen en el documento. Si el tramo más relevante no cabe por sí solo,
+    se recorta al presupuesto.
+
+    Args:
+        docs (List[Document]): Fragmentos recuperados, ordenados por relevancia
+        max_tokens (int, optional): Presupuesto de tokens del contexto. Por defecto se toma
+            de CONTEXT_MAX_TOKENS (0 o ausente para no limitar)
+
+    Returns:
+        str: Contexto con los tramos seleccionados separados por saltos de línea
+    """
+
+    if max_tokens is None:
+        max_tokens = int(os.getenv("CONTEXT_MAX_TOKENS", "0"))
+    spans = merge_spans(docs)
+
+    if max_tokens > 0:
+        selected, used_tokens = set(), 0
+        for order, position in enumerate(sorted(range(len(spans)), key=lambda position: spans[position]["rank"])):
+            span_tokens = count_tokens(spans[position]["text"])
+            if used_tokens + span_tokens <= max_tokens:
+                selected.add(position)
+                used_tokens += span_tokens
+            elif order == 0:
+                # The most relevant span alone exceeds the budget: keep its beginning rather than an empty context
+                spans[position] = {**spans[position], "text": truncate_tokens(spans[position]["text"], max_tokens)}
+                selected.add(position)
+                used_tokens = max_tokens
+        spans = [span for position, span in enumerate(spans) if position in selected]
+
+    return "\n".join(span["text"] for span in spans)
+
+def context_token_budget(prompt_system: str, prompt_user_without_context: str, allowance: int = None):
+    """
+    Calcula cuántos tokens de contexto caben en una llamada al LLM.
+
+    El límite de la llamada es el menor entre LLM_MAX_PROMPT_TOKENS y la asignación del
+    presupuesto del documento ('allowance', ver TokenBudget); de él se descuentan los tokens
+    del prompt de sistema y del prompt de usuario sin contexto. CONTEXT_MAX_TOKENS, si está
+    definido, limita además el contexto por sí solo.
+
+    Args:
+        prompt_system (str): Prompt de sistema de la llamada
+        prompt_user_without_context (str): Prompt de usuario con el contexto vacío
+        allowance (int, optional): Tokens de prompt asignados a la llamada por el presupuesto
+            del documento
+
+    Returns:
+        int: Presupuesto de tokens del contexto (al menos 1), o None si no hay límite
+
+    Note:
+        Si el prompt sin contexto ya no cabe en el límite el presupuesto es 1, pero la
+        llamada seguiría superándolo: quien la envía debe comprobarlo (ver budgeted_llm_call).
+    """
+
+    prompt_limit = prompt_token_limit(allowance)
+    budgets = [int(os.getenv("CONTEXT_MAX_TOKENS", "0"))]
+    if prompt_limit is not None:
+        # At least 1 token, since 0 means no limit for parse_document
+        budgets.append(max(1, prompt_limit - count_tokens(prompt_system) - count_tokens(prompt_user_without_context)))
+    budgets = [budget for budget in budgets if budget > 0]
+    return min(budgets) if budgets else None
+
+
+class TokenBudgetExceeded(Exception):
+    """
+    El prompt de una llamada al LLM no cabe en los tokens que tiene asignados.
+    """
+
+
+def prompt_token_limit(allowance: int = None):
+    """
+    Retorna el máximo de tokens de prompt de una llamada: el menor entre LLM_MAX_PROMPT_TOKENS
+    y la asignación del presupuesto del documento, o None si no hay límite.
+    """
+
+    prompt_limits = [limit for limit in (int(os.getenv("LLM_MAX_PROMPT_TOKENS", "0")), allowance) if limit is not None and limit > 0]
+    if allowance is not None and allowance <= 0:
+        # The document budget is exhausted
+        prompt_limits.append(0)
+    return min(prompt_limits) if prompt_limits else None
+
+
+class TokenBudget:
+    """
+    Presupuesto de tokens de prompt compartido por las llamadas al LLM de un documento.
+
+    Cada llamada reserva una parte proporcional de lo que queda (reserve) y, al terminar,
+    liquida lo que ha usado (release): lo no usado queda disponible para las siguientes
+    llamadas y un exceso se descuenta de ellas. Es seguro usarlo desde varios hilos. La
+    suma de los tokens usados solo se mantiene dentro del total si las llamadas no superan
+    su asignación (budgeted_llm_call no envía las que la superan).
+
+    Las llamadas no previstas de una llamada (p. ej. los reintentos individuales de las
+    variables de un grupo) se presupuestan con split, contra la parte de esa llamada y no
+    contra la de las siguientes.
+
+    Args:
+        max_tokens (int): Tokens de prompt disponibles para el documento (0 para no limitar)
+        calls (int): Número de llamadas previstas
+    """
+
+    def __init__(self, max_tokens: int, calls: int):
+        self.max_tokens = max_tokens
+        self.remaining = max_tokens
+        self.calls_left = calls
+        self.limited = max_tokens > 0
+        self._parent = None
+        self._parent_allowance = None
+        self._lock = threading.Lock()
+
+    def split(self, calls: int = 1) -> "TokenBudget":
+        """
+        Reserva la parte de una llamada y la convierte en un presupuesto propio para
+        'calls' llamadas, ampliable con add_calls. close devuelve lo no usado.
+        """
+
+        allowance = self.reserve()
+        share = TokenBudget(allowance or 0, calls)
+        # An exhausted share (allowance 0) is still a limit, unlike max_tokens=0
+        share.limited = allowance is not None
+        share._parent, share._parent_allowance = self, allowance
+        return share
+
+    def add_calls(self, calls: int):
+        with self._lock:
+            self.calls_left += calls
+
+    def close(self):
+        if self._parent is not None:
+            self._parent.release(self._parent_allowance, self.max_tokens - self.remaining)
+
+    def reserve(self):
+        if not self.limited:
+            return None
+        with self._lock:
+            allowance = max(self.remaining, 0) // max(self.calls_left, 1)
+            self.remaining -= allowance
+            self.calls_left = max(self.calls_left - 1, 0)
+            return allowance
+
+    def release(self, allowance, used_tokens: int):
+        if allowance is None:
+            return
+        with self._lock:
+            # Unused tokens go back to the budget and overruns are charged to the next calls
+            self.remaining += allowance - used_tokens
@@ -0,0 +1,129 @@
+import os
+import time
+import sqlite3
+import hashlib
+import threading
+from typing import List
+
+import numpy as np
+
+from utils import embeddings_model_name
+from metrics import increment
+
+
+EMBEDDINGS_CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', "embeddings_cache")
+CHUNK_EMBEDDINGS_DB = os.path.join(EMBEDDINGS_CACHE_DIR, "chunk_embeddings.sqlite")
+
+# SQLite limits the number of bound parameters per statement
+_SQL_BATCH_SIZE = 500
+
+_schema_lock = threading.Lock()
+_schema_ready = False
+
+
+def _connect() -> sqlite3.Connection:
+    global _schema_ready
+    os.makedirs(EMBEDDINGS_CACHE_DIR, exist_ok=True)
+    connection = sqlite3.connect(CHUNK_EMBEDDINGS_DB, timeout=30)
+    with _schema_lock:
+        if not _schema_ready:
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS embeddings ("
+                "text_hash TEXT NOT NULL, model TEXT NOT NULL, vector BLOB NOT NULL, last_used REAL NOT NULL, "
+                "PRIMARY KEY (text_hash, model))"
+            )
+            connection.execute("CREATE INDEX IF NOT EXISTS embeddings_last_used ON embeddings (last_used)")
+            connection.commit()
+            _schema_ready = True
+    return connection
+
+def text_hash(text: str) -> str:
+    """
+    Calcula el hash SHA-256 de un fragmento de texto.
+
+    Args:
+        text (str): Texto del fragmento
+
+    Returns:
+        str: Hash hexadecimal del texto
+    """
+
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+def embed_documents_cached(embeddings_model, texts: List[str], store: bool = True) -> List[List[float]]:
+    """
+    Retorna los embeddings de una lista de fragmentos, consultando antes la caché local.
+
+    La caché (SQLite en 'embeddings_cache/chunk_embeddings.sqlite') está indexada por el hash
+    del texto y el modelo de embeddings, por lo que el texto repetido entre documentos
+    (cláusulas legales comunes, reediciones de una misma licitación) solo se embebe una vez.
+    Únicamente los fragmentos que no están en la caché se envían a la API, en una sola llamada.
+
+    Args:
+        embeddings_model: Modelo de embeddings a utilizar
+        texts (List[str]): Fragmentos de texto a embeber
+        store (bool, optional): Si es False, los textos que no están en la caché se embeben
+            pero no se guardan (p. ej. textos de evaluación que no son fragmentos de
+            documentos). Por defecto es True
+
+    Returns:
+        List[List[float]]: Un vector por fragmento, en el mismo orden que 'texts'
+
+    Note:
+        El tamaño de la caché se limita con EMBEDDING_CACHE_MAX_ENTRIES; al superarlo se
+        eliminan las entradas usadas hace más tiempo.
+    """
+
+    if not texts:
+        return []
+
+    model = embeddings_model_name(embeddings_model)
+    hashes = [text_hash(text) for text in texts]
+    unique_hashes = list(dict.fromkeys(hashes))
+    now = time.time()
+
+    connection = _connect()
+    try:
+        vectors = {}
+        for start in range(0, len(unique_hashes), _SQL_BATCH_SIZE):
+            batch = unique_hashes[start:start + _SQL_BATCH_SIZE]
+            placeholders = ",".join("?" * len(batch))
+            rows = connection.execute(
+                f"SELECT text_hash, vector FROM embeddings WHERE model = ? AND text_hash IN ({placeholders})",
+                [model, *batch],
+            ).fetchall()
+            vectors.update((row_hash, np.frombuffer(vector, dtype=np.float32).tolist()) for row_hash, vector in rows)
+
+        connection.executemany(
+            "UPDATE embeddings SET last_used = ? WHERE model = ? AND text_hash = ?",
+            [(now, model, cached_hash) for cached_hash in vectors],
+        )
+
+        # Embed only the texts that are not cached yet (each distinct text once)
+        missing = {hash_: text for hash_, text in zip(hashes, texts) if hash_ not in vectors}
+        increment("rag_embedding_cache_lookups_total", len(unique_hashes) - len(missing), result="hit")
+        increment("rag_embedding_cache_lookups_total", len(missing), result="miss")
+        if missing:
+            new_vectors = embeddings_model.embed_documents(list(missing.values()))
+            vectors.update(zip(missing.keys(), new_vectors))
+            if store:
+                connection.executemany(
+                    "INSERT OR REPLACE INTO embeddings (text_hash, model, vector, last_used) VALUES (?, ?, ?, ?)",
+                    [(missing_hash, model, np.asarray(vector, dtype=np.float32).tobytes(), now) for missing_hash, vector in zip(missing.keys(), new_vectors)],
+                )
+                _evict(connection)
+        connection.commit()
+    finally:
+        connection.close()
+
+    return [vectors[hash_] for hash_ in hashes]
+
+def _evict(connection: sqlite3.Connection):
+    max_entries = int(os.getenv("EMBEDDING_CACHE_MAX_ENTRIES", "500000"))
+    (entries,) = connection.execute("SELECT COUNT(*) FROM embeddings").fetchone()
+    if entries > max_entries:
+        connection.execute(
+            "DELETE FROM embeddings WHERE rowid IN (SELECT rowid FROM embeddings ORDER BY last_used LIMIT ?)",
+            (entries - max_entries,),
+        )
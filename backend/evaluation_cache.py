@@ -0,0 +1,109 @@
+import os
+import json
+import math
+import time
+import sqlite3
+import hashlib
+import threading
+from typing import Dict, List, Tuple
+
+
+EVALUATION_CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', "evaluation_cache")
+SCORES_DB = os.path.join(EVALUATION_CACHE_DIR, "sample_scores.sqlite")
+
+# SQLite limits the number of bound parameters per statement
+_SQL_BATCH_SIZE = 500
+
+_schema_lock = threading.Lock()
+_schema_ready = False
+
+
+def _connect() -> sqlite3.Connection:
+    global _schema_ready
+    os.makedirs(EVALUATION_CACHE_DIR, exist_ok=True)
+    connection = sqlite3.connect(SCORES_DB, timeout=30)
+    with _schema_lock:
+        if not _schema_ready:
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS scores ("
+                "sample_hash TEXT NOT NULL, metric TEXT NOT NULL, metric_version TEXT NOT NULL, "
+                "score REAL NOT NULL, created REAL NOT NULL, "
+                "PRIMARY KEY (sample_hash, metric, metric_version))"
+            )
+            connection.commit()
+            _schema_ready = True
+    return connection
+
+def sample_hash(sample) -> str:
+    """
+    Calcula el hash del contenido de una muestra de evaluación.
+
+    Args:
+        sample (SingleTurnSample): Muestra con pregunta, contextos, respuesta y referencia
+
+    Returns:
+        str: Hash SHA-256 de la muestra serializada de forma canónica
+    """
+
+    serialized = json.dumps(sample.model_dump(), sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(serialized.encode("utf-8")).hexdigest()
+
+def load_scores(sample_hashes: List[str], metric_versions: Dict[str, str]) -> Dict[Tuple[str, str], float]:
+    """
+    Carga las puntuaciones ya calculadas de un conjunto de muestras.
+
+    Args:
+        sample_hashes (List[str]): Hashes de las muestras
+        metric_versions (Dict[str, str]): Diccionario métrica -> versión vigente
+
+    Returns:
+        Dict[Tuple[str, str], float]: Diccionario (hash de la muestra, métrica) -> puntuación,
+            solo para las métricas en su versión vigente
+    """
+
+    unique_hashes = list(dict.fromkeys(sample_hashes))
+    scores = {}
+    connection = _connect()
+    try:
+        for start in range(0, len(unique_hashes), _SQL_BATCH_SIZE):
+            batch = unique_hashes[start:start + _SQL_BATCH_SIZE]
+            placeholders = ",".join("?" * len(batch))
+            rows = connection.execute(
+                f"SELECT sample_hash, metric, metric_version, score FROM scores WHERE sample_hash IN ({placeholders})",
+                batch,
+            ).fetchall()
+            scores.update(
+                ((row_hash, metric), score)
+                for row_hash, metric, version, score in rows
+                if metric_versions.get(metric) == version
+            )
+    finally:
+        connection.close()
+    return scores
+
+def save_scores(scores: Dict[Tuple[str, str], float], metric_versions: Dict[str, str]):
+    """
+    Guarda las puntuaciones calculadas. Las puntuaciones no válidas (NaN, p. ej. por un
+    fallo del LLM evaluador) no se guardan para que se recalculen en la siguiente evaluación.
+
+    Args:
+        scores (Dict[Tuple[str, str], float]): Diccionario (hash de la muestra, métrica) -> puntuación
+        metric_versions (Dict[str, str]): Diccionario métrica -> versión vigente
+    """
+
+    now = time.time()
+    rows = [
+        (hash_, metric, metric_versions[metric], float(score), now)
+        for (hash_, metric), score in scores.items()
+        if score is not None and not math.isnan(score)
+    ]
+    connection = _connect()
+    try:
+        with connection:
+            connection.executemany(
+                "INSERT OR REPLACE INTO scores (sample_hash, metric, metric_version, score, created) VALUES (?, ?, ?, ?, ?)",
+                rows,
+            )
+    finally:
+        connection.close()
@@ -1,9 +1,11 @@
 import json
 import os
-import pickle
+import hashlib
+from functools import lru_cache
 import pandas as pd
 from langchain_openai import ChatOpenAI
-from ragas import evaluate, EvaluationDataset # funcion para evaluar
+import ragas
+from ragas import evaluate, EvaluationDataset, RunConfig, SingleTurnSample # funcion para evaluar
 from ragas.llms import LangchainLLMWrapper # evaluador llm
 from ragas.embeddings import LangchainEmbeddingsWrapper
 from ragas.metrics._context_recall import ContextRecallClassification
@@ -15,10 +17,14 @@ from ragas.metrics import (
     SemanticSimilarity,
 )
 
-from utils import get_embeddings_model, load_secrets
+from utils import get_embeddings_model, load_secrets, load_json_config, embeddings_model_name
+from evaluation_cache import sample_hash, load_scores, save_scores
+from trace_store import list_runs, load_run_samples
 
 load_secrets([".env.file", ".env.secrets"])
 
+EVALUATOR_MODEL = "gpt-4o-mini"
+
 def load_ground_truth(file_name: str):
     """
     Carga los datos de validación desde un archivo JSON.
@@ -27,27 +33,28 @@ def load_ground_truth(file_name: str):
         file_name (str): Nombre del archivo de validación
 
     Returns:
-        dict: Datos de validación para el archivo especificado
+        dict: Datos de validación para el archivo especificado (vacío si el archivo no
+            tiene datos de validación)
     """    
    
    
-    with open("backend/validation.json", "r", encoding="utf-8") as f:
-        json_data = json.load(f)
+    json_data = load_json_config("validation.json")
         
-    json_data = json_data[file_name]["details"]
+    json_data = json_data.get(file_name, {}).get("details", {})
         
     return json_data
 
 
+@lru_cache(maxsize=None)
 def evaluator_llm():
     """
-    Inicializa el modelo LLM evaluador.
+    Inicializa el modelo LLM evaluador (una única vez por proceso).
 
     Returns:
         LangchainLLMWrapper: Instancia del modelo evaluador configurado
     """
     
-    evaluator_llm = LangchainLLMWrapper(ChatOpenAI(model="gpt-4o-mini", temperature=0))
+    evaluator_llm = LangchainLLMWrapper(ChatOpenAI(model=EVALUATOR_MODEL, temperature=0))
     return evaluator_llm
 
 def semantic_similarity_metric():
@@ -276,45 +283,132 @@ def response_relevancy_metric():
     return scorer
 
 
-def rag_system_evaluation() -> pd.DataFrame:
+@lru_cache(maxsize=None)
+def evaluation_metrics() -> tuple:
+    """
+    Construye una única vez por proceso las métricas de evaluación (con sus prompts en español).
+
+    Returns:
+        tuple: Métricas de similitud semántica, recall, precisión, fidelidad y relevancia
+    """
+
+    return (
+        semantic_similarity_metric(),
+        context_recall_metric(),
+        context_precision_metric(),
+        faithfulness_metric(),
+        response_relevancy_metric(),
+    )
+
+def metric_version(metric) -> str:
+    """
+    Calcula la versión de una métrica a partir de todo lo que influye en su puntuación:
+    la versión de ragas, el LLM evaluador, el modelo de embeddings y sus prompts.
+
+    Args:
+        metric: Métrica de ragas
+
+    Returns:
+        str: Hash que cambia cuando cambia la configuración de la métrica
+    """
+
+    prompts = metric.get_prompts() if hasattr(metric, "get_prompts") else {}
+    description = {
+        "metric": metric.name,
+        "ragas": ragas.__version__,
+        "llm": EVALUATOR_MODEL,
+        "embeddings": embeddings_model_name(get_embeddings_model()) if hasattr(metric, "embeddings") else None,
+        "prompts": {
+            name: [prompt.language, prompt.instruction, repr(prompt.examples)]
+            for name, prompt in sorted(prompts.items())
+        },
+    }
+    return hashlib.sha256(json.dumps(description, sort_keys=True, ensure_ascii=False, default=str).encode("utf-8")).hexdigest()
+
+def score_samples(samples) -> pd.DataFrame:
+    """
+    Puntúa un conjunto de muestras con todas las métricas, reutilizando las puntuaciones guardadas.
+
+    Cada puntuación se guarda en la caché de evaluación (ver evaluation_cache.py) indexada por
+    el contenido de la muestra y la versión de la métrica, de modo que solo se evalúan las
+    muestras nuevas o modificadas y las métricas cuya configuración ha cambiado. Las muestras
+    pendientes (de uno o varios documentos) se evalúan juntas, con las llamadas al LLM
+    evaluador en paralelo.
+
+    Args:
+        samples (List[SingleTurnSample]): Muestras a evaluar
+
+    Returns:
+        pd.DataFrame: Una fila por muestra con sus campos y una columna por métrica
+
+    Note:
+        El número máximo de llamadas simultáneas al LLM evaluador se configura con
+        EVALUATION_MAX_WORKERS.
+    """
+
+    metrics = evaluation_metrics()
+    metric_versions = {metric.name: metric_version(metric) for metric in metrics}
+    sample_hashes = [sample_hash(sample) for sample in samples]
+    scores = load_scores(sample_hashes, metric_versions)
+
+    # Pending samples grouped by the metrics they are missing (each distinct sample once)
+    pending = {}
+    for hash_, sample in zip(sample_hashes, samples):
+        missing_metrics = tuple(metric.name for metric in metrics if (hash_, metric.name) not in scores)
+        if missing_metrics:
+            pending.setdefault(missing_metrics, {})[hash_] = sample
+
+    run_config = RunConfig(max_workers=int(os.getenv("EVALUATION_MAX_WORKERS", "8")))
+    for missing_metrics, pending_samples in pending.items():
+        results = evaluate(
+            dataset=EvaluationDataset(samples=list(pending_samples.values())),
+            metrics=[metric for metric in metrics if metric.name in missing_metrics],
+            llm=evaluator_llm(),
+            run_config=run_config,
+        )
+        new_scores = {
+            (hash_, metric_name): sample_scores.get(metric_name)
+            for hash_, sample_scores in zip(pending_samples, results.scores)
+            for metric_name in missing_metrics
+        }
+        save_scores(new_scores, metric_versions)
+        scores.update(new_scores)
+
+    return pd.DataFrame([
+        {**sample.model_dump(), **{metric.name: scores.get((hash_, metric.name)) for metric in metrics}}
+        for hash_, sample in zip(sample_hashes, samples)
+    ])
+
+def rag_system_evaluation(run_ids=None) -> pd.DataFrame:
     """
     Realiza una evaluación completa del sistema RAG utilizando múltiples métricas.
 
     Esta función coordina la evaluación del sistema RAG utilizando diferentes métricas
     incluyendo similitud semántica, recall, precisión, fidelidad y relevancia.
+    Solo se evalúan las muestras que no se hayan puntuado antes (ver score_samples).
+
+    Args:
+        run_ids (List[str], optional): Ejecuciones del registro de trazas a evaluar (ver
+            trace_store.py). Por defecto, la ejecución más reciente
         
     Returns:
         pd.DataFrame: DataFrame con los resultados de la evaluación.    
        
     """
-    semantic = semantic_similarity_metric()
-    recall = context_recall_metric()
-    precision = context_precision_metric()
-    faith = faithfulness_metric()
-    relevancy = response_relevancy_metric()
-    
-    # Cargar la lista desde el archivo
-    with open("rag_result.pkl", "rb") as f:
-        evaluation_dataset = pickle.load(f)
-
-    dataset = EvaluationDataset(samples=evaluation_dataset)
-    
-    llm_evaluador = evaluator_llm()
-    
-        
-    results = evaluate(
-        dataset=dataset,
-        metrics=[
-                 semantic, 
-                 recall, 
-                 precision, 
-                 faith,
-                 relevancy
-            ],
-        llm=llm_evaluador,      
-    )
-    
     
-    evaluacion = results.to_pandas()
+    if not run_ids:
+        runs = list_runs()
+        if not runs:
+            raise ValueError("No hay ejecuciones registradas para evaluar")
+        run_ids = [runs[-1]["run_id"]]
+
+    # Samples without a reference answer (documents missing from 'validation.json') cannot be scored
+    records = [record for record in load_run_samples(run_ids) if record["sample"].get("reference")]
+    if not records:
+        raise ValueError(f"Las ejecuciones {run_ids} no tienen muestras con respuesta de referencia")
+    evaluation_dataset = [SingleTurnSample(**record["sample"]) for record in records]
+
+    evaluacion = score_samples(evaluation_dataset)
+    evaluacion.insert(0, "run_id", [record["run_id"] for record in records])
     
     return "Evaluación realizada con éxito"
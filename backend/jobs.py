@@ -0,0 +1,192 @@
+import os
+import json
+import time
+import uuid
+import threading
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+
+from tender_extractor import tender_data_extractor
+
+
+JOBS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', "jobs")
+
+# Job states
+QUEUED = "queued"
+RUNNING = "running"
+COMPLETED = "completed"
+FAILED = "failed"
+CANCELLED = "cancelled"
+
+_jobs = {}
+_jobs_lock = threading.Lock()
+_executor = None
+_executor_lock = threading.Lock()
+
+
+class JobCancelled(Exception):
+    """
+    Se lanza dentro de un trabajo de extracción cuando se solicita su cancelación.
+    """
+
+
+def _get_executor() -> ThreadPoolExecutor:
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=int(os.getenv("EXTRACTION_JOB_WORKERS", "2")),
+                thread_name_prefix="extraction-job",
+            )
+        return _executor
+
+def _evict_finished_jobs(now: float):
+    # Finished jobs are dropped from memory after a while; get_job serves them from 'jobs/<id>.json'
+    ttl_seconds = float(os.getenv("JOBS_FINISHED_TTL_SECONDS", "600"))
+    max_finished = int(os.getenv("JOBS_MAX_FINISHED", "100"))
+    finished = sorted((job for job in _jobs.values() if job.get("_persisted")), key=lambda job: job["finished_at"])
+    excess = len(finished) - max_finished
+    for position, job in enumerate(finished):
+        if position < excess or now - job["finished_at"] > ttl_seconds:
+            del _jobs[job["job_id"]]
+
+def _public_view(job: dict) -> dict:
+    return {field: value for field, value in job.items() if not field.startswith("_")}
+
+def _persist(job: dict):
+    os.makedirs(JOBS_DIR, exist_ok=True)
+    job_path = os.path.join(JOBS_DIR, f"{job['job_id']}.json")
+    tmp_path = f"{job_path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(_public_view(job), f, ensure_ascii=False, indent=2)
+    os.replace(tmp_path, job_path)
+
+def submit_extraction_job(pdf_file_path: str, file_name: str, cleanup=None, **extractor_kwargs):
+    """
+    Encola la extracción de un PDF en el pool de trabajos de extracción.
+
+    Los trabajos se ejecutan en orden de llegada con un máximo de EXTRACTION_JOB_WORKERS
+    extracciones simultáneas, de modo que las subidas concurrentes no bloquean el servidor.
+
+    Args:
+        pdf_file_path (str): Ruta al archivo PDF de la licitación
+        file_name (str): Nombre original del archivo subido (el PDF puede tener un nombre temporal)
+        cleanup (callable, optional): Función a ejecutar al terminar el trabajo (p. ej. borrar el PDF)
+        **extractor_kwargs: Argumentos adicionales para tender_data_extractor
+
+    Returns:
+        tuple: (id del trabajo, Future con el resultado de la extracción)
+    """
+
+    job_id = uuid.uuid4().hex
+    job = {
+        "job_id": job_id,
+        "file_name": file_name,
+        "status": QUEUED,
+        "progress": {"completed": 0, "total": None, "stage": None},
+        "result": None,
+        "usage": None,
+        "error": None,
+        "created_at": time.time(),
+        "started_at": None,
+        "finished_at": None,
+        "_cancel": threading.Event(),
+    }
+    with _jobs_lock:
+        _evict_finished_jobs(time.time())
+        _jobs[job_id] = job
+    # The job runs in the caller's context, so its stages show up in the request log
+    context = contextvars.copy_context()
+    job["_future"] = _get_executor().submit(context.run, _run_job, job, pdf_file_path, cleanup, extractor_kwargs)
+    return job_id, job["_future"]
+
+def _run_job(job: dict, pdf_file_path: str, cleanup, extractor_kwargs: dict):
+    def on_progress(event: dict):
+        if job["_cancel"].is_set():
+            raise JobCancelled()
+        if event["stage"] == "usage":
+            job["usage"] = {field: value for field, value in event.items() if field != "stage"}
+        job["progress"] = {
+            "completed": event.get("completed", job["progress"]["completed"]),
+            "total": event.get("total", job["progress"]["total"]),
+            "stage": event["stage"],
+        }
+        user_callback = extractor_kwargs.get("progress_callback")
+        if user_callback is not None:
+            user_callback(event)
+
+    try:
+        if job["_cancel"].is_set():
+            raise JobCancelled()
+        job["status"] = RUNNING
+        job["started_at"] = time.time()
+        job["result"] = tender_data_extractor(
+            pdf_file_path, **{**extractor_kwargs, "progress_callback": on_progress, "file_name": job["file_name"]}
+        )
+        job["status"] = COMPLETED
+        return job["result"]
+    except JobCancelled:
+        job["status"] = CANCELLED
+        raise
+    except Exception as e:
+        job["status"] = FAILED
+        job["error"] = str(e)
+        raise
+    finally:
+        try:
+            job["finished_at"] = time.time()
+            _persist(job)
+            with _jobs_lock:
+                job["_persisted"] = True
+                _evict_finished_jobs(time.time())
+        finally:
+            # The PDF is removed even if the job could not be written to disk (it then stays in memory)
+            if cleanup is not None:
+                cleanup()
+
+def get_job(job_id: str):
+    """
+    Retorna el estado, el progreso y, si ha terminado, el resultado de un trabajo.
+
+    Args:
+        job_id (str): Id del trabajo
+
+    Returns:
+        dict: Estado del trabajo, o None si no existe (ni en memoria ni persistido en 'jobs')
+
+    Note:
+        Los trabajos terminados se mantienen en memoria como máximo JOBS_FINISHED_TTL_SECONDS
+        segundos (y solo los JOBS_MAX_FINISHED más recientes); después se leen de disco.
+    """
+
+    with _jobs_lock:
+        job = _jobs.get(job_id)
+    if job is not None:
+        return _public_view(job)
+
+    job_path = os.path.join(JOBS_DIR, f"{os.path.basename(job_id)}.json")
+    if not os.path.exists(job_path):
+        return None
+    with open(job_path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+def cancel_job(job_id: str) -> bool:
+    """
+    Solicita la cancelación de un trabajo en cola o en ejecución.
+
+    Un trabajo en cola no llega a ejecutarse; uno en ejecución se detiene en el siguiente
+    punto de progreso (cada lote de páginas de la ingesta o cada variable).
+
+    Args:
+        job_id (str): Id del trabajo
+
+    Returns:
+        bool: True si el trabajo existía y no había terminado
+    """
+
+    with _jobs_lock:
+        job = _jobs.get(job_id)
+    if job is None or job["status"] in (COMPLETED, FAILED, CANCELLED):
+        return False
+    job["_cancel"].set()
+    return True
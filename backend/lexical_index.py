@@ -0,0 +1,140 @@
+import os
+import re
+import json
+import math
+import threading
+import unicodedata
+from collections import Counter
+from typing import List, Tuple
+
+import numpy as np
+
+
+LEXICAL_INDEX_FILE = "lexical_index.json"
+
+# BM25 parameters
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+
+def tokenize(text: str) -> List[str]:
+    """
+    Divide un texto en términos para el índice léxico (minúsculas y sin tildes).
+
+    Los números se conservan como términos, de modo que fechas, importes o códigos
+    pueden recuperarse por coincidencia exacta.
+
+    Args:
+        text (str): Texto a dividir
+
+    Returns:
+        List[str]: Términos del texto
+    """
+
+    text = unicodedata.normalize("NFKD", text.lower()).encode("ascii", "ignore").decode("ascii")
+    return re.findall(r"\w+", text)
+
+def build_lexical_index(vectorstore) -> dict:
+    """
+    Construye un índice invertido BM25 sobre los fragmentos de un vectorstore FAISS.
+
+    Args:
+        vectorstore (FAISS): vector store FAISS
+
+    Returns:
+        dict: Índice con los ids del docstore, la longitud de cada fragmento y las
+            listas de apariciones (posición del fragmento, frecuencia) de cada término
+    """
+
+    docstore_ids = [vectorstore.index_to_docstore_id[i] for i in range(len(vectorstore.index_to_docstore_id))]
+    doc_lengths = []
+    postings = {}
+    for position, docstore_id in enumerate(docstore_ids):
+        terms = tokenize(vectorstore.docstore.search(docstore_id).page_content)
+        doc_lengths.append(len(terms))
+        for term, frequency in Counter(terms).items():
+            postings.setdefault(term, []).append([position, frequency])
+    return {"docstore_ids": docstore_ids, "doc_lengths": doc_lengths, "postings": postings}
+
+def save_lexical_index(vectorstore_path: str, lexical_index: dict):
+    """
+    Guarda el índice léxico junto a los archivos del vectorstore.
+
+    Args:
+        vectorstore_path (str): Ruta de la carpeta del vectorstore
+        lexical_index (dict): Índice retornado por build_lexical_index
+    """
+
+    # Written aside and renamed, so a concurrent reader never sees a partial file
+    index_file = os.path.join(vectorstore_path, LEXICAL_INDEX_FILE)
+    tmp_file = f"{index_file}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp_file, "w", encoding="utf-8") as f:
+        json.dump(lexical_index, f)
+    os.replace(tmp_file, index_file)
+
+def load_lexical_index(vectorstore_path: str):
+    """
+    Carga el índice léxico guardado junto a un vectorstore.
+
+    Args:
+        vectorstore_path (str): Ruta de la carpeta del vectorstore
+
+    Returns:
+        dict: Índice léxico, o None si el vectorstore no tiene índice léxico
+    """
+
+    lexical_index_path = os.path.join(vectorstore_path, LEXICAL_INDEX_FILE)
+    if not os.path.exists(lexical_index_path):
+        return None
+    with open(lexical_index_path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+def bm25_search(lexical_index: dict, query: str, k: int) -> List[Tuple[str, float]]:
+    """
+    Busca los fragmentos con mayor puntuación BM25 para una consulta.
+
+    Args:
+        lexical_index (dict): Índice léxico
+        query (str): Consulta
+        k (int): Número de fragmentos a retornar
+
+    Returns:
+        List[Tuple[str, float]]: Pares (id del docstore, puntuación), de mayor a menor puntuación
+    """
+
+    doc_lengths = np.asarray(lexical_index["doc_lengths"], dtype=np.float32)
+    n_docs = len(doc_lengths)
+    if n_docs == 0:
+        return []
+    length_norm = BM25_K1 * (1 - BM25_B + BM25_B * doc_lengths / max(doc_lengths.mean(), 1))
+
+    scores = np.zeros(n_docs, dtype=np.float32)
+    for term in set(tokenize(query)):
+        term_postings = lexical_index["postings"].get(term)
+        if not term_postings:
+            continue
+        positions, frequencies = np.asarray(term_postings, dtype=np.float32).T
+        positions = positions.astype(np.int64)
+        idf = math.log(1 + (n_docs - len(term_postings) + 0.5) / (len(term_postings) + 0.5))
+        scores[positions] += idf * frequencies * (BM25_K1 + 1) / (frequencies + length_norm[positions])
+
+    top_positions = [position for position in np.argsort(-scores)[:k] if scores[position] > 0]
+    return [(lexical_index["docstore_ids"][position], float(scores[position])) for position in top_positions]
+
+def reciprocal_rank_fusion(rankings: List[List[str]], k: int = 60) -> List[str]:
+    """
+    Fusiona varias clasificaciones de fragmentos con Reciprocal Rank Fusion.
+
+    Args:
+        rankings (List[List[str]]): Listas de ids del docstore ordenadas por relevancia
+        k (int): Constante de suavizado de RRF. Por defecto 60
+
+    Returns:
+        List[str]: Ids del docstore ordenados por puntuación fusionada
+    """
+
+    scores = {}
+    for ranking in rankings:
+        for rank, docstore_id in enumerate(ranking):
+            scores[docstore_id] = scores.get(docstore_id, 0.0) + 1.0 / (k + rank + 1)
+    return sorted(scores, key=scores.get, reverse=True)
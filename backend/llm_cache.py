@@ -0,0 +1,179 @@
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+from collections import OrderedDict
+
+from metrics import increment
+
+
+LLM_CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', "llm_cache")
+LLM_CACHE_DB = os.path.join(LLM_CACHE_DIR, "llm_responses.sqlite")
+
+
+def cache_key(request: dict) -> str:
+    """
+    Calcula la clave de caché de una petición al LLM.
+
+    Args:
+        request (dict): Parámetros de la llamada a litellm (modelo, mensajes, temperatura, etc.)
+
+    Returns:
+        str: Hash SHA-256 de la petición serializada de forma canónica
+    """
+
+    return hashlib.sha256(json.dumps(request, sort_keys=True, ensure_ascii=False).encode("utf-8")).hexdigest()
+
+
+class MemoryLRUCache:
+    """
+    Caché en memoria del proceso con desalojo LRU y caducidad.
+
+    Args:
+        max_entries (int): Número máximo de respuestas guardadas
+        ttl_seconds (float): Segundos de validez de cada respuesta (0 para no caducar)
+    """
+
+    def __init__(self, max_entries: int, ttl_seconds: float):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            created, value = entry
+            if self.ttl_seconds and time.time() - created > self.ttl_seconds:
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key: str, value: dict):
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = (time.time(), value)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+
+class SQLiteCache:
+    """
+    Caché persistente en disco (SQLite) con desalojo LRU y caducidad.
+
+    Args:
+        max_entries (int): Número máximo de respuestas guardadas
+        ttl_seconds (float): Segundos de validez de cada respuesta (0 para no caducar)
+        db_path (str): Ruta de la base de datos SQLite
+    """
+
+    def __init__(self, max_entries: int, ttl_seconds: float, db_path: str = LLM_CACHE_DB):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.db_path = db_path
+        os.makedirs(os.path.dirname(db_path), exist_ok=True)
+        with self._connect() as connection:
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS responses ("
+                "key TEXT PRIMARY KEY, value TEXT NOT NULL, created REAL NOT NULL, last_used REAL NOT NULL)"
+            )
+            connection.execute("CREATE INDEX IF NOT EXISTS responses_last_used ON responses (last_used)")
+
+    def _connect(self) -> sqlite3.Connection:
+        return sqlite3.connect(self.db_path, timeout=30)
+
+    def get(self, key: str):
+        now = time.time()
+        connection = self._connect()
+        try:
+            with connection:
+                row = connection.execute("SELECT value, created FROM responses WHERE key = ?", (key,)).fetchone()
+                if row is None:
+                    return None
+                value, created = row
+                if self.ttl_seconds and now - created > self.ttl_seconds:
+                    connection.execute("DELETE FROM responses WHERE key = ?", (key,))
+                    return None
+                connection.execute("UPDATE responses SET last_used = ? WHERE key = ?", (now, key))
+            return json.loads(value)
+        finally:
+            connection.close()
+
+    def set(self, key: str, value: dict):
+        now = time.time()
+        connection = self._connect()
+        try:
+            with connection:
+                connection.execute(
+                    "INSERT OR REPLACE INTO responses (key, value, created, last_used) VALUES (?, ?, ?, ?)",
+                    (key, json.dumps(value, ensure_ascii=False, default=str), now, now),
+                )
+                (entries,) = connection.execute("SELECT COUNT(*) FROM responses").fetchone()
+                if entries > self.max_entries:
+                    connection.execute(
+                        "DELETE FROM responses WHERE key IN (SELECT key FROM responses ORDER BY last_used LIMIT ?)",
+                        (entries - self.max_entries,),
+                    )
+        finally:
+            connection.close()
+
+
+LLM_CACHE_BACKENDS = {
+    "memory": MemoryLRUCache,
+    "sqlite": SQLiteCache,
+}
+
+_cache = None
+_cache_lock = threading.Lock()
+_stats = {"hits": 0, "misses": 0}
+_stats_lock = threading.Lock()
+
+
+def get_llm_cache():
+    """
+    Retorna la caché de respuestas del LLM configurada en el entorno.
+
+    Note:
+        Se configura con las variables de entorno:
+        - LLM_CACHE_BACKEND: 'none' (por defecto), 'memory' o 'sqlite'
+        - LLM_CACHE_MAX_ENTRIES: Número máximo de respuestas guardadas
+        - LLM_CACHE_TTL_SECONDS: Segundos de validez de cada respuesta (0 para no caducar)
+
+    Returns:
+        Union[MemoryLRUCache, SQLiteCache]: Instancia de la caché, o None si está desactivada
+    """
+
+    global _cache
+    backend = os.getenv("LLM_CACHE_BACKEND", "none").lower()
+    if backend not in LLM_CACHE_BACKENDS:
+        return None
+    with _cache_lock:
+        if not isinstance(_cache, LLM_CACHE_BACKENDS[backend]):
+            _cache = LLM_CACHE_BACKENDS[backend](
+                max_entries=int(os.getenv("LLM_CACHE_MAX_ENTRIES", "10000")),
+                ttl_seconds=float(os.getenv("LLM_CACHE_TTL_SECONDS", "0")),
+            )
+        return _cache
+
+def record_lookup(hit: bool):
+    with _stats_lock:
+        _stats["hits" if hit else "misses"] += 1
+    increment("rag_llm_cache_lookups_total", result="hit" if hit else "miss")
+
+def llm_cache_stats() -> dict:
+    """
+    Retorna las estadísticas de uso de la caché de respuestas del LLM.
+
+    Returns:
+        dict: Aciertos, fallos y tasa de acierto
+    """
+
+    with _stats_lock:
+        lookups = _stats["hits"] + _stats["misses"]
+        return {**_stats, "hit_rate": _stats["hits"] / lookups if lookups else None}
@@ -0,0 +1,68 @@
+import re
+import hashlib
+import unicodedata
+from functools import lru_cache
+from typing import List
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+
+@lru_cache(maxsize=2 ** 20)
+def _feature_bucket(feature: str, dimensions: int):
+    digest = int.from_bytes(hashlib.blake2b(feature.encode("utf-8"), digest_size=8).digest(), "little")
+    return digest % dimensions, 1.0 if (digest >> 63) & 1 else -1.0
+
+def _features(text: str) -> List[str]:
+    text = unicodedata.normalize("NFKD", text.lower()).encode("ascii", "ignore").decode("ascii")
+    words = re.findall(r"\w+", text)
+    features = [f"w:{word}" for word in words]
+    for word in words:
+        padded = f"<{word}>"
+        features.extend(f"c:{padded[i:i + 3]}" for i in range(len(padded) - 2))
+    return features
+
+
+class HashingEmbeddings(Embeddings):
+    """
+    Modelo de embeddings local, determinista y solo CPU basado en feature hashing.
+
+    Cada texto se representa con sus palabras y trigramas de caracteres (sin tildes ni
+    mayúsculas), proyectados mediante hashing con signo a un vector de dimensión fija,
+    con ponderación logarítmica de frecuencias y normalización L2. No requiere red ni
+    modelos descargados, por lo que permite ejecutar y medir todo el sistema de recuperación
+    sin conexión.
+
+    Args:
+        dimensions (int): Dimensión de los vectores. Por defecto 1024
+        batch_size (int): Número de textos procesados por lote. Por defecto 256
+    """
+
+    def __init__(self, dimensions: int = 1024, batch_size: int = 256):
+        self.dimensions = dimensions
+        self.batch_size = batch_size
+        self.model = f"local-hashing-{dimensions}"
+
+    def _embed_batch(self, texts: List[str]) -> np.ndarray:
+        rows, columns, signs = [], [], []
+        for row, text in enumerate(texts):
+            for feature in _features(text):
+                column, sign = _feature_bucket(feature, self.dimensions)
+                rows.append(row)
+                columns.append(column)
+                signs.append(sign)
+
+        matrix = np.zeros((len(texts), self.dimensions), dtype=np.float32)
+        np.add.at(matrix, (np.array(rows, dtype=np.int64), np.array(columns, dtype=np.int64)), np.array(signs, dtype=np.float32))
+        matrix = np.sign(matrix) * np.log1p(np.abs(matrix))
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        return matrix / np.where(norms == 0, 1, norms)
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        vectors = [self._embed_batch(texts[start:start + self.batch_size]) for start in range(0, len(texts), self.batch_size)]
+        if not vectors:
+            return []
+        return np.vstack(vectors).tolist()
+
+    def embed_query(self, text: str) -> List[float]:
+        return self._embed_batch([text])[0].tolist()
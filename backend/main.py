@@ -1,18 +1,36 @@
-from fastapi import FastAPI, File, UploadFile, BackgroundTasks, HTTPException
-from fastapi.responses import StreamingResponse
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.responses import StreamingResponse, PlainTextResponse
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
 import os
-import shutil
-from typing import List
+import json
 import asyncio
-from tender_extractor import tender_data_extractor
+import time
+import logging
+from typing import List, Optional
+from contextlib import asynccontextmanager
+from jobs import submit_extraction_job, get_job, cancel_job, JobCancelled
 from evaluation_pipeline import rag_system_evaluation, load_ground_truth
-from chatbot import chatbot_response
+from chatbot import achatbot_response
+from chat_sessions import get_session, record_turn, delete_session
 from validator import validator_response
+from retriever import delete_vectorstore as remove_vectorstore, VectorstoreMismatch, shutdown_parse_pool
+from utils import init_runtime, close_runtime
+from trace_store import list_runs
+from uploads import spool_upload, UploadTooLarge, InvalidUpload
+from metrics import increment, observe, render_prometheus, start_request_context, end_request_context, summarize_spans
 
 
-app = FastAPI()
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Secrets, pooled HTTP clients and embeddings model are created once for the app lifetime
+    init_runtime()
+    yield
+    await close_runtime()
+    # Page extraction processes are shared by all ingestions and started on first use
+    shutdown_parse_pool()
+
+app = FastAPI(lifespan=lifespan)
 
 app.add_middleware(
     CORSMiddleware,
@@ -20,52 +38,252 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Chat-Session"],
 )
 
-@app.post("/get_resume")
-async def get_resume(background_tasks: BackgroundTasks, file: UploadFile = File(...)):
+# Room for the multipart boundaries and part headers around the PDF in the request body
+MULTIPART_OVERHEAD_BYTES = 64 * 1024
+
+async def save_upload(request: Request):
+    """
+    Guarda el PDF subido (campo 'file' del formulario) en un archivo temporal único de 'tmp'.
+
+    El cuerpo de la petición se escribe en disco a medida que llega, una sola vez, y su
+    hash SHA-256 se calcula durante la escritura, de modo que la ingesta no necesita
+    volver a leer el archivo para identificar su vectorstore (ver uploads.spool_upload).
+
+    Args:
+        request (Request): Petición con el formulario multipart
+
+    Returns:
+        tuple: (ruta del archivo temporal, hash SHA-256 del contenido, nombre original del archivo)
+
+    Note:
+        Las subidas de más de UPLOAD_MAX_MB megabytes se rechazan con un error 413: sin
+        leer el cuerpo si lo indica su Content-Length y, si no, en cuanto se supera el límite.
+    """
+
+    max_bytes = int(float(os.getenv("UPLOAD_MAX_MB", "100")) * 1024 * 1024)
+    content_length = request.headers.get("content-length")
+    if content_length and content_length.isdigit() and int(content_length) > max_bytes + MULTIPART_OVERHEAD_BYTES:
+        raise HTTPException(status_code=413, detail=f"File larger than {max_bytes // (1024 * 1024)} MB")
+
     base_dir = os.path.dirname(os.path.abspath(__file__))
     pdf_file_dir = os.path.join(base_dir, '..', "tmp")
+    try:
+        return await spool_upload(request.stream(), request.headers.get("content-type"), pdf_file_dir, max_bytes)
+    except UploadTooLarge as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    except InvalidUpload as e:
+        raise HTTPException(status_code=400, detail=str(e))
 
-    # Define PDF file path
-    pdf_file_path = os.path.join(pdf_file_dir, file.filename)
-    # Save the uploaded file
-    with open(pdf_file_path, 'wb') as pdf_file:
-        content = await file.read()
-        pdf_file.write(content)
-    
-    # Clean up the PDF and Excel directories after response is sent
+def submit_upload_job(pdf_file_path: str, file_name: str, content_hash: str, progress_callback=None):
+    # The job removes the PDF once the extraction has finished (or was cancelled)
     def cleanup():
-        os.remove(pdf_file_path)
-    
-    # Add cleanup function to background tasks
-    background_tasks.add_task(cleanup)
+        if os.path.exists(pdf_file_path):
+            os.remove(pdf_file_path)
+
+    return submit_extraction_job(pdf_file_path, file_name, cleanup=cleanup, content_hash=content_hash,
+                                 progress_callback=progress_callback)
 
-    return tender_data_extractor(pdf_file_path)
+# One JSON line per request (method, path, status, duration, time per pipeline stage and LLM tokens)
+request_logger = logging.getLogger("rag.requests")
+if os.getenv("JSON_REQUEST_LOGS", "false").lower() == "true":
+    request_logger.setLevel(logging.INFO)
+    request_logger.addHandler(logging.StreamHandler())
+
+class InstrumentRequests:
+    """
+    Middleware ASGI que mide cada petición HTTP (contador, duración y peticiones en curso)
+    y, con JSON_REQUEST_LOGS, escribe su línea de log.
+
+    La petición termina cuando la aplicación ha enviado el último fragmento del cuerpo
+    (los endpoints en streaming lo envían después de retornar), o cuando falla o el cliente
+    se desconecta: la medición se cierra siempre, aunque el cuerpo no llegue a recorrerse.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        request_context, context_token = start_request_context()
+        increment("rag_http_requests_in_flight")
+        start = time.perf_counter()
+        status_code = 500
+
+        async def instrumented_send(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, instrumented_send)
+        finally:
+            end_request_context(context_token)
+            seconds = time.perf_counter() - start
+            increment("rag_http_requests_in_flight", -1)
+            route = scope.get("route")
+            path = route.path if route is not None else "unmatched"
+            increment("rag_http_requests_total", method=scope["method"], path=path, status=status_code)
+            observe("rag_http_request_duration_seconds", seconds, method=scope["method"], path=path)
+            if request_logger.isEnabledFor(logging.INFO):
+                request_logger.info(json.dumps({
+                    "method": scope["method"],
+                    "path": path,
+                    "status": status_code,
+                    "duration_ms": round(seconds * 1000, 3),
+                    "stages": summarize_spans(request_context["spans"]),
+                    "tokens": request_context["tokens"],
+                }, ensure_ascii=False))
+
+app.add_middleware(InstrumentRequests)
+
+@app.get("/metrics")
+async def get_metrics():
+    return PlainTextResponse(render_prometheus(), media_type="text/plain; version=0.0.4")
+
+
+@app.post("/get_resume")
+async def get_resume(http_request: Request):
+    pdf_file_path, content_hash, file_name = await save_upload(http_request)
+    job_id, future = submit_upload_job(pdf_file_path, file_name, content_hash)
+
+    # The extraction runs in the job pool, so the event loop keeps serving other requests
+    try:
+        return await asyncio.wrap_future(future)
+    except JobCancelled:
+        raise HTTPException(status_code=409, detail=f"Job '{job_id}' was cancelled")
+
+
+@app.post("/get_resume/stream")
+async def stream_resume(http_request: Request):
+    pdf_file_path, content_hash, file_name = await save_upload(http_request)
+
+    # Progress events are produced in the job thread and handed over to the event loop
+    loop = asyncio.get_running_loop()
+    events = asyncio.Queue()
+    def on_progress(event: dict):
+        loop.call_soon_threadsafe(events.put_nowait, event)
+
+    job_id, future = submit_upload_job(pdf_file_path, file_name, content_hash, progress_callback=on_progress)
+    job_result = asyncio.wrap_future(future)
+
+    async def response_generator():
+        try:
+            # Ingestion progress, then each variable as soon as its answer is ready
+            while not (job_result.done() and events.empty()):
+                if await http_request.is_disconnected():
+                    return
+                event_waiter = asyncio.ensure_future(events.get())
+                await asyncio.wait({event_waiter, job_result}, return_when=asyncio.FIRST_COMPLETED)
+                if not event_waiter.done():
+                    event_waiter.cancel()
+                    continue
+                event = event_waiter.result()
+                yield format_sse(json.dumps(event, ensure_ascii=False), event=event["stage"])
+
+            # Final summary in the order of 'variables_to_extract.json'
+            try:
+                yield format_sse(json.dumps(job_result.result(), ensure_ascii=False), event="summary")
+            except JobCancelled:
+                yield format_sse(json.dumps({"job_id": job_id, "status": "cancelled"}, ensure_ascii=False), event="cancelled")
+            except Exception as e:
+                yield format_sse(json.dumps({"job_id": job_id, "error": str(e)}, ensure_ascii=False), event="error")
+        finally:
+            # Client went away: stop the extraction at the next variable
+            if not job_result.done():
+                cancel_job(job_id)
+
+    return StreamingResponse(response_generator(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
+@app.post("/jobs/get_resume")
+async def submit_resume_job(http_request: Request):
+    pdf_file_path, content_hash, file_name = await save_upload(http_request)
+    job_id, _ = submit_upload_job(pdf_file_path, file_name, content_hash)
+    return {"job_id": job_id, "status_url": f"/jobs/{job_id}"}
+
+@app.get("/jobs/{job_id}")
+async def get_resume_job(job_id: str):
+    job = get_job(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Job '{job_id}' not found")
+    return job
+
+@app.delete("/jobs/{job_id}")
+async def cancel_resume_job(job_id: str):
+    if not cancel_job(job_id):
+        raise HTTPException(status_code=404, detail=f"Job '{job_id}' not found or already finished")
+    return {"job_id": job_id, "status": "cancelling"}
 
 
 class ChatRequest(BaseModel):
     vectorstore_name: str
     input_text: str
-    chat_history: List[str]
+    chat_history: List[str] = []
+    session_id: Optional[str] = None
 
 @app.post("/chatbot")
-async def stream_chatbot_response(request: ChatRequest):
+async def stream_chatbot_response(request: ChatRequest, http_request: Request):
     vectorstore_name = request.vectorstore_name
     input_text = request.input_text
     chat_history = request.chat_history
+
+    # Server-side session: history and last retrieved context are kept between questions
+    session = get_session(request.session_id, vectorstore_name, chat_history)
     
+    try:
+        chatbot_stream = await achatbot_response(vectorstore_name, input_text, chat_history, session=session)
+    except FileNotFoundError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    except VectorstoreMismatch as e:
+        raise HTTPException(status_code=409, detail=str(e))
+
     # Return a StreamingResponse, passing the generator function
-    async def response_generator(chatbot_response):
-        # Stream the response chunk by chunk
-        for chunk in chatbot_response:
-            if 'choices' in chunk:
-                chunk_content = chunk['choices'][0]['delta'].get('content', '')
-                if chunk_content:
-                    yield chunk_content  # Yield each chunk as it's received
-                await asyncio.sleep(0.1)
-    return StreamingResponse(response_generator(chatbot_response(vectorstore_name, input_text, chat_history)),
-                             media_type="text/event-stream")
+    async def response_generator():
+        answer_chunks = []
+        try:
+            # Stream the response chunk by chunk as server-sent events
+            async for chunk in chatbot_stream:
+                if await http_request.is_disconnected():
+                    break
+                if 'choices' in chunk and chunk['choices']:
+                    chunk_content = chunk['choices'][0]['delta'].get('content', '')
+                    if chunk_content:
+                        answer_chunks.append(chunk_content)
+                        yield format_sse(chunk_content)  # Yield each chunk as it's received
+            else:
+                record_turn(session, input_text, "".join(answer_chunks))
+                yield format_sse("", event="end")
+        finally:
+            # Stop the upstream LLM stream if the client went away
+            aclose = getattr(chatbot_stream, "aclose", None)
+            if aclose is not None:
+                await aclose()
+
+    return StreamingResponse(response_generator(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no", "X-Chat-Session": session["session_id"]})
+
+@app.delete("/chat-sessions/{session_id}")
+async def end_chat_session(session_id: str):
+    if not delete_session(session_id):
+        raise HTTPException(status_code=404, detail=f"Chat session '{session_id}' not found")
+    return {"status": "success", "session_id": session_id}
+
+
+def format_sse(data: str, event: str = None) -> str:
+    """
+    Formatea un mensaje server-sent event (una línea 'data:' por cada línea del mensaje).
+    """
+    lines = [f"event: {event}"] if event else []
+    lines.extend(f"data: {line}" for line in data.split("\n"))
+    return "\n".join(lines) + "\n\n"
 
 
 class ValidateRequest(BaseModel):
@@ -79,7 +297,12 @@ async def validate_response(request: ValidateRequest):
     input_prompt = request.input_prompt
     input_llm = request.input_llm
 
-    return validator_response(vectorstore_name, input_prompt, input_llm)
+    try:
+        return validator_response(vectorstore_name, input_prompt, input_llm)
+    except FileNotFoundError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    except VectorstoreMismatch as e:
+        raise HTTPException(status_code=409, detail=str(e))
 
 
 class VectorstoreDeleteRequest(BaseModel):
@@ -88,22 +311,27 @@ class VectorstoreDeleteRequest(BaseModel):
 @app.post("/delete-vectorstore")
 async def delete_vectorstore(request: VectorstoreDeleteRequest):
     vectorstore_name = request.vectorstore_name
-    base_dir = os.path.dirname(os.path.abspath(__file__))
-    folder_to_delete = os.path.join(base_dir, '..', "vectorstores", vectorstore_name)
     
-    print(folder_to_delete)
-    if os.path.isdir(folder_to_delete):
-        # Recursively delete the folder and its contents
-        shutil.rmtree(folder_to_delete)
+    # Removes the name alias, and the index folder once no other name points to it
+    folder_to_delete = remove_vectorstore(vectorstore_name)
+    if folder_to_delete is not None:
         return {"status": "success", "message": f"Folder '{folder_to_delete}' deleted successfully"}
     else:
-        raise HTTPException(status_code=404, detail=f"Folder '{folder_to_delete}' not found")
+        raise HTTPException(status_code=404, detail=f"Vectorstore '{vectorstore_name}' not found")
+
+
+class EvaluationRequest(BaseModel):
+    run_ids: List[str] = []
 
+@app.get("/runs")
+async def get_runs():
+    # SQLite read off the event loop
+    return await asyncio.to_thread(list_runs)
 
 @app.post("/get_evaluation")
-async def get_evaluation():
+async def get_evaluation(request: EvaluationRequest = None):
     try:
-        evaluation_result = rag_system_evaluation()
+        evaluation_result = await asyncio.to_thread(rag_system_evaluation, request.run_ids if request else None)
         return {"evaluation_result": evaluation_result}
     except Exception as e:
         return {"error": str(e)}
\ No newline at end of file
@@ -0,0 +1,179 @@
+import time
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+
+# Histogram buckets (seconds) shared by all stage and request durations
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+METRICS = {
+    "rag_stage_duration_seconds": ("histogram", "Duración de cada etapa del pipeline RAG"),
+    "rag_http_request_duration_seconds": ("histogram", "Duración de las peticiones HTTP"),
+    "rag_http_requests_total": ("counter", "Peticiones HTTP atendidas"),
+    "rag_http_requests_in_flight": ("gauge", "Peticiones HTTP en curso"),
+    "rag_llm_tokens_total": ("counter", "Tokens consumidos en llamadas al LLM"),
+    "rag_llm_cached_tokens_total": ("counter", "Tokens de respuestas servidas desde la caché del LLM (no consumidos)"),
+    "rag_llm_cache_lookups_total": ("counter", "Consultas a la caché de respuestas del LLM"),
+    "rag_embedding_cache_lookups_total": ("counter", "Fragmentos consultados en la caché de embeddings"),
+    "rag_vectorstore_opens_total": ("counter", "Vectorstores abiertos según su origen (cache, disk o build)"),
+}
+
+_lock = threading.Lock()
+_values = {}
+_histograms = {}
+
+# Spans and tokens of the current request, for the per-request JSON log (see main.py)
+_request_context = ContextVar("request_context", default=None)
+
+
+def _key(name: str, labels: dict) -> tuple:
+    return name, tuple(sorted(labels.items()))
+
+def increment(name: str, value: float = 1, **labels):
+    """
+    Incrementa un contador (o un gauge, con un valor negativo para decrementarlo).
+
+    Args:
+        name (str): Nombre de la métrica (ver METRICS)
+        value (float, optional): Cantidad a sumar. Por defecto 1
+        **labels: Etiquetas de la serie
+    """
+
+    key = _key(name, labels)
+    with _lock:
+        _values[key] = _values.get(key, 0) + value
+
+def observe(name: str, seconds: float, **labels):
+    """
+    Registra una duración en un histograma.
+
+    Args:
+        name (str): Nombre de la métrica (ver METRICS)
+        seconds (float): Duración observada
+        **labels: Etiquetas de la serie
+    """
+
+    key = _key(name, labels)
+    with _lock:
+        histogram = _histograms.setdefault(key, {"buckets": [0] * len(DURATION_BUCKETS), "count": 0, "sum": 0.0})
+        for position, upper_bound in enumerate(DURATION_BUCKETS):
+            if seconds <= upper_bound:
+                histogram["buckets"][position] += 1
+        histogram["count"] += 1
+        histogram["sum"] += seconds
+
+@contextmanager
+def span(stage: str):
+    """
+    Mide la duración de una etapa del pipeline (carga o construcción del vectorstore,
+    embedding de consultas, búsqueda, construcción del contexto, llamada al LLM...).
+
+    La duración se acumula en 'rag_stage_duration_seconds' y, si hay una petición HTTP en
+    curso en el mismo contexto, en el resumen de etapas de su log.
+
+    Args:
+        stage (str): Nombre de la etapa
+    """
+
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_span(stage, time.perf_counter() - start)
+
+def record_span(stage: str, seconds: float):
+    """
+    Registra la duración de una etapa medida fuera de span (p. ej. una llamada al LLM en
+    streaming, que termina cuando se consume el stream).
+
+    Args:
+        stage (str): Nombre de la etapa
+        seconds (float): Duración de la etapa
+    """
+
+    observe("rag_stage_duration_seconds", seconds, stage=stage)
+    request_context = _request_context.get()
+    if request_context is not None:
+        request_context["spans"].append((stage, seconds))
+
+def record_tokens(prompt_tokens: int, completion_tokens: int = 0):
+    """
+    Suma los tokens de una llamada al LLM a 'rag_llm_tokens_total' y a la petición HTTP en curso.
+
+    Args:
+        prompt_tokens (int): Tokens del prompt
+        completion_tokens (int, optional): Tokens de la respuesta
+    """
+
+    increment("rag_llm_tokens_total", prompt_tokens, direction="prompt")
+    increment("rag_llm_tokens_total", completion_tokens, direction="completion")
+    request_context = _request_context.get()
+    if request_context is not None:
+        with _lock:
+            request_context["tokens"]["prompt"] += prompt_tokens
+            request_context["tokens"]["completion"] += completion_tokens
+
+def start_request_context():
+    """
+    Empieza a recoger las etapas y los tokens del contexto actual (una petición HTTP).
+
+    Returns:
+        tuple: (diccionario con 'spans' y 'tokens', token para restaurar el contexto con
+            end_request_context)
+    """
+
+    request_context = {"spans": [], "tokens": {"prompt": 0, "completion": 0}}
+    return request_context, _request_context.set(request_context)
+
+def end_request_context(token):
+    _request_context.reset(token)
+
+def summarize_spans(request_spans) -> dict:
+    """
+    Agrega las etapas de una petición en un diccionario etapa -> {count, ms}.
+    """
+
+    summary = {}
+    for stage, seconds in request_spans:
+        stage_summary = summary.setdefault(stage, {"count": 0, "ms": 0.0})
+        stage_summary["count"] += 1
+        stage_summary["ms"] = round(stage_summary["ms"] + seconds * 1000, 3)
+    return summary
+
+def _format_labels(labels) -> str:
+    if not labels:
+        return ""
+    escaped = (str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, value in labels)
+    return "{" + ",".join(f'{name}="{value}"' for (name, _), value in zip(labels, escaped)) + "}"
+
+def render_prometheus() -> str:
+    """
+    Genera las métricas en el formato de texto de Prometheus.
+
+    Returns:
+        str: Métricas listas para servir en el endpoint /metrics
+    """
+
+    with _lock:
+        values = dict(_values)
+        histograms = {key: {**histogram, "buckets": list(histogram["buckets"])} for key, histogram in _histograms.items()}
+
+    lines = []
+    for name, (metric_type, description) in METRICS.items():
+        lines.append(f"# HELP {name} {description}")
+        lines.append(f"# TYPE {name} {metric_type}")
+        if metric_type == "histogram":
+            for (series_name, labels), histogram in sorted(histograms.items()):
+                if series_name != name:
+                    continue
+                for upper_bound, bucket_count in zip(DURATION_BUCKETS, histogram["buckets"]):
+                    lines.append(f"{name}_bucket{_format_labels(labels + (('le', upper_bound),))} {bucket_count}")
+                lines.append(f"{name}_bucket{_format_labels(labels + (('le', '+Inf'),))} {histogram['count']}")
+                lines.append(f"{name}_sum{_format_labels(labels)} {histogram['sum']}")
+                lines.append(f"{name}_count{_format_labels(labels)} {histogram['count']}")
+        else:
+            for (series_name, labels), value in sorted(values.items()):
+                if series_name == name:
+                    lines.append(f"{name}{_format_labels(labels)} {value}")
+    return "\n".join(lines) + "\n"
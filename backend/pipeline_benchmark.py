@@ -0,0 +1,347 @@
+import os
+import json
+import time
+import asyncio
+import functools
+import random
+import pathlib
+import argparse
+import tempfile
+import subprocess
+import tracemalloc
+from contextlib import contextmanager
+from typing import List
+
+# Offline configuration: local CPU embedder and no LLM response cache (the LLM is mocked, see mock_llm).
+# Set before the pipeline modules load '.env.file', which does not override existing variables.
+os.environ["EMBEDDINGS_BACKEND"] = "local"
+os.environ["LLM_CACHE_BACKEND"] = "none"
+
+import fitz
+from langchain_community.vectorstores.faiss import FAISS
+
+import retriever
+import trace_store
+import embedding_cache
+import augmented_generator
+from utils import init_runtime, get_embeddings_model, embeddings_model_name, load_json_config, count_tokens
+from chunking import get_chunking_config, get_text_splitter, chunking_identity
+from lexical_index import build_lexical_index
+from retriever import load_pdf_pages, extract_top_documents_batch, parse_document, load_retriever_queries
+from augmented_generator import llm_response
+from prompt_engineering import SUMMARIZER_PROMPT_SYSTEM, SUMMARIZER_PROMPT_USER
+from tender_extractor import tender_data_extractor, load_variables_to_resume
+from chatbot import achatbot_response
+from validator import validator_response
+from retrieval_benchmark import PDF_FILES_DIR, print_table
+
+
+BENCHMARKS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', "benchmarks")
+
+MOCK_LLM_RESPONSE = "No existe información al respecto."
+
+FILLER_WORDS = (
+    "contrato licitación servicio suministro adjudicación pliego cláusula administrativa técnica "
+    "entidad órgano contratación plazo ejecución garantía definitiva presupuesto base importe "
+    "lote oferta criterio valoración solvencia económica financiera empresa documentación "
+    "prescripciones obligaciones penalidades modificación prórroga recepción pago factura"
+).split()
+
+
+@contextmanager
+def measure(stages: dict, stage: str):
+    """
+    Mide el tiempo de reloj y el pico de memoria de Python de una etapa.
+
+    Args:
+        stages (dict): Diccionario etapa -> métricas donde se guarda el resultado
+        stage (str): Nombre de la etapa
+
+    Note:
+        El pico de memoria se mide con tracemalloc, que no incluye la memoria reservada
+        fuera del intérprete (p. ej. el índice FAISS o el texto extraído por PyMuPDF).
+    """
+
+    tracemalloc.reset_peak()
+    start_memory = tracemalloc.get_traced_memory()[0]
+    start = time.perf_counter()
+    metrics = stages.setdefault(stage, {})
+    yield metrics
+    metrics["seconds"] = time.perf_counter() - start
+    metrics["peak_mb"] = (tracemalloc.get_traced_memory()[1] - start_memory) / (1024 * 1024)
+
+def mock_llm(response: str = MOCK_LLM_RESPONSE):
+    """
+    Sustituye las llamadas al LLM del pipeline por respuestas simuladas de litellm
+    ('mock_response'), que no se envían a la API pero recorren el mismo código (streaming,
+    consumo de tokens, métricas).
+
+    Args:
+        response (str, optional): Texto con el que responde el LLM simulado
+    """
+
+    augmented_generator.completion = functools.partial(augmented_generator.completion, mock_response=response)
+    augmented_generator.acompletion = functools.partial(augmented_generator.acompletion, mock_response=response)
+
+def isolate_storage(work_dir: str):
+    """
+    Redirige los vectorstores, la caché de embeddings y el registro de trazas a un directorio
+    temporal, para que cada ejecución del benchmark parta de cero y no altere los datos reales.
+
+    Args:
+        work_dir (str): Directorio de trabajo del benchmark
+    """
+
+    retriever.VECTORSTORES_DIR = os.path.join(work_dir, "vectorstores")
+    retriever.ALIASES_FILE = os.path.join(retriever.VECTORSTORES_DIR, "aliases.json")
+    embedding_cache.EMBEDDINGS_CACHE_DIR = os.path.join(work_dir, "embeddings_cache")
+    embedding_cache.CHUNK_EMBEDDINGS_DB = os.path.join(embedding_cache.EMBEDDINGS_CACHE_DIR, "chunk_embeddings.sqlite")
+    embedding_cache._schema_ready = False
+    trace_store.TRACES_DIR = os.path.join(work_dir, "traces")
+
+def create_synthetic_pdf(pdf_file_path: str, pages: int, facts: dict, seed: int = 0):
+    """
+    Genera un PDF de licitación sintético con texto de relleno y los datos de referencia
+    de 'validation.json' repartidos entre sus páginas.
+
+    Args:
+        pdf_file_path (str): Ruta del PDF a generar
+        pages (int): Número de páginas
+        facts (dict): Diccionario variable -> respuesta de referencia
+        seed (int, optional): Semilla del texto de relleno
+    """
+
+    rng = random.Random(seed)
+    fact_pages = {}
+    for variable, answer in facts.items():
+        fact_pages.setdefault(rng.randrange(pages), []).append(f"{variable}: {answer}")
+
+    with fitz.open() as pdf:
+        for page_number in range(pages):
+            paragraphs = [" ".join(rng.choice(FILLER_WORDS) for _ in range(120)).capitalize() + "." for _ in range(4)]
+            for fact in fact_pages.get(page_number, []):
+                paragraphs.insert(rng.randrange(len(paragraphs) + 1), fact)
+            page = pdf.new_page()
+            page.insert_textbox(fitz.Rect(50, 50, page.rect.width - 50, page.rect.height - 50), "\n\n".join(paragraphs), fontsize=8)
+        pdf.save(pdf_file_path)
+
+def benchmark_stages(embeddings_model, pdf_file_path: str, top_k: int, fetch_k: int) -> dict:
+    """
+    Ejecuta la extracción de un documento etapa por etapa, sin caché ni persistencia.
+
+    Las etapas (parse, split, embed, index, search, prompt_build, llm) se ejecutan de forma
+    secuencial para poder medirlas por separado; en producción la ingesta solapa parse,
+    split y embed (ver retriever.build_vectorstore).
+
+    Args:
+        embeddings_model: Modelo de embeddings a utilizar
+        pdf_file_path (str): Ruta al archivo PDF
+        top_k (int): Número de documentos a retornar por variable
+        fetch_k (int): Número de documentos a recuperar antes de filtrar
+
+    Returns:
+        dict: Diccionario etapa -> tiempo, pico de memoria y, donde aplica, tokens
+    """
+
+    stages = {}
+    with measure(stages, "parse") as metrics:
+        pages = load_pdf_pages(pdf_file_path)
+        metrics["pages"] = len(pages)
+    with measure(stages, "split") as metrics:
+        documents = get_text_splitter(get_chunking_config()).split_documents(pages)
+        metrics["chunks"] = len(documents)
+
+    texts = [document.page_content for document in documents]
+    queries = load_retriever_queries()
+    variables = dict(list(variable.items())[0] for variable in load_variables_to_resume())
+    query_list = [queries[variable] for variable in variables]
+    with measure(stages, "embed") as metrics:
+        vectors = embeddings_model.embed_documents(texts)
+        query_embeddings = dict(zip(query_list, embeddings_model.embed_documents(query_list)))
+        metrics["embedding_tokens"] = sum(count_tokens(text) for text in texts + query_list)
+
+    with measure(stages, "index"):
+        vectorstore = FAISS.from_embeddings(
+            text_embeddings=list(zip(texts, vectors)),
+            embedding=embeddings_model,
+            metadatas=[document.metadata for document in documents],
+        )
+        vectorstore.lexical_index = build_lexical_index(vectorstore)
+    with measure(stages, "search"):
+        top_documents = extract_top_documents_batch(vectorstore, query_embeddings, top_k=top_k, fetch_k=fetch_k)
+
+    with measure(stages, "prompt_build") as metrics:
+        prompts = [
+            SUMMARIZER_PROMPT_USER.format(variable=variable, definicion_variable=definition, contexto=parse_document(top_documents[queries[variable]]))
+            for variable, definition in variables.items()
+        ]
+        metrics["prompt_tokens"] = sum(count_tokens(SUMMARIZER_PROMPT_SYSTEM) + count_tokens(prompt) for prompt in prompts)
+    with measure(stages, "llm") as metrics:
+        responses = [llm_response(prompt_system=SUMMARIZER_PROMPT_SYSTEM, prompt_user=prompt) for prompt in prompts]
+        metrics["calls"] = len(responses)
+    return stages
+
+async def _consume_chatbot_response(vectorstore_name: str, input_text: str, chat_history: List[str]):
+    async for _ in await achatbot_response(vectorstore_name, input_text, chat_history):
+        pass
+
+def benchmark_end_to_end(pdf_file_path: str, questions: List[str]) -> dict:
+    """
+    Mide las funciones que usa la API: extracción completa, chatbot (la versión asíncrona
+    del endpoint /chatbot) y validador.
+
+    Args:
+        pdf_file_path (str): Ruta al archivo PDF
+        questions (List[str]): Preguntas de ejemplo para el chatbot y el validador
+
+    Returns:
+        dict: Diccionario etapa -> tiempo y pico de memoria
+    """
+
+    stages = {}
+    vectorstore_name = pathlib.Path(pdf_file_path).stem
+    with measure(stages, "e2e_extractor"):
+        tender_data_extractor(pdf_file_path)
+    with measure(stages, "e2e_chatbot"):
+        asyncio.run(_consume_chatbot_response(vectorstore_name, questions[-1], questions[:-1]))
+    with measure(stages, "e2e_validator"):
+        validator_response(vectorstore_name, questions[0], questions[0])
+    return stages
+
+def run_benchmark(pages: int, include_samples: bool, top_k: int, fetch_k: int) -> dict:
+    """
+    Ejecuta el benchmark sobre un PDF sintético y, opcionalmente, sobre los PDFs de
+    'validation.json' disponibles en 'pdf_files'.
+
+    Args:
+        pages (int): Número de páginas del PDF sintético
+        include_samples (bool): Si también se miden los PDFs reales de 'pdf_files'
+        top_k (int): Número de documentos a retornar por variable
+        fetch_k (int): Número de documentos a recuperar antes de filtrar
+
+    Returns:
+        dict: Configuración y métricas por documento y etapa
+    """
+
+    validation = load_json_config("validation.json")
+    embeddings_model = get_embeddings_model()
+    questions = list(load_retriever_queries().values())[:3]
+
+    with tempfile.TemporaryDirectory() as work_dir:
+        isolate_storage(work_dir)
+        pdf_files = [os.path.join(work_dir, f"synthetic_{pages}p.pdf")]
+        create_synthetic_pdf(pdf_files[0], pages, next(iter(validation.values()))["details"])
+        if include_samples:
+            pdf_files += [os.path.join(PDF_FILES_DIR, file_name) for file_name in validation if os.path.exists(os.path.join(PDF_FILES_DIR, file_name))]
+
+        tracemalloc.start()
+        try:
+            documents = {}
+            for pdf_file_path in pdf_files:
+                stages = benchmark_stages(embeddings_model, pdf_file_path, top_k, fetch_k)
+                stages.update(benchmark_end_to_end(pdf_file_path, questions))
+                documents[pathlib.Path(pdf_file_path).name] = stages
+        finally:
+            tracemalloc.stop()
+            trace_store.flush_traces()
+
+    return {
+        "created_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "commit": _git_commit(),
+        "config": {
+            "chunking": chunking_identity(get_chunking_config()),
+            "embeddings": embeddings_model_name(embeddings_model),
+            "top_k": top_k,
+            "fetch_k": fetch_k,
+            "retrieval_mode": os.getenv("RETRIEVAL_MODE", "dense"),
+            "rerank": os.getenv("RETRIEVAL_RERANK", "none"),
+        },
+        "documents": documents,
+    }
+
+def _git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def latest_result(exclude: str = None):
+    """
+    Retorna la ruta del último resultado guardado en 'benchmarks', o None si no hay ninguno.
+    """
+
+    if not os.path.isdir(BENCHMARKS_DIR):
+        return None
+    results = sorted(
+        os.path.join(BENCHMARKS_DIR, file_name)
+        for file_name in os.listdir(BENCHMARKS_DIR)
+        if file_name.endswith(".json")
+    )
+    results = [path for path in results if exclude is None or os.path.abspath(path) != os.path.abspath(exclude)]
+    return results[-1] if results else None
+
+def result_rows(result: dict, baseline: dict = None, tolerance: float = 0.2) -> List[dict]:
+    """
+    Convierte un resultado en filas (documento, etapa) comparables con un resultado anterior.
+
+    Args:
+        result (dict): Resultado actual
+        baseline (dict, optional): Resultado anterior con el que comparar
+        tolerance (float, optional): Aumento relativo de tiempo a partir del cual una etapa
+            se marca como regresión
+
+    Returns:
+        List[dict]: Una fila por documento y etapa
+    """
+
+    rows = []
+    for document, stages in result["documents"].items():
+        for stage, metrics in stages.items():
+            row = {
+                "document": document,
+                "stage": stage,
+                "seconds": metrics["seconds"],
+                "peak_mb": metrics["peak_mb"],
+                "tokens": metrics.get("prompt_tokens", metrics.get("embedding_tokens", "")),
+            }
+            if baseline is not None:
+                previous = baseline["documents"].get(document, {}).get(stage)
+                ratio = metrics["seconds"] / previous["seconds"] if previous and previous["seconds"] else None
+                row["vs_baseline"] = ratio if ratio is not None else ""
+                row["regression"] = "yes" if ratio is not None and ratio > 1 + tolerance else ""
+            rows.append(row)
+    return rows
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmark offline de la extracción con LLM y embeddings simulados")
+    parser.add_argument("--pages", type=int, default=40, help="Páginas del PDF sintético")
+    parser.add_argument("--samples", action="store_true", help="Incluye los PDFs de validation.json presentes en pdf_files")
+    parser.add_argument("--top-k", type=int, default=None)
+    parser.add_argument("--fetch-k", type=int, default=None)
+    parser.add_argument("--output", help="Ruta del JSON de resultados. Por defecto 'benchmarks/pipeline_<fecha>.json'")
+    parser.add_argument("--baseline", help="Resultado anterior con el que comparar. Por defecto, el último de 'benchmarks'")
+    parser.add_argument("--tolerance", type=float, default=0.2)
+    parser.add_argument("--mock-response", default=MOCK_LLM_RESPONSE, help="Respuesta del LLM simulado")
+    args = parser.parse_args()
+
+    init_runtime()
+    mock_llm(args.mock_response)
+    top_k = args.top_k or int(os.getenv("DOCUMENTS_TO_FETCH"))
+    fetch_k = args.fetch_k or int(os.getenv("DOCUMENTS_TO_RETRIEVE"))
+
+    result = run_benchmark(args.pages, args.samples, top_k, fetch_k)
+
+    output = args.output or os.path.join(BENCHMARKS_DIR, f"pipeline_{time.strftime('%Y%m%d-%H%M%S')}.json")
+    baseline_path = args.baseline or latest_result(exclude=output)
+    baseline = None
+    if baseline_path:
+        with open(baseline_path, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+        print(f"Comparando con {baseline_path}")
+
+    print_table(result_rows(result, baseline, args.tolerance))
+
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(result, f, ensure_ascii=False, indent=2)
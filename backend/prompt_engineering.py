@@ -18,6 +18,28 @@ Contexto: {contexto}
 Respuesta:
 """
 
+GROUPED_SUMMARIZER_PROMPT_SYSTEM = """
+Eres un asistente útil. Recibes información del contrato de una licitación y se te pide que extraigas la información
+de varios campos de la licitación. Tu deber es extraer la información de cada campo de una manera resumida y devolverla
+en formato JSON.
+"""
+
+GROUPED_SUMMARIZER_PROMPT_USER = """
+Ante la tarea de extraer información del contrato de una licitación se pide extraer la información de varios Campos
+del contrato de licitación. Los Campos se proporcionan como un objeto JSON cuyas claves son los nombres de los Campos y cuyos
+valores son la Definición de cada campo. La Definición de campo es un recurso de apoyo pero en ningún caso debe formar parte
+de la respuesta. Extrae la información de cada Campo a partir del Contexto. El Contexto contiene la información relevante del
+contrato de licitación para extraer la información de los Campos. Incluye toda la información relevante del Contexto en cada respuesta.
+Responde en español. Cuando la respuesta de un Campo no esté disponible, devuelve 'No se encontro información en el documento'.
+Devuelve únicamente un objeto JSON cuyas claves sean exactamente los nombres de los Campos y cuyos valores sean la respuesta
+de cada Campo en formato string.
+
+Campos: {campos}
+Contexto: {contexto}
+
+Respuesta:
+"""
+
 GET_CONTEXT_PROMPT_SYSTEM = """
 Eres un asistente útil. Recibes una pregunta de un usuario junto con el historial de preguntas anteriores a esta última pregunta.
 Si esta última pregunta necesita contexto, reformúlala a partir de las preguntas anteriores para que la pregunta tenga sentido en
@@ -0,0 +1,350 @@
+import os
+import re
+import json
+import time
+import argparse
+from itertools import product
+from typing import List
+
+import numpy as np
+from langchain_community.vectorstores.faiss import FAISS
+
+from utils import init_runtime, get_embeddings_model, load_json_config, count_tokens
+from chunking import CHUNKING_STRATEGIES, get_chunking_config, get_text_splitter, chunking_identity
+from embedding_cache import embed_documents_cached
+from retriever import load_pdf_pages, load_query_embeddings, extract_top_documents_batch, load_retriever_queries, parse_document, uses_fetch_k
+from vectorstore_cache import estimate_vectorstore_size
+from lexical_index import tokenize, build_lexical_index
+
+
+PDF_FILES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', "pdf_files")
+
+# Ground-truth answers stating that the field is not in the document cannot be hit
+NO_ANSWER_PATTERN = re.compile(r"no (existe|se encontr)", re.IGNORECASE)
+
+
+def normalize_tokens(text: str) -> set:
+    """
+    Normaliza un texto en un conjunto de términos (minúsculas, sin tildes, sin palabras cortas).
+
+    Args:
+        text (str): Texto a normalizar
+
+    Returns:
+        set: Términos del texto
+    """
+
+    return {token for token in tokenize(text) if len(token) > 2 or token.isdigit()}
+
+def lexical_hit(reference: str, contexts: List[str], threshold: float) -> bool:
+    """
+    Indica si la respuesta de referencia aparece en los fragmentos recuperados.
+
+    Args:
+        reference (str): Respuesta de referencia de 'validation.json'
+        contexts (List[str]): Fragmentos recuperados
+        threshold (float): Fracción mínima de términos de la referencia presentes en los fragmentos
+
+    Returns:
+        bool: True si la fracción de términos encontrados alcanza el umbral
+    """
+
+    reference_tokens = normalize_tokens(reference)
+    if not reference_tokens:
+        return False
+    context_tokens = normalize_tokens(" ".join(contexts))
+    return len(reference_tokens & context_tokens) / len(reference_tokens) >= threshold
+
+def embedding_hits(embeddings_model, references: dict, contexts: dict, threshold: float) -> dict:
+    """
+    Indica, por variable, si algún fragmento recuperado es semánticamente similar a la respuesta de referencia.
+
+    Complementa el acierto léxico cuando la respuesta de referencia está redactada con
+    palabras distintas a las del documento. Los vectores de los fragmentos se obtienen de la
+    caché de embeddings (ya se embebieron al construir el índice); los de las respuestas de
+    referencia se calculan sin guardarlos en ella.
+
+    Args:
+        embeddings_model: Modelo de embeddings a utilizar
+        references (dict): Diccionario variable -> respuesta de referencia
+        contexts (dict): Diccionario variable -> fragmentos recuperados
+        threshold (float): Similitud coseno mínima entre la referencia y algún fragmento
+
+    Returns:
+        dict: Diccionario variable -> acierto
+    """
+
+    variables = list(references)
+    texts = list(dict.fromkeys([references[variable] for variable in variables] + [text for variable in variables for text in contexts[variable]]))
+    vectors = np.asarray(embed_documents_cached(embeddings_model, texts, store=False), dtype=np.float32)
+    vectors /= np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+    positions = {text: position for position, text in enumerate(texts)}
+
+    hits = {}
+    for variable in variables:
+        context_positions = [positions[text] for text in contexts[variable]]
+        similarities = vectors[context_positions] @ vectors[positions[references[variable]]]
+        hits[variable] = bool(context_positions) and float(similarities.max()) >= threshold
+    return hits
+
+def build_index(embeddings_model, pages, chunking_config: dict):
+    """
+    Fragmenta las páginas de un documento y construye un índice FAISS en memoria.
+
+    Args:
+        embeddings_model: Modelo de embeddings a utilizar
+        pages (List[Document]): Páginas del documento
+        chunking_config (dict): Configuración de fragmentación
+
+    Returns:
+        tuple: (vectorstore, estadísticas con número de fragmentos, tokens embebidos y tamaño del índice)
+    """
+
+    documents = get_text_splitter(chunking_config).split_documents(pages)
+    texts = [document.page_content for document in documents]
+    vectors = embed_documents_cached(embeddings_model, texts)
+    vectorstore = FAISS.from_embeddings(
+        text_embeddings=list(zip(texts, vectors)),
+        embedding=embeddings_model,
+        metadatas=[document.metadata for document in documents],
+    )
+    vectorstore.lexical_index = build_lexical_index(vectorstore)
+    stats = {
+        "chunks": len(texts),
+        "embedding_tokens": sum(count_tokens(text) for text in texts),
+        "index_bytes": estimate_vectorstore_size(vectorstore),
+    }
+    return vectorstore, stats
+
+def evaluate_retrieval(vectorstore, embeddings_model, ground_truth: dict, top_k: int, fetch_k: int, threshold: float, embedding_threshold: float = 0.8) -> dict:
+    """
+    Calcula la tasa de acierto de la recuperación frente a las respuestas de referencia.
+
+    Args:
+        vectorstore (FAISS): vector store FAISS del documento
+        embeddings_model: Modelo de embeddings a utilizar
+        ground_truth (dict): Diccionario variable -> respuesta de referencia
+        top_k (int): Número de documentos a retornar por variable
+        fetch_k (int): Número de documentos a recuperar antes de filtrar
+        threshold (float): Umbral de acierto léxico
+        embedding_threshold (float, optional): Umbral de acierto por similitud de embeddings
+
+    Returns:
+        dict: Aciertos, variables evaluables, tasas de acierto léxico y por embeddings,
+            tokens medios de contexto y latencia media de búsqueda por consulta
+    """
+
+    queries = load_retriever_queries()
+    variables = [variable for variable, reference in ground_truth.items() if variable in queries and not NO_ANSWER_PATTERN.search(reference)]
+    if not variables:
+        return {"hits": 0, "evaluated": 0, "hit_rate": None, "embedding_hit_rate": None, "context_tokens": None, "search_ms": None}
+
+    query_embeddings = load_query_embeddings(embeddings_model, [queries[variable] for variable in variables])
+    start = time.perf_counter()
+    top_documents = extract_top_documents_batch(vectorstore, query_embeddings, top_k=top_k, fetch_k=fetch_k)
+    search_ms = (time.perf_counter() - start) * 1000 / len(variables)
+
+    contexts = {variable: [document.page_content for document in top_documents[queries[variable]]] for variable in variables}
+    hits = sum(lexical_hit(ground_truth[variable], contexts[variable], threshold) for variable in variables)
+    semantic_hits = embedding_hits(embeddings_model, {variable: ground_truth[variable] for variable in variables}, contexts, embedding_threshold)
+    context_tokens = sum(count_tokens(parse_document(top_documents[queries[variable]])) for variable in variables)
+    return {
+        "hits": hits,
+        "evaluated": len(variables),
+        "hit_rate": hits / len(variables),
+        "embedding_hit_rate": sum(semantic_hits.values()) / len(variables),
+        "context_tokens": context_tokens / len(variables),
+        "search_ms": search_ms,
+    }
+
+def compare_chunking_strategies(strategies: List[str], top_k: int, fetch_k: int, threshold: float, embedding_threshold: float = 0.8) -> List[dict]:
+    """
+    Compara estrategias de fragmentación sobre los documentos de 'validation.json'.
+
+    Para cada documento disponible en 'pdf_files' y cada estrategia (con sus valores por
+    defecto) reporta el coste de embeddings, el tamaño del índice y la tasa de acierto.
+
+    Args:
+        strategies (List[str]): Estrategias de fragmentación a comparar
+        top_k (int): Número de documentos a retornar por variable
+        fetch_k (int): Número de documentos a recuperar antes de filtrar
+        threshold (float): Umbral de acierto léxico
+        embedding_threshold (float, optional): Umbral de acierto por similitud de embeddings
+
+    Returns:
+        List[dict]: Una fila por documento y estrategia
+    """
+
+    embeddings_model = get_embeddings_model()
+    rows = []
+    for file_name, pages, ground_truth in load_validation_documents():
+        for strategy in strategies:
+            chunking_config = get_chunking_config(strategy, **CHUNKING_STRATEGIES[strategy])
+            vectorstore, stats = build_index(embeddings_model, pages, chunking_config)
+            retrieval = evaluate_retrieval(vectorstore, embeddings_model, ground_truth, top_k, fetch_k, threshold, embedding_threshold)
+            rows.append({"document": file_name, "chunking": chunking_identity(chunking_config), **stats, **retrieval})
+    return rows
+
+def load_validation_documents():
+    """
+    Carga las páginas de los documentos de 'validation.json' disponibles en 'pdf_files'.
+
+    Yields:
+        tuple: (nombre del PDF, páginas, diccionario variable -> respuesta de referencia)
+    """
+
+    for file_name, validation in load_json_config("validation.json").items():
+        pdf_file_path = os.path.join(PDF_FILES_DIR, file_name)
+        if os.path.exists(pdf_file_path):
+            yield file_name, load_pdf_pages(pdf_file_path), validation["details"]
+
+def sweep_retrieval(strategy: str, chunk_sizes: List[int], chunk_overlaps: List[int], top_ks: List[int], fetch_ks: List[int],
+                    threshold: float, embedding_threshold: float) -> List[dict]:
+    """
+    Recorre una rejilla de parámetros de recuperación sobre los documentos de 'validation.json'.
+
+    Cada índice (tamaño y solapamiento de fragmento) se construye una vez por documento y se
+    evalúa con todas las combinaciones de DOCUMENTS_TO_FETCH (top_k) y DOCUMENTS_TO_RETRIEVE
+    (fetch_k) con fetch_k >= top_k. Los resultados se agregan sobre todos los documentos.
+
+    fetch_k solo se recorre si RETRIEVAL_MODE es 'hybrid' o RETRIEVAL_RERANK es 'mmr' (ver
+    retriever.uses_fetch_k); con búsqueda densa simple se evalúa cada top_k con fetch_k = top_k.
+
+    Args:
+        strategy (str): Estrategia de fragmentación
+        chunk_sizes (List[int]): Tamaños de fragmento
+        chunk_overlaps (List[int]): Solapamientos entre fragmentos
+        top_ks (List[int]): Valores de DOCUMENTS_TO_FETCH
+        fetch_ks (List[int]): Valores de DOCUMENTS_TO_RETRIEVE
+        threshold (float): Umbral de acierto léxico
+        embedding_threshold (float): Umbral de acierto por similitud de embeddings
+
+    Returns:
+        List[dict]: Una fila por combinación de parámetros
+    """
+
+    embeddings_model = get_embeddings_model()
+    documents = list(load_validation_documents())
+    if uses_fetch_k():
+        configs = [(top_k, fetch_k) for top_k, fetch_k in product(top_ks, fetch_ks) if fetch_k >= top_k]
+    else:
+        # Plain dense search ignores fetch_k: sweeping it would only repeat identical rows
+        configs = [(top_k, top_k) for top_k in top_ks]
+
+    totals = {}
+    for chunk_size, chunk_overlap in product(chunk_sizes, chunk_overlaps):
+        if chunk_overlap >= chunk_size:
+            continue
+        chunking_config = get_chunking_config(strategy, chunk_size=chunk_size, chunk_overlap=chunk_overlap)
+        for _, pages, ground_truth in documents:
+            vectorstore, _ = build_index(embeddings_model, pages, chunking_config)
+            for top_k, fetch_k in configs:
+                retrieval = evaluate_retrieval(vectorstore, embeddings_model, ground_truth, top_k, fetch_k, threshold, embedding_threshold)
+                if not retrieval["evaluated"]:
+                    continue
+                total = totals.setdefault((chunk_size, chunk_overlap, top_k, fetch_k), {"evaluated": 0, "hits": 0, "embedding_hits": 0, "context_tokens": 0, "search_ms": 0})
+                evaluated = retrieval["evaluated"]
+                total["evaluated"] += evaluated
+                total["hits"] += retrieval["hits"]
+                total["embedding_hits"] += retrieval["embedding_hit_rate"] * evaluated
+                total["context_tokens"] += retrieval["context_tokens"] * evaluated
+                total["search_ms"] += retrieval["search_ms"] * evaluated
+
+    return [
+        {
+            "chunk_size": chunk_size,
+            "chunk_overlap": chunk_overlap,
+            "top_k": top_k,
+            "fetch_k": fetch_k,
+            "evaluated": total["evaluated"],
+            "hit_rate": total["hits"] / total["evaluated"],
+            "embedding_hit_rate": total["embedding_hits"] / total["evaluated"],
+            "context_tokens": total["context_tokens"] / total["evaluated"],
+            "search_ms": total["search_ms"] / total["evaluated"],
+        }
+        for (chunk_size, chunk_overlap, top_k, fetch_k), total in totals.items()
+    ]
+
+def mark_pareto_front(rows: List[dict], maximize=("hit_rate", "embedding_hit_rate"), minimize=("context_tokens", "search_ms")) -> List[dict]:
+    """
+    Marca las configuraciones óptimas de Pareto: aquellas para las que ninguna otra tiene
+    igual o mejor tasa de acierto con igual o menor coste (tokens de contexto y latencia),
+    siendo mejor en al menos un criterio.
+
+    Args:
+        rows (List[dict]): Filas de sweep_retrieval
+        maximize (tuple, optional): Columnas a maximizar
+        minimize (tuple, optional): Columnas a minimizar
+
+    Returns:
+        List[dict]: Filas con la columna 'pareto', ordenadas por tasa de acierto descendente
+            y tokens de contexto ascendentes
+    """
+
+    def objectives(row):
+        return [row[column] for column in maximize] + [-row[column] for column in minimize]
+
+    for row in rows:
+        row_objectives = objectives(row)
+        row["pareto"] = not any(
+            all(other_value >= value for other_value, value in zip(objectives(other), row_objectives)) and objectives(other) != row_objectives
+            for other in rows
+        )
+    return sorted(rows, key=lambda row: (-row["hit_rate"], row["context_tokens"]))
+
+def print_table(rows: List[dict]):
+    if not rows:
+        print("No se encontraron documentos de 'validation.json' en 'pdf_files'")
+        return
+    columns = list(rows[0].keys())
+    widths = {column: max(len(column), *(len(_format_value(row[column])) for row in rows)) for column in columns}
+    print("  ".join(column.ljust(widths[column]) for column in columns))
+    for row in rows:
+        print("  ".join(_format_value(row[column]).ljust(widths[column]) for column in columns))
+
+def _format_value(value) -> str:
+    if isinstance(value, float):
+        return f"{value:.3f}"
+    return str(value)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Compara estrategias de fragmentación y parámetros de recuperación sobre validation.json")
+    parser.add_argument("--strategies", nargs="+", default=list(CHUNKING_STRATEGIES), choices=list(CHUNKING_STRATEGIES))
+    parser.add_argument("--top-k", type=int, default=None)
+    parser.add_argument("--fetch-k", type=int, default=None)
+    parser.add_argument("--threshold", type=float, default=0.6)
+    parser.add_argument("--embedding-threshold", type=float, default=0.8)
+    parser.add_argument("--sweep", action="store_true", help="Recorre la rejilla de parámetros y muestra el frente de Pareto")
+    parser.add_argument("--chunk-sizes", nargs="+", type=int, default=None)
+    parser.add_argument("--chunk-overlaps", nargs="+", type=int, default=None)
+    parser.add_argument("--top-ks", nargs="+", type=int, default=[5, 10, 15])
+    parser.add_argument("--fetch-ks", nargs="+", type=int, default=[10, 20, 40])
+    parser.add_argument("--pareto-only", action="store_true", help="Con --sweep, muestra solo las configuraciones óptimas de Pareto")
+    parser.add_argument("--output", help="Ruta de un archivo JSON donde guardar los resultados")
+    args = parser.parse_args()
+
+    init_runtime()
+    top_k = args.top_k or int(os.getenv("DOCUMENTS_TO_FETCH"))
+    fetch_k = args.fetch_k or int(os.getenv("DOCUMENTS_TO_RETRIEVE"))
+
+    if args.sweep:
+        strategy = args.strategies[0]
+        default_config = CHUNKING_STRATEGIES[strategy]
+        rows = mark_pareto_front(sweep_retrieval(
+            strategy,
+            args.chunk_sizes or [default_config["chunk_size"] // 2, default_config["chunk_size"], default_config["chunk_size"] * 2],
+            args.chunk_overlaps or [0, default_config["chunk_overlap"]],
+            args.top_ks,
+            args.fetch_ks,
+            args.threshold,
+            args.embedding_threshold,
+        ))
+        print_table([row for row in rows if row["pareto"]] if args.pareto_only else rows)
+    else:
+        rows = compare_chunking_strategies(args.strategies, top_k, fetch_k, args.threshold, args.embedding_threshold)
+        print_table(rows)
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(rows, f, ensure_ascii=False, indent=2)
@@ -1,81 +1,615 @@
 import json
+import hashlib
 import pathlib
 import os
-from typing import List
+import shutil
+import threading
+import multiprocessing
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from itertools import islice
+from typing import Dict, List
+
+import fitz
+import numpy as np
 
-from langchain_community.document_loaders import PyMuPDFLoader
 from langchain_core.documents import Document
-from langchain_text_splitters import RecursiveCharacterTextSplitter
 from langchain_community.vectorstores import FAISS
 from langchain_community.vectorstores.faiss import FAISS
 
+from utils import embeddings_model_name, load_json_config
+import embedding_cache
+from embedding_cache import embed_documents_cached
+from chunking import get_chunking_config, get_text_splitter, chunking_identity
+from context_builder import build_context
+from lexical_index import build_lexical_index, save_lexical_index, load_lexical_index, bm25_search, reciprocal_rank_fusion
+from vectorstore_cache import get_cached_vectorstore, cache_vectorstore, invalidate_vectorstore
+from metrics import span, increment
+
+
+VECTORSTORES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', "vectorstores")
+ALIASES_FILE = os.path.join(VECTORSTORES_DIR, "aliases.json")
+IDENTITY_FILE = "identity.json"
+
+_aliases_lock = threading.Lock()
+_query_embeddings_lock = threading.Lock()
+# One lock per vectorstore folder, so a vectorstore is loaded or built once when requested concurrently
+_path_locks: Dict[str, threading.Lock] = {}
+_path_locks_lock = threading.Lock()
+
+_parse_pool = None
+_parse_pool_lock = threading.Lock()
+
+
+class VectorstoreMismatch(ValueError):
+    """
+    El vectorstore de un documento se creó con otro modelo de embeddings o con otros
+    parámetros de fragmentación que los configurados.
+    """
+
+
+def _parse_pages(pdf_file_path: str, first_page: int, last_page: int) -> List[Document]:
+    """
+    Extrae el texto de un rango de páginas de un PDF (se ejecuta en un proceso del pool).
+
+    Args:
+        pdf_file_path (str): Ruta completa al archivo PDF
+        first_page (int): Primera página del rango (incluida)
+        last_page (int): Última página del rango (excluida)
+
+    Returns:
+        List[Document]: Un documento por página con su número de página en los metadatos
+    """
+    
+    with fitz.open(pdf_file_path) as pdf:
+        return [
+            Document(
+                page_content=pdf[page_number].get_text(),
+                metadata={"source": pdf_file_path, "file_path": pdf_file_path, "page": page_number, "total_pages": pdf.page_count},
+            )
+            for page_number in range(first_page, last_page)
+        ]
+
+def get_parse_pool() -> ProcessPoolExecutor:
+    """
+    Retorna el pool de procesos de extracción de páginas, compartido por todas las ingestas.
+
+    El pool se crea la primera vez que se usa, con INGESTION_WORKERS procesos iniciados con
+    'spawn': hacer fork de un servidor con varios hilos puede dejar locks tomados en el
+    proceso hijo.
+
+    Returns:
+        ProcessPoolExecutor: Pool de procesos de extracción
+    """
+    
+    global _parse_pool
+    with _parse_pool_lock:
+        if _parse_pool is None:
+            _parse_pool = ProcessPoolExecutor(max_workers=int(os.getenv("INGESTION_WORKERS", "4")),
+                                              mp_context=multiprocessing.get_context("spawn"))
+        return _parse_pool
+
+def shutdown_parse_pool(pool: ProcessPoolExecutor = None):
+    """
+    Cierra el pool de procesos de extracción (el siguiente uso crea uno nuevo).
+
+    Args:
+        pool (ProcessPoolExecutor, optional): Cierra el pool solo si sigue siendo este
+    """
+    
+    global _parse_pool
+    with _parse_pool_lock:
+        if _parse_pool is None or (pool is not None and _parse_pool is not pool):
+            return
+        pool, _parse_pool = _parse_pool, None
+    pool.shutdown(wait=False, cancel_futures=True)
+
+def load_pdf_pages(pdf_file_path: str) -> List[Document]:
+    """
+    Extrae el texto de todas las páginas de un PDF.
+
+    Args:
+        pdf_file_path (str): Ruta completa al archivo PDF
+
+    Returns:
+        List[Document]: Un documento por página con su número de página en los metadatos
+    """
+    
+    with fitz.open(pdf_file_path) as pdf:
+        page_count = pdf.page_count
+    return _parse_pages(pdf_file_path, 0, page_count)
+
+def _embed_documents(embeddings_model, documents: List[Document]):
+    texts = [document.page_content for document in documents]
+    return texts, embed_documents_cached(embeddings_model, texts), [document.metadata for document in documents]
+
+def _add_to_vectorstore(vectorstore, embeddings_model, texts, vectors, metadatas):
+    if not texts:
+        return vectorstore
+    if vectorstore is None:
+        return FAISS.from_embeddings(text_embeddings=list(zip(texts, vectors)), embedding=embeddings_model, metadatas=metadatas)
+    vectorstore.add_embeddings(text_embeddings=list(zip(texts, vectors)), metadatas=metadatas)
+    return vectorstore
 
 # Build Vector Store.
-def build_vectorstore(embeddings_model, pdf_file_name):
+def build_vectorstore(embeddings_model, pdf_file_path, progress_callback=None):
     """
     Construye un vectorstore a partir de un archivo PDF.
 
     Esta función carga un PDF, lo divide en fragmentos más pequeños y crea un índice
     FAISS con los embeddings de estos fragmentos.
 
+    La ingesta funciona en streaming: las páginas se extraen en paralelo en el pool de
+    procesos compartido (ver get_parse_pool) por lotes de INGESTION_PAGES_PER_BATCH
+    páginas, cada lote se fragmenta y se embebe en segundo plano mientras se siguen
+    extrayendo los siguientes, y los vectores se añaden al índice de forma incremental.
+    Los fragmentos ya presentes en la caché de embeddings no se vuelven a enviar a la API.
+    Nunca se mantiene en memoria el texto completo del PDF ni todos sus vectores
+    pendientes a la vez.
+
     Args:
         embeddings_model: Modelo de embeddings a utilizar
-        pdf_file_name (str): Nombre del archivo PDF sin la extensión
+        pdf_file_path (str): Ruta completa al archivo PDF
+        progress_callback (callable, optional): Función que recibe {'completed', 'total'}
+            (páginas extraídas) tras cada lote. Si lanza una excepción, la ingesta se
+            interrumpe
 
     Returns:
         FAISS: Instancia del vector store FAISS construido
 
+    Raises:
+        ValueError: Si el PDF no contiene texto extraíble
+
     Note:
-        El PDF debe estar ubicado en el directorio 'pdf_files'
+        El número de procesos de extracción se configura con INGESTION_WORKERS y la
+        fragmentación con CHUNKING_STRATEGY, CHUNK_SIZE y CHUNK_OVERLAP (ver chunking.py)
     """
     
-    # Load pdf as langchain document object
-    pdf_file_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', "pdf_files", f'{pdf_file_name}.pdf')
-    loader = PyMuPDFLoader(pdf_file_path)
-    main_documents = loader.load()  
+    pages_per_batch = int(os.getenv("INGESTION_PAGES_PER_BATCH", "16"))
+    with fitz.open(pdf_file_path) as pdf:
+        page_count = pdf.page_count
+    page_batches = iter([(first_page, min(first_page + pages_per_batch, page_count)) for first_page in range(0, page_count, pages_per_batch)])
+    max_workers = max(1, min(int(os.getenv("INGESTION_WORKERS", "4")), -(-page_count // pages_per_batch)))
+
+    document_splitter = get_text_splitter(get_chunking_config())
+
+    vectorstore = None
+    parse_pool = get_parse_pool()
+    pending_pages = deque()
+    parsed_pages = 0
+    try:
+        with ThreadPoolExecutor(max_workers=1) as embed_pool:
+            # Bounded read-ahead: only a few page batches are parsed ahead of the embedding step
+            pending_pages.extend(parse_pool.submit(_parse_pages, pdf_file_path, *page_batch) for page_batch in islice(page_batches, 2 * max_workers))
+            pending_embeddings = None
+
+            while pending_pages:
+                main_documents = pending_pages.popleft().result()
+                parsed_pages += len(main_documents)
+                if progress_callback is not None:
+                    progress_callback({"completed": parsed_pages, "total": page_count})
+                for page_batch in islice(page_batches, 1):
+                    pending_pages.append(parse_pool.submit(_parse_pages, pdf_file_path, *page_batch))
 
-    document_splitter = RecursiveCharacterTextSplitter(
-            chunk_size=4500,
-            chunk_overlap=1000,
-            length_function=len,
-            is_separator_regex=False,
-        )
+                splitted_documents = document_splitter.split_documents(main_documents)
 
-    splitted_documents = document_splitter.split_documents(main_documents)
+                # Index the previous batch while this one is embedded
+                if pending_embeddings is not None:
+                    vectorstore = _add_to_vectorstore(vectorstore, embeddings_model, *pending_embeddings.result())
+                pending_embeddings = embed_pool.submit(_embed_documents, embeddings_model, splitted_documents)
+
+            if pending_embeddings is not None:
+                vectorstore = _add_to_vectorstore(vectorstore, embeddings_model, *pending_embeddings.result())
+    except BrokenProcessPool:
+        # A worker died (e.g. out of memory): the next ingestion starts a new pool
+        shutdown_parse_pool(parse_pool)
+        raise
+    finally:
+        # The pool is shared: do not leave this ingestion's batches queued after a failure
+        for pending_page in pending_pages:
+            pending_page.cancel()
+
+    if vectorstore is None:
+        raise ValueError(f"El PDF '{pdf_file_path}' no contiene texto extraíble")
+    return vectorstore
+
+def compute_file_hash(file_path: str) -> str:
+    """
+    Calcula el hash SHA-256 del contenido de un archivo leyéndolo por bloques.
+
+    Args:
+        file_path (str): Ruta al archivo
+
+    Returns:
+        str: Hash hexadecimal del contenido
+    """
     
-    return FAISS.from_documents(documents=splitted_documents, embedding=embeddings_model)
+    file_hash = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            file_hash.update(block)
+    return file_hash.hexdigest()
+
+def vectorstore_key(content_hash: str, embeddings_model) -> str:
+    """
+    Calcula el identificador de un vectorstore.
+
+    El identificador depende del contenido del PDF, de los parámetros de fragmentación y
+    del modelo de embeddings, de modo que un cambio en cualquiera de ellos genera un
+    vectorstore nuevo en lugar de reutilizar uno obsoleto.
+
+    Args:
+        content_hash (str): Hash SHA-256 del contenido del PDF
+        embeddings_model: Modelo de embeddings a utilizar
+
+    Returns:
+        str: Identificador del vectorstore (nombre de su carpeta en 'vectorstores')
+    """
     
-def load_vectorstore(embeddings_model, pdf_file_path):
+    identity = f"{content_hash}|{chunking_identity(get_chunking_config())}|{embeddings_model_name(embeddings_model)}"
+    return hashlib.sha256(identity.encode("utf-8")).hexdigest()[:32]
+
+def load_aliases() -> Dict[str, str]:
+    """
+    Carga la tabla de alias nombre de documento -> identificador de vectorstore.
+
+    Returns:
+        Dict[str, str]: Tabla de alias
+    """
+    
+    if not os.path.exists(ALIASES_FILE):
+        return {}
+    with open(ALIASES_FILE, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+def _save_aliases(aliases: Dict[str, str]):
+    os.makedirs(VECTORSTORES_DIR, exist_ok=True)
+    tmp_file = f"{ALIASES_FILE}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp_file, "w", encoding="utf-8") as f:
+        json.dump(aliases, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_file, ALIASES_FILE)
+
+def register_alias(vectorstore_name: str, key: str):
+    """
+    Asocia un nombre de documento con el identificador de su vectorstore.
+
+    Args:
+        vectorstore_name (str): Nombre del documento (sin extensión .pdf)
+        key (str): Identificador del vectorstore
+    """
+    
+    with _aliases_lock:
+        aliases = load_aliases()
+        if aliases.get(vectorstore_name) != key:
+            aliases[vectorstore_name] = key
+            _save_aliases(aliases)
+
+def resolve_vectorstore_path(vectorstore_name: str):
+    """
+    Retorna la carpeta del vectorstore asociado a un nombre de documento.
+
+    Args:
+        vectorstore_name (str): Nombre del documento (sin extensión .pdf)
+
+    Returns:
+        str: Ruta de la carpeta del vectorstore, o None si el nombre no tiene vectorstore
+
+    Note:
+        Los vectorstores antiguos guardados como 'vectorstores/<nombre>' siguen resolviéndose.
+    """
+    
+    key = load_aliases().get(vectorstore_name)
+    if key is not None:
+        return os.path.join(VECTORSTORES_DIR, key)
+    legacy_path = os.path.join(VECTORSTORES_DIR, vectorstore_name)
+    if os.path.isdir(legacy_path):
+        return legacy_path
+    return None
+
+def _vectorstore_identity(content_hash: str, embeddings_model) -> dict:
+    return {
+        "content_hash": content_hash,
+        "chunking": chunking_identity(get_chunking_config()),
+        "embeddings_model": embeddings_model_name(embeddings_model),
+    }
+
+def _save_identity(vectorstore_path: str, identity: dict):
+    identity_file = os.path.join(vectorstore_path, IDENTITY_FILE)
+    tmp_file = f"{identity_file}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp_file, "w", encoding="utf-8") as f:
+        json.dump(identity, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_file, identity_file)
+
+def load_identity(vectorstore_path: str):
+    """
+    Retorna el contenido, la fragmentación y el modelo de embeddings con que se creó un
+    vectorstore, o None si es un vectorstore antiguo que no los guardó.
+    """
+    
+    identity_path = os.path.join(vectorstore_path, IDENTITY_FILE)
+    if not os.path.exists(identity_path):
+        return None
+    with open(identity_path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+def _path_lock(vectorstore_path: str) -> threading.Lock:
+    with _path_locks_lock:
+        return _path_locks.setdefault(os.path.normcase(os.path.abspath(vectorstore_path)), threading.Lock())
+
+def _open_vectorstore(embeddings_model, vectorstore_path, pdf_file_path=None, content_hash=None, progress_callback=None):
+    """
+    Retorna el vectorstore de una carpeta desde la caché, desde disco o construyéndolo.
+
+    El índice léxico BM25 se guarda junto al índice FAISS y se adjunta al vectorstore
+    como atributo 'lexical_index'. Los vectorstores antiguos sin índice léxico lo
+    generan la primera vez que se cargan.
+
+    Las peticiones simultáneas de una misma carpeta esperan a que la primera la cargue o
+    la construya. Un vectorstore nuevo se escribe en una carpeta temporal que se renombra
+    al terminar, de modo que nunca se lee una carpeta a medio escribir.
+
+    Args:
+        embeddings_model: Modelo de embeddings a utilizar
+        vectorstore_path (str): Ruta de la carpeta del vectorstore
+        pdf_file_path (str, optional): Ruta al PDF, necesaria si el vectorstore no existe
+        content_hash (str, optional): Hash SHA-256 del PDF, que se guarda con la identidad
+            del vectorstore (ver load_identity)
+        progress_callback (callable, optional): Progreso de la construcción (ver build_vectorstore)
+
+    Returns:
+        FAISS: Instancia del vector store FAISS
+
+    Raises:
+        FileNotFoundError: Si el vectorstore no existe y no se indica el PDF
+    """
+    
+    vectorstore = get_cached_vectorstore(vectorstore_path)
+    if vectorstore is not None:
+        increment("rag_vectorstore_opens_total", source="cache")
+        return vectorstore
+
+    with _path_lock(vectorstore_path):
+        # Another request may have opened it while this one was waiting
+        vectorstore = get_cached_vectorstore(vectorstore_path)
+        if vectorstore is not None:
+            increment("rag_vectorstore_opens_total", source="cache")
+            return vectorstore
+
+        if os.path.exists(vectorstore_path):
+            increment("rag_vectorstore_opens_total", source="disk")
+            with span("load_vectorstore"):
+                vectorstore = FAISS.load_local(folder_path=vectorstore_path, embeddings=embeddings_model, allow_dangerous_deserialization=True)
+                lexical_index = load_lexical_index(vectorstore_path)
+        elif pdf_file_path is None:
+            raise FileNotFoundError(f"El vectorstore '{vectorstore_path}' no existe")
+        else:
+            increment("rag_vectorstore_opens_total", source="build")
+            with span("build_vectorstore"):
+                vectorstore = build_vectorstore(embeddings_model, pdf_file_path, progress_callback)
+                lexical_index = build_lexical_index(vectorstore)
+                tmp_path = f"{vectorstore_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+                vectorstore.save_local(tmp_path)
+                save_lexical_index(tmp_path, lexical_index)
+                if content_hash is not None:
+                    _save_identity(tmp_path, _vectorstore_identity(content_hash, embeddings_model))
+                try:
+                    os.rename(tmp_path, vectorstore_path)
+                except OSError:
+                    # Another process published the same vectorstore first
+                    shutil.rmtree(tmp_path, ignore_errors=True)
+
+        if lexical_index is None:
+            lexical_index = build_lexical_index(vectorstore)
+            save_lexical_index(vectorstore_path, lexical_index)
+        if content_hash is not None and load_identity(vectorstore_path) is None:
+            _save_identity(vectorstore_path, _vectorstore_identity(content_hash, embeddings_model))
+        vectorstore.lexical_index = lexical_index
+
+        cache_vectorstore(vectorstore_path, vectorstore)
+    return vectorstore
+
+def load_vectorstore(embeddings_model, pdf_file_path, vectorstore_name=None, content_hash=None, progress_callback=None):
     """
     Carga o crea un vector store FAISS para un archivo PDF.
 
-    Si existe un vector store previamente guardado, lo carga.
+    El vectorstore se identifica por el hash del contenido del PDF, los parámetros de
+    fragmentación y el modelo de embeddings. Si existe un vector store previamente guardado
+    con ese identificador, lo carga (aunque el PDF se haya subido con otro nombre).
     Si no existe, lo crea y lo guarda para uso futuro.
 
     Args:
         embeddings_model: Modelo de embeddings a utilizar
         pdf_file_path (str): Ruta completa al archivo PDF
+        vectorstore_name (str, optional): Nombre con el que el frontend se referirá al
+            vectorstore. Por defecto, el nombre del PDF sin extensión
+        content_hash (str, optional): Hash SHA-256 del PDF si ya se calculó (p. ej. durante
+            la subida). Por defecto se calcula leyendo el archivo
+        progress_callback (callable, optional): Progreso de la construcción si el
+            vectorstore no existe (ver build_vectorstore)
 
     Returns:
         FAISS: Instancia del vector store FAISS
 
     Note:
-        Los vectorstores se guardan en el directorio 'vectorstores'
+        Los vectorstores se guardan en el directorio 'vectorstores' y los ya cargados
+        se mantienen en memoria en una caché LRU del proceso.
     """
     
-    pdf_file_name = pathlib.Path(pdf_file_path).stem
-    vectorstore_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', "vectorstores", pdf_file_name)
-    if os.path.exists(vectorstore_path):
-        vectorstore = FAISS.load_local(folder_path=vectorstore_path, embeddings=embeddings_model, allow_dangerous_deserialization=True)
-    else:
-        vectorstore = build_vectorstore(embeddings_model, pdf_file_name)
-        vectorstore.save_local(vectorstore_path)
+    if vectorstore_name is None:
+        vectorstore_name = pathlib.Path(pdf_file_path).stem
+    if content_hash is None:
+        content_hash = compute_file_hash(pdf_file_path)
+    key = vectorstore_key(content_hash, embeddings_model)
+    vectorstore_path = os.path.join(VECTORSTORES_DIR, key)
+
+    vectorstore = _open_vectorstore(embeddings_model, vectorstore_path, pdf_file_path, content_hash, progress_callback)
+    register_alias(vectorstore_name, key)
     return vectorstore
 
+def load_vectorstore_by_name(embeddings_model, vectorstore_name: str):
+    """
+    Carga el vector store FAISS asociado a un nombre de documento ya procesado.
+
+    Args:
+        embeddings_model: Modelo de embeddings a utilizar
+        vectorstore_name (str): Nombre del documento (sin extensión .pdf)
+
+    Returns:
+        FAISS: Instancia del vector store FAISS
+
+    Raises:
+        FileNotFoundError: Si el documento no tiene vectorstore o su carpeta ya no existe
+        VectorstoreMismatch: Si el vectorstore se creó con otro modelo de embeddings o con
+            otra fragmentación y no hay uno del mismo PDF con la configuración actual
+
+    Note:
+        Si el documento se volvió a procesar con la configuración actual (p. ej. subido con
+        otro nombre), el alias pasa a apuntar a ese vectorstore.
+    """
+    
+    vectorstore_path = resolve_vectorstore_path(vectorstore_name)
+    if vectorstore_path is None or not os.path.isdir(vectorstore_path):
+        raise FileNotFoundError(f"No existe vectorstore para '{vectorstore_name}'")
+
+    identity = load_identity(vectorstore_path)
+    if identity is not None and identity != _vectorstore_identity(identity["content_hash"], embeddings_model):
+        key = vectorstore_key(identity["content_hash"], embeddings_model)
+        current_path = os.path.join(VECTORSTORES_DIR, key)
+        if not os.path.isdir(current_path):
+            raise VectorstoreMismatch(
+                f"El vectorstore de '{vectorstore_name}' se creó con el modelo de embeddings "
+                f"'{identity['embeddings_model']}' y la fragmentación '{identity['chunking']}'; "
+                f"vuelva a subir el documento para procesarlo con la configuración actual")
+        register_alias(vectorstore_name, key)
+        vectorstore_path = current_path
+
+    return _open_vectorstore(embeddings_model, vectorstore_path)
+
+def delete_vectorstore(vectorstore_name: str):
+    """
+    Elimina el alias de un documento y, si ningún otro alias lo usa, su vectorstore.
+
+    Args:
+        vectorstore_name (str): Nombre del documento (sin extensión .pdf)
+
+    Returns:
+        str: Ruta del vectorstore desvinculado, o None si el nombre no tenía vectorstore
+    """
+    
+    with _aliases_lock:
+        vectorstore_path = resolve_vectorstore_path(vectorstore_name)
+        if vectorstore_path is None:
+            return None
+
+        aliases = load_aliases()
+        key = aliases.pop(vectorstore_name, None)
+        if key is not None:
+            _save_aliases(aliases)
+
+        if key is None or key not in aliases.values():
+            shutil.rmtree(vectorstore_path, ignore_errors=True)
+            invalidate_vectorstore(vectorstore_path)
+    return vectorstore_path
+
+def _query_matrix(vectorstore: FAISS, query_vectors) -> np.ndarray:
+    query_matrix = np.array(query_vectors, dtype=np.float32)
+    # Old vectorstores do not record their embeddings model: at least catch a different dimension
+    if query_matrix.shape[1] != vectorstore.index.d:
+        raise VectorstoreMismatch(f"El vectorstore tiene vectores de dimensión {vectorstore.index.d} y el modelo "
+                                  f"de embeddings de dimensión {query_matrix.shape[1]}; vuelva a subir el documento")
+    if vectorstore._normalize_L2:
+        query_matrix /= np.linalg.norm(query_matrix, axis=1, keepdims=True)
+    return query_matrix
+
+def _dense_search(vectorstore: FAISS, query_matrix: np.ndarray, k: int) -> List[List[str]]:
+    _, indices = vectorstore.index.search(query_matrix, k)
+    return [[vectorstore.index_to_docstore_id[i] for i in row if i != -1] for row in indices]
+
+def _retrieval_mode() -> str:
+    return os.getenv("RETRIEVAL_MODE", "dense").lower()
+
+def _rerank_mode() -> str:
+    return os.getenv("RETRIEVAL_RERANK", "none").lower()
+
+def uses_fetch_k() -> bool:
+    """
+    Indica si la recuperación configurada usa fetch_k (DOCUMENTS_TO_RETRIEVE): la búsqueda
+    híbrida y el re-ranking MMR trabajan sobre un conjunto de candidatos más amplio, y la
+    búsqueda densa simple recupera directamente top_k fragmentos.
+    """
+    
+    return _retrieval_mode() == "hybrid" or _rerank_mode() == "mmr"
+
+def _candidates_to_fetch(top_k, fetch_k) -> int:
+    if uses_fetch_k():
+        return max(top_k, fetch_k)
+    return top_k
+
+def mmr_rerank(vectorstore: FAISS, query_vector: np.ndarray, candidate_ids: List[str], top_k, lambda_mult: float) -> List[str]:
+    """
+    Reordena candidatos con Maximal Marginal Relevance sobre sus vectores almacenados.
+
+    En cada paso se elige el candidato que maximiza
+    lambda * similitud(consulta) - (1 - lambda) * máxima similitud con los ya elegidos,
+    de modo que los fragmentos casi duplicados (p. ej. por el solapamiento entre
+    fragmentos consecutivos) se penalizan. Todas las similitudes se calculan con
+    operaciones matriciales de NumPy.
+
+    Args:
+        vectorstore (FAISS): vector store FAISS
+        query_vector (np.ndarray): Vector de la consulta
+        candidate_ids (List[str]): Ids del docstore de los candidatos
+        top_k (int): Número de documentos a retornar
+        lambda_mult (float): Peso de la relevancia frente a la diversidad (entre 0 y 1)
+
+    Returns:
+        List[str]: Ids del docstore seleccionados, en orden de selección
+    """
+    
+    if len(candidate_ids) <= 1:
+        return candidate_ids[:top_k]
+
+    docstore_id_to_index = {docstore_id: index for index, docstore_id in vectorstore.index_to_docstore_id.items()}
+    candidate_vectors = vectorstore.index.reconstruct_batch(np.array([docstore_id_to_index[docstore_id] for docstore_id in candidate_ids], dtype=np.int64))
+    candidate_vectors = candidate_vectors / np.maximum(np.linalg.norm(candidate_vectors, axis=1, keepdims=True), 1e-12)
+    query_vector = query_vector / max(np.linalg.norm(query_vector), 1e-12)
+
+    relevance = candidate_vectors @ query_vector
+    redundancy = np.full(len(candidate_ids), -np.inf, dtype=np.float32)
+    available = np.ones(len(candidate_ids), dtype=bool)
+    selected = []
+    for _ in range(min(top_k, len(candidate_ids))):
+        scores = lambda_mult * relevance - (1 - lambda_mult) * np.where(np.isinf(redundancy), 0, redundancy)
+        scores[~available] = -np.inf
+        best = int(np.argmax(scores))
+        selected.append(best)
+        available[best] = False
+        redundancy = np.maximum(redundancy, candidate_vectors @ candidate_vectors[best])
+    return [candidate_ids[position] for position in selected]
+
+def _rank_candidates(vectorstore: FAISS, query: str, query_vector: np.ndarray, dense_ids: List[str], top_k) -> List[str]:
+    candidate_ids = dense_ids
+    lexical_index = getattr(vectorstore, "lexical_index", None)
+    if _retrieval_mode() == "hybrid" and lexical_index is not None:
+        lexical_ids = [docstore_id for docstore_id, _ in bm25_search(lexical_index, query, len(dense_ids))]
+        candidate_ids = reciprocal_rank_fusion([dense_ids, lexical_ids], k=int(os.getenv("RRF_K", "60")))[:len(dense_ids)]
+    if _rerank_mode() == "mmr":
+        return mmr_rerank(vectorstore, query_vector, candidate_ids, top_k, float(os.getenv("MMR_LAMBDA", "0.5")))
+    return candidate_ids[:top_k]
+
+def _documents(vectorstore: FAISS, docstore_ids: List[str]) -> List[Document]:
+    return [vectorstore.docstore.search(docstore_id) for docstore_id in docstore_ids]
+
 def extract_top_documents(vectorstore: FAISS, prompt_request, top_k, fetch_k):
     """
     Extrae los documentos más similares a una consulta del vector store 
 
+    Con RETRIEVAL_MODE='hybrid' se recuperan 'fetch_k' candidatos por similitud de
+    embeddings y otros tantos por BM25, y se fusionan con Reciprocal Rank Fusion. Con
+    RETRIEVAL_RERANK='mmr' los 'fetch_k' candidatos se reordenan con MMR (MMR_LAMBDA)
+    para descartar fragmentos redundantes.
+
     Args:
         vectorstore (FAISS): vector store FAISS
         prompt_request (str): Consulta para buscar documentos similares
@@ -83,21 +617,108 @@ def extract_top_documents(vectorstore: FAISS, prompt_request, top_k, fetch_k):
         fetch_k (int): Número de documentos a recuperar antes de filtrar
 
     Returns:
-        List[str]: Lista de contenidos de los documentos más similares
+        List[Document]: Lista de los documentos más similares, ordenados por relevancia
     """
-    return [document.page_content for document in vectorstore.similarity_search(query=prompt_request, k=top_k, fetch_k=fetch_k)]
+    
+    with span("query_embedding"):
+        query_vector = vectorstore._embed_query(prompt_request)
+    with span("similarity_search"):
+        query_matrix = _query_matrix(vectorstore, [query_vector])
+        dense_ids = _dense_search(vectorstore, query_matrix, _candidates_to_fetch(top_k, fetch_k))[0]
+        return _documents(vectorstore, _rank_candidates(vectorstore, prompt_request, query_matrix[0], dense_ids, top_k))
 
-def parse_document(docs: List[Document]) -> str:
+def load_query_embeddings(embeddings_model, queries: List[str]) -> Dict[str, List[float]]:
+    """
+    Retorna los embeddings de una lista de consultas, calculándolos en una única llamada.
+
+    Los vectores se persisten en '<EMBEDDINGS_CACHE_DIR>/queries_<modelo>.json', de modo que las
+    consultas del retriever (iguales para todos los documentos) solo se embeben una vez por
+    modelo de embeddings. Únicamente las consultas nuevas se envían a la API.
+
+    Args:
+        embeddings_model: Modelo de embeddings a utilizar
+        queries (List[str]): Consultas a embeber
+
+    Returns:
+        Dict[str, List[float]]: Diccionario consulta -> vector
+    """
+    
+    model_name = embeddings_model_name(embeddings_model)
+    cache_dir = embedding_cache.EMBEDDINGS_CACHE_DIR
+    cache_path = os.path.join(cache_dir, f"queries_{model_name.replace('/', '_')}.json")
+
+    query_embeddings = _load_query_embeddings_file(cache_path)
+
+    missing_queries = [query for query in dict.fromkeys(queries) if query not in query_embeddings]
+    if missing_queries:
+        with span("query_embedding"):
+            new_embeddings = dict(zip(missing_queries, embeddings_model.embed_documents(missing_queries)))
+        query_embeddings.update(new_embeddings)
+        # Re-read under the lock so entries written by other threads meanwhile are kept
+        with _query_embeddings_lock:
+            stored_embeddings = _load_query_embeddings_file(cache_path)
+            stored_embeddings.update(new_embeddings)
+            os.makedirs(cache_dir, exist_ok=True)
+            tmp_file = f"{cache_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(tmp_file, "w", encoding="utf-8") as f:
+                json.dump(stored_embeddings, f)
+            os.replace(tmp_file, cache_path)
+
+    return {query: query_embeddings[query] for query in queries}
+
+def _load_query_embeddings_file(cache_path: str) -> Dict[str, List[float]]:
+    if not os.path.exists(cache_path):
+        return {}
+    with open(cache_path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+def extract_top_documents_batch(vectorstore: FAISS, query_embeddings: Dict[str, List[float]], top_k, fetch_k) -> Dict[str, List[Document]]:
+    """
+    Extrae los documentos más similares para varias consultas con una única búsqueda en el índice.
+
+    Todas las consultas se apilan en una matriz y se puntúan contra los vectores de los
+    fragmentos del documento en una sola llamada a 'index.search' de FAISS. Con
+    RETRIEVAL_MODE='hybrid' cada consulta se fusiona además con su ranking BM25, y con
+    RETRIEVAL_RERANK='mmr' sus candidatos se reordenan con MMR.
+
+    Args:
+        vectorstore (FAISS): vector store FAISS
+        query_embeddings (Dict[str, List[float]]): Diccionario consulta -> vector
+        top_k (int): Número de documentos a retornar por consulta
+        fetch_k (int): Número de documentos a recuperar antes de filtrar
+
+    Returns:
+        Dict[str, List[Document]]: Diccionario consulta -> documentos más similares, ordenados por relevancia
+    """
+    
+    queries = list(query_embeddings.keys())
+    with span("similarity_search"):
+        query_matrix = _query_matrix(vectorstore, [query_embeddings[query] for query in queries])
+        dense_ids = _dense_search(vectorstore, query_matrix, _candidates_to_fetch(top_k, fetch_k))
+
+        return {
+            query: _documents(vectorstore, _rank_candidates(vectorstore, query, query_vector, query_dense_ids, top_k))
+            for query, query_vector, query_dense_ids in zip(queries, query_matrix, dense_ids)
+        }
+
+def parse_document(docs: List[Document], max_tokens: int = None) -> str:
     """
     Combina una lista de documentos en una única cadena de texto.
 
+    Los fragmentos solapados se fusionan sin repetir texto, se ordenan por su posición en
+    el documento y se recortan al presupuesto de tokens descartando primero los menos
+    relevantes (ver context_builder.build_context).
+
     Args:
-        docs (List[Document]): Lista de documentos a combinar
+        docs (List[Document]): Lista de documentos a combinar, ordenados por relevancia
+        max_tokens (int, optional): Presupuesto de tokens del contexto. Por defecto
+            CONTEXT_MAX_TOKENS
 
     Returns:
         str: Cadena de texto combinada con los contenidos de los documentos
     """
-    return "\n".join([doc for doc in docs])
+    with span("parse_document"):
+        return build_context(docs, max_tokens=max_tokens)
 
 def load_retriever_queries():    
     """
@@ -107,10 +728,8 @@ def load_retriever_queries():
         dict: Diccionario con las consultas de recuperación
 
     Note:
-        El archivo JSON está ubicado en 'backend/variables_queries.json'
+        El archivo JSON está ubicado en 'backend/variables_queries.json' y se mantiene
+        cacheado en memoria hasta que cambia en disco.
     """
    
-    with open("backend/variables_queries.json", "r", encoding="utf-8") as f:
-        json_data = json.load(f)
-        
-    return json_data
\ No newline at end of file
+    return load_json_config("variables_queries.json")
\ No newline at end of file
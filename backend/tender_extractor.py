@@ -2,18 +2,21 @@ import os
 import json
 import re
 import pathlib
-import pickle
+import contextvars
+from concurrent.futures import ThreadPoolExecutor, as_completed
 import pandas as pd
 from ragas import SingleTurnSample
 
-from augmented_generator import llm_response
+from augmented_generator import llm_response, response_usage, is_cache_hit
 from evaluation_pipeline import rag_system_evaluation, load_ground_truth
-from utils import load_secrets, get_embeddings_model
-from prompt_engineering import SUMMARIZER_PROMPT_SYSTEM, SUMMARIZER_PROMPT_USER
-from retriever import load_vectorstore, extract_top_documents, parse_document, load_retriever_queries
+from utils import init_runtime, get_embeddings_model, load_json_config, count_tokens
+from prompt_engineering import SUMMARIZER_PROMPT_SYSTEM, SUMMARIZER_PROMPT_USER, GROUPED_SUMMARIZER_PROMPT_SYSTEM, GROUPED_SUMMARIZER_PROMPT_USER
+from retriever import load_vectorstore, load_query_embeddings, extract_top_documents_batch, parse_document, load_retriever_queries
+from trace_store import start_run, record_sample, record_llm_call
+from context_builder import context_token_budget, prompt_token_limit, TokenBudget, TokenBudgetExceeded
 
 
-def tender_data_extractor(pdf_file_path):
+def tender_data_extractor(pdf_file_path, progress_callback=None, file_name=None, content_hash=None):
     """
     Extrae información estructurada de un documento de licitación en PDF.
 
@@ -22,74 +25,272 @@ def tender_data_extractor(pdf_file_path):
 
     Args:
         pdf_file_path (str): Ruta al archivo PDF de la licitación
+        progress_callback (callable, optional): Función que recibe un diccionario por cada
+            evento de progreso: {'stage': 'ingestion', 'status': 'started' | 'completed'},
+            {'stage': 'ingestion', 'status': 'progress', 'completed', 'total'} por cada lote
+            de páginas extraído si el vectorstore se construye,
+            {'stage': 'variable', 'variable', 'answer', 'completed', 'total', 'usage'} al
+            terminar cada variable y {'stage': 'usage', 'calls', 'prompt_tokens',
+            'completion_tokens', 'total_tokens'} al final. Si lanza una excepción, la
+            extracción se interrumpe
+        file_name (str, optional): Nombre original del PDF (para el alias del vectorstore y
+            los datos de validación) si se guardó con un nombre temporal. Por defecto, el
+            nombre del archivo en pdf_file_path
+        content_hash (str, optional): Hash SHA-256 del PDF si ya se calculó durante la subida
 
     Returns:
         dict: Diccionario ordenado con la información extraída para cada variable
 
     Note:
-        Utiliza variables globales 'referencias', 'queries' y 'rag_result' para
-        almacenar datos intermedios necesarios para la evaluación del sistema RAG.
+        Cada llamada es una ejecución independiente en el registro de trazas (ver
+        trace_store.py), donde se guardan las muestras necesarias para la evaluación
+        del sistema RAG.
+        Las variables (o grupos de variables, ver group_variables) se procesan en paralelo
+        con un máximo de EXTRACTION_MAX_WORKERS hilos; si una variable falla, su valor
+        contiene el mensaje de error.
+        Los prompts de todas las llamadas al LLM del documento suman como máximo
+        EXTRACTION_MAX_PROMPT_TOKENS tokens (ver budgeted_llm_call).
     """
     
-    # First, load the secrets files to access environmental variables
-    load_secrets([".env.file", ".env.secrets"])
+    # Make sure secrets and shared clients are loaded (no-op after app startup)
+    init_runtime()
 
-    file_name = pathlib.Path(pdf_file_path).name
+    if file_name is None:
+        file_name = pathlib.Path(pdf_file_path).name
     
+    def report(**event):
+        if progress_callback is not None:
+            progress_callback(event)
+
     # Load vectorstore
-    vectorstore = load_vectorstore(embeddings_model=get_embeddings_model(), pdf_file_path=pdf_file_path)
+    report(stage="ingestion", status="started")
+    embeddings_model = get_embeddings_model()
+    vectorstore = load_vectorstore(
+        embeddings_model=embeddings_model,
+        pdf_file_path=pdf_file_path,
+        vectorstore_name=pathlib.Path(file_name).stem,
+        content_hash=content_hash,
+        progress_callback=lambda event: report(stage="ingestion", status="progress", **event),
+    )
+    report(stage="ingestion", status="completed")
 
     # Variables to resume
     variables_to_resume = load_variables_to_resume()
     ordered_variables = [list(variable.keys())[0] for variable in variables_to_resume]
         
-    global referencias 
-    referencias = load_ground_truth(file_name)
-    
-    global queries
-    queries =  load_retriever_queries()
+    # Per-run state shared by the extraction threads
+    queries = load_retriever_queries()
+    run = {
+        "run_id": start_run(file_name),
+        "queries": queries,
+        "references": load_ground_truth(file_name),
+        "llm_calls": [],
+        "variable_usage": {},
+    }
     
     # Set number of docs to retrieve
     fetch_k = int(os.getenv("DOCUMENTS_TO_RETRIEVE"))
     top_k = int(os.getenv("DOCUMENTS_TO_FETCH"))
 
+    # RAG to get context for all variables: queries embedded in one batch and searched in one call
+    query_embeddings = load_query_embeddings(embeddings_model, [queries[variable] for variable in ordered_variables])
+    top_documents = extract_top_documents_batch(vectorstore, query_embeddings, top_k=top_k, fetch_k=fetch_k)
+
+    # Variables extracted together in a single LLM call (one variable per group unless EXTRACTION_MODE=grouped)
+    variable_groups = group_variables(ordered_variables, top_documents, queries)
+
+    # Prompt tokens available for the whole document, shared among its LLM calls
+    run["token_budget"] = TokenBudget(int(os.getenv("EXTRACTION_MAX_PROMPT_TOKENS", "0")), calls=len(variable_groups))
+
+    # Max number of groups extracted concurrently
+    max_workers = int(os.getenv("EXTRACTION_MAX_WORKERS", "4"))
+
     # Empty dict to return the info of each variable
     tender_resume = {}
 
-    # Objects to evaluate the RAG system.
-    global rag_result   
-    rag_result = []
-    
-    for variable_info in variables_to_resume:
-        summary_variable, summary_variable_info = process_variable(variable_info, vectorstore, top_k, fetch_k) # Get variable and extracted answer from LLM.
-        tender_resume[summary_variable] = summary_variable_info
+    # Each group is an independent LLM call, so they run in a bounded worker pool
+    variables_info = {list(variable_info.keys())[0]: variable_info for variable_info in variables_to_resume}
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        # Each group runs in a copy of the caller's context, so its stages and tokens count towards the request
+        futures = {
+            executor.submit(contextvars.copy_context().run, process_variable_group, [variables_info[variable] for variable in variable_group], top_documents, run): variable_group
+            for variable_group in variable_groups
+        }
+        try:
+            for future in as_completed(futures):
+                variable_group = futures[future]
+                try:
+                    group_resume = future.result() # Get variables and extracted answers from LLM.
+                except Exception as e:
+                    # A failing variable must not break the extraction of the rest
+                    group_resume = {variable: f"Error al extraer la información: {e}" for variable in variable_group}
+                tender_resume.update(group_resume)
+                for variable, answer in group_resume.items():
+                    report(stage="variable", variable=variable, answer=answer, completed=len(tender_resume), total=len(ordered_variables),
+                           usage=run["variable_usage"].get(variable))
+        except BaseException:
+            # Interrupted (e.g. job cancelled): drop the groups that have not started yet
+            executor.shutdown(wait=False, cancel_futures=True)
+            raise
         
     ordered_tender_resume = {key: tender_resume[key] for key in ordered_variables if key in tender_resume}
 
-    # Guardar la lista en un archivo
-    with open("rag_result.pkl", "wb") as f:
-        pickle.dump(rag_result, f)
+    report(stage="usage", calls=len(run["llm_calls"]), **{
+        field: sum(call[field] for call in run["llm_calls"]) for field in ("prompt_tokens", "completion_tokens", "total_tokens")
+    })
 
     return ordered_tender_resume
 
-def process_variable(variable_info, vectorstore, top_k, fetch_k):
+def process_variable(variable_info, top_documents, run):
     """
     Procesa una variable específica para extraer su información del documento.
 
     Args:
         variable_info (dict): Diccionario con la variable y su definición
-        vectorstore: Instancia del almacén de vectores
-        top_k (int): Número de documentos a retornar
-        fetch_k (int): Número de documentos a recuperar
+        top_documents (dict): Diccionario consulta -> documentos recuperados
+        run (dict): Ejecución en curso (id, consultas y respuestas de referencia)
 
     Returns:
         tuple: (nombre_variable, información_extraída)
     """
     
     variable, variable_definition = list(variable_info.items())[0]
-    variable_info = add_variable_info(variable, variable_definition, vectorstore, top_k=top_k, fetch_k=fetch_k)
+    variable_info = add_variable_info(variable, variable_definition, top_documents[run["queries"][variable]], run)
     return variable, variable_info
 
+def group_variables(ordered_variables, top_documents, queries):
+    """
+    Agrupa las variables cuyos fragmentos recuperados se solapan.
+
+    Con EXTRACTION_MODE='grouped' una variable se une a un grupo existente si la similitud
+    de Jaccard entre sus fragmentos y los de cada miembro del grupo es al menos
+    EXTRACTION_GROUP_MIN_OVERLAP, hasta EXTRACTION_GROUP_MAX_SIZE variables por grupo.
+    En cualquier otro modo cada variable forma su propio grupo.
+
+    Args:
+        ordered_variables (list): Variables a extraer, en orden
+        top_documents (dict): Diccionario consulta -> documentos recuperados
+        queries (dict): Diccionario variable -> consulta
+
+    Returns:
+        list: Lista de grupos (listas de variables)
+    """
+    
+    if os.getenv("EXTRACTION_MODE", "per_variable").lower() != "grouped":
+        return [[variable] for variable in ordered_variables]
+
+    min_overlap = float(os.getenv("EXTRACTION_GROUP_MIN_OVERLAP", "0.5"))
+    max_group_size = int(os.getenv("EXTRACTION_GROUP_MAX_SIZE", "4"))
+    chunk_sets = {variable: {document.page_content for document in top_documents[queries[variable]]} for variable in ordered_variables}
+
+    def overlap(variable_a, variable_b):
+        union = chunk_sets[variable_a] | chunk_sets[variable_b]
+        return len(chunk_sets[variable_a] & chunk_sets[variable_b]) / len(union) if union else 0.0
+
+    variable_groups = []
+    for variable in ordered_variables:
+        for variable_group in variable_groups:
+            if len(variable_group) < max_group_size and all(overlap(variable, member) >= min_overlap for member in variable_group):
+                variable_group.append(variable)
+                break
+        else:
+            variable_groups.append([variable])
+    return variable_groups
+
+def process_variable_group(variable_group_info, top_documents, run):
+    """
+    Extrae la información de un grupo de variables con una única llamada al LLM.
+
+    El contexto es la unión (sin duplicados) de los fragmentos recuperados para cada
+    variable y se pide al modelo un objeto JSON con una clave por variable. Las variables
+    ausentes o con un valor no válido en la respuesta se extraen individualmente.
+
+    Args:
+        variable_group_info (list): Lista de diccionarios variable -> definición
+        top_documents (dict): Diccionario consulta -> documentos recuperados
+        run (dict): Ejecución en curso (id, consultas y respuestas de referencia)
+
+    Returns:
+        dict: Diccionario variable -> información extraída
+    """
+    
+    if len(variable_group_info) == 1:
+        return dict([process_variable(variable_group_info[0], top_documents, run)])
+
+    queries = run["queries"]
+
+    variable_definitions = dict(list(variable_info.items())[0] for variable_info in variable_group_info)
+    group_documents = list({
+        document.page_content: document for variable in variable_definitions for document in top_documents[queries[variable]]
+    }.values())
+
+    # The group call and its per-variable retries share the group's part of the document budget
+    group_budget = run["token_budget"].split()
+    try:
+        # Generate llm response as a JSON object with one key per variable
+        campos = json.dumps(variable_definitions, ensure_ascii=False, indent=2)
+        llm_answer, llm_call = budgeted_llm_call(
+            run,
+            list(variable_definitions),
+            GROUPED_SUMMARIZER_PROMPT_SYSTEM,
+            lambda llm_context: GROUPED_SUMMARIZER_PROMPT_USER.format(campos=campos, contexto=llm_context),
+            group_documents,
+            token_budget=group_budget,
+            json_output=True,
+            max_tokens=512 * len(variable_definitions),
+        )
+        group_answers = parse_group_answer(llm_answer, variable_definitions)
+        group_budget.add_calls(len(variable_definitions) - len(group_answers))
+
+        group_resume = {}
+        for variable, variable_definition in variable_definitions.items():
+            if variable in group_answers:
+                group_resume[variable] = group_answers[variable]
+                run["variable_usage"][variable] = llm_call
+                sample = SingleTurnSample(
+                    user_input=queries[variable],
+                    retrieved_contexts=[document.page_content for document in group_documents],
+                    response=group_answers[variable],
+                    reference=run["references"].get(variable)
+                )
+                record_sample(run["run_id"], variable, sample.model_dump())
+            else:
+                try:
+                    group_resume[variable] = add_variable_info(variable, variable_definition, top_documents[queries[variable]], run, group_budget)
+                except TokenBudgetExceeded as e:
+                    # Only this retry is skipped: the group's answers are kept
+                    group_resume[variable] = f"Error al extraer la información: {e}"
+        return group_resume
+    finally:
+        group_budget.close()
+
+def parse_group_answer(llm_answer, variable_definitions):
+    """
+    Valida la respuesta JSON del LLM para un grupo de variables.
+
+    Args:
+        llm_answer (str): Respuesta del LLM
+        variable_definitions (dict): Diccionario variable -> definición del grupo
+
+    Returns:
+        dict: Respuestas válidas (texto no vacío) de las variables del grupo
+    """
+    
+    answer = llm_answer.strip()
+    if answer.startswith("```"):
+        answer = answer.strip("`").removeprefix("json").strip()
+    try:
+        parsed_answer = json.loads(answer)
+    except json.JSONDecodeError:
+        return {}
+    if not isinstance(parsed_answer, dict):
+        return {}
+    return {
+        variable: value.strip()
+        for variable, value in parsed_answer.items()
+        if variable in variable_definitions and isinstance(value, str) and value.strip()
+    }
+
 def load_variables_to_resume():
     """
     Carga la lista de variables a extraer desde un archivo JSON.
@@ -99,48 +300,111 @@ def load_variables_to_resume():
     """
     
     # Load json with variables names
-    with open("backend/variables_to_extract.json", "r", encoding="utf-8") as f:
-        json_data = json.load(f)
+    json_data = load_json_config("variables_to_extract.json")
     return json_data["variables"]
 
-def add_variable_info(variable, variable_definition, vectorstore, top_k, fetch_k):
+def add_variable_info(variable, variable_definition, top_documents, run, token_budget=None):
     """
     Extrae información específica para una variable utilizando RAG.
 
     Args:
         variable (str): Nombre de la variable a extraer
         variable_definition (str): Definición de la variable
-        vectorstore: Instancia del almacén de vectores
-        top_k (int): Número de documentos a retornar
-        fetch_k (int): Número de documentos a recuperar
+        top_documents (List[Document]): Documentos recuperados para la consulta de la variable
+        run (dict): Ejecución en curso (id, consultas y respuestas de referencia)
+        token_budget (TokenBudget, optional): Presupuesto de la llamada. Por defecto el del documento
 
     Returns:
         str: Información extraída para la variable
 
     Note:
-        Agrega la muestra generada a 'rag_result' para evaluación posterior
+        Registra la muestra generada en la ejecución para evaluación posterior
     """
     
-    # RAG to get context for given variable
-    rag_query = queries[variable]
-    top_documents = extract_top_documents(vectorstore, prompt_request=rag_query, top_k=top_k, fetch_k=fetch_k)
-    llm_context = parse_document(top_documents)
+    # Context for given variable
+    rag_query = run["queries"][variable]
     
     # Generate llm response
-    prompt_user = SUMMARIZER_PROMPT_USER.format(variable=variable, definicion_variable= variable_definition, contexto=llm_context)
-    llm_answer = llm_response(prompt_system=SUMMARIZER_PROMPT_SYSTEM, prompt_user=prompt_user).choices[0].message.content    
+    llm_answer, run["variable_usage"][variable] = budgeted_llm_call(
+        run,
+        [variable],
+        SUMMARIZER_PROMPT_SYSTEM,
+        lambda llm_context: SUMMARIZER_PROMPT_USER.format(variable=variable, definicion_variable= variable_definition, contexto=llm_context),
+        top_documents,
+        token_budget=token_budget,
+    )
     
     # Sample para Evaluacion
     sample = SingleTurnSample(
         user_input=rag_query,
-        retrieved_contexts=top_documents,
+        retrieved_contexts=[document.page_content for document in top_documents],
         response=llm_answer,
-        reference=referencias[variable]
+        reference=run["references"].get(variable)
     )
       
-    rag_result.append(sample)
+    record_sample(run["run_id"], variable, sample.model_dump())
 
     return llm_answer
+
+def budgeted_llm_call(run, variables, prompt_system, build_prompt_user, documents, token_budget=None, **llm_kwargs):
+    """
+    Llama al LLM con el contexto recortado al presupuesto de tokens y registra su consumo.
+
+    Antes de la llamada se cuentan los tokens del prompt sin contexto y el contexto se
+    limita a lo que cabe en LLM_MAX_PROMPT_TOKENS y en la parte del presupuesto del
+    documento asignada a la llamada, descartando primero los fragmentos menos relevantes
+    (ver context_builder.build_context). Los tokens no usados vuelven al presupuesto.
+    Si el prompt no cabe ni sin contexto, la llamada no se envía.
+
+    Args:
+        run (dict): Ejecución en curso (presupuesto de tokens y registro de llamadas)
+        variables (list): Variables que resuelve la llamada
+        prompt_system (str): Prompt de sistema
+        build_prompt_user (callable): Función contexto -> prompt de usuario
+        documents (List[Document]): Documentos recuperados, ordenados por relevancia
+        token_budget (TokenBudget, optional): Presupuesto del que se reserva la llamada. Por
+            defecto el del documento
+        **llm_kwargs: Argumentos adicionales para llm_response
+
+    Returns:
+        tuple: (respuesta del LLM, consumo de la llamada con 'variables', 'prompt_tokens',
+            'completion_tokens', 'total_tokens', 'counted_prompt_tokens' y 'cached'; las
+            respuestas servidas desde la caché del LLM no consumen tokens ni presupuesto)
+
+    Raises:
+        TokenBudgetExceeded: Si el prompt supera LLM_MAX_PROMPT_TOKENS o la asignación del
+            presupuesto del documento
+    """
+
+    if token_budget is None:
+        token_budget = run["token_budget"]
+    allowance = token_budget.reserve()
+    sent_tokens = 0
+    try:
+        max_context_tokens = context_token_budget(prompt_system, build_prompt_user(""), allowance)
+        prompt_user = build_prompt_user(parse_document(documents, max_tokens=max_context_tokens))
+        prompt_tokens = count_tokens(prompt_system) + count_tokens(prompt_user)
+        prompt_limit = prompt_token_limit(allowance)
+        if prompt_limit is not None and prompt_tokens > prompt_limit:
+            raise TokenBudgetExceeded(f"El prompt ({prompt_tokens} tokens) supera el límite de {prompt_limit} tokens de la llamada")
+        sent_tokens = prompt_tokens
+        response = llm_response(prompt_system=prompt_system, prompt_user=prompt_user, **llm_kwargs)
+        cached = is_cache_hit(response)
+        if cached:
+            # Served from the LLM cache: nothing consumed, nothing charged to the budget
+            sent_tokens = 0
+    finally:
+        token_budget.release(allowance, sent_tokens)
+
+    # Usage reported by litellm (the local count is kept to compare with the budget)
+    if cached:
+        usage = {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0}
+    else:
+        usage = response_usage(response) or {"prompt_tokens": prompt_tokens, "completion_tokens": 0, "total_tokens": prompt_tokens}
+    llm_call = {"variables": variables, **usage, "counted_prompt_tokens": prompt_tokens, "cached": cached}
+    run["llm_calls"].append(llm_call)
+    record_llm_call(run["run_id"], llm_call)
+    return response.choices[0].message.content, llm_call
         
 
 if __name__ == '__main__':
@@ -0,0 +1,155 @@
+import os
+import json
+import time
+import uuid
+import queue
+import atexit
+import logging
+import threading
+from typing import List
+
+
+TRACES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', "traces")
+
+_records = queue.Queue()
+_writer = None
+_writer_lock = threading.Lock()
+
+logger = logging.getLogger("rag.traces")
+
+
+def _run_path(run_id: str) -> str:
+    return os.path.join(TRACES_DIR, f"{os.path.basename(run_id)}.jsonl")
+
+def _write_records():
+    while True:
+        batch = [_records.get()]
+        # Drain whatever else is queued so each file is opened once per batch
+        while True:
+            try:
+                batch.append(_records.get_nowait())
+            except queue.Empty:
+                break
+        try:
+            lines_by_run = {}
+            for run_id, record in batch:
+                lines_by_run.setdefault(run_id, []).append(json.dumps(record, ensure_ascii=False, default=str) + "\n")
+            os.makedirs(TRACES_DIR, exist_ok=True)
+            for run_id, lines in lines_by_run.items():
+                with open(_run_path(run_id), "a", encoding="utf-8") as f:
+                    f.writelines(lines)
+        except Exception:
+            # A failed batch is lost, but the writer keeps consuming so flush_traces never hangs
+            logger.exception("Could not write %d trace records", len(batch))
+        finally:
+            for _ in batch:
+                _records.task_done()
+
+def _append(run_id: str, record: dict):
+    global _writer
+    with _writer_lock:
+        if _writer is None or not _writer.is_alive():
+            _writer = threading.Thread(target=_write_records, name="trace-writer", daemon=True)
+            _writer.start()
+    _records.put((run_id, record))
+
+def start_run(file_name: str) -> str:
+    """
+    Crea una nueva ejecución de extracción en el registro de trazas.
+
+    Args:
+        file_name (str): Nombre del PDF procesado
+
+    Returns:
+        str: Id de la ejecución (ordenable por fecha de creación)
+    """
+
+    run_id = f"{time.strftime('%Y%m%d-%H%M%S')}-{uuid.uuid4().hex[:8]}"
+    _append(run_id, {"type": "run", "run_id": run_id, "file_name": file_name, "created_at": time.time()})
+    return run_id
+
+def record_sample(run_id: str, variable: str, sample: dict):
+    """
+    Añade la muestra de evaluación de una variable a una ejecución.
+
+    La escritura se realiza en un hilo en segundo plano, por lo que no bloquea la extracción;
+    los hilos de extracción de una misma ejecución pueden registrar muestras concurrentemente.
+
+    Args:
+        run_id (str): Id de la ejecución
+        variable (str): Variable extraída
+        sample (dict): Pregunta, contextos recuperados, respuesta y referencia
+    """
+
+    _append(run_id, {"type": "sample", "run_id": run_id, "variable": variable, "sample": sample})
+
+def record_llm_call(run_id: str, llm_call: dict):
+    """
+    Añade a una ejecución el consumo de tokens de una llamada al LLM.
+
+    Args:
+        run_id (str): Id de la ejecución
+        llm_call (dict): Variables resueltas y tokens de prompt y de respuesta de la llamada
+    """
+
+    _append(run_id, {"type": "llm_call", "run_id": run_id, **llm_call})
+
+def flush_traces():
+    """
+    Espera a que todas las trazas pendientes se hayan escrito en disco.
+    """
+
+    _records.join()
+
+atexit.register(flush_traces)
+
+def _read_run(run_id: str) -> List[dict]:
+    run_path = _run_path(run_id)
+    if not os.path.exists(run_path):
+        return []
+    with open(run_path, "r", encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+def list_runs() -> List[dict]:
+    """
+    Lista las ejecuciones registradas, de la más antigua a la más reciente.
+
+    Returns:
+        List[dict]: Id, nombre del PDF, fecha de creación, número de muestras y tokens
+            consumidos en llamadas al LLM de cada ejecución
+    """
+
+    flush_traces()
+    if not os.path.isdir(TRACES_DIR):
+        return []
+    runs = []
+    for trace_file in sorted(os.listdir(TRACES_DIR)):
+        if not trace_file.endswith(".jsonl"):
+            continue
+        records = _read_run(trace_file[:-len(".jsonl")])
+        if not records or records[0]["type"] != "run":
+            continue
+        run = {key: value for key, value in records[0].items() if key != "type"}
+        llm_calls = [record for record in records if record["type"] == "llm_call"]
+        runs.append({
+            **run,
+            "samples": sum(record["type"] == "sample" for record in records),
+            "llm_calls": len(llm_calls),
+            "prompt_tokens": sum(record["prompt_tokens"] for record in llm_calls),
+            "completion_tokens": sum(record["completion_tokens"] for record in llm_calls),
+        })
+    return runs
+
+def load_run_samples(run_ids: List[str]) -> List[dict]:
+    """
+    Carga las muestras de evaluación de una o varias ejecuciones.
+
+    Args:
+        run_ids (List[str]): Ids de las ejecuciones
+
+    Returns:
+        List[dict]: Registros con las claves 'run_id', 'variable' y 'sample'
+    """
+
+    flush_traces()
+    return [record for run_id in run_ids for record in _read_run(run_id) if record["type"] == "sample"]
@@ -0,0 +1,121 @@
+import os
+import asyncio
+import hashlib
+import tempfile
+from typing import AsyncIterator
+
+try:
+    from python_multipart.multipart import MultipartParser, parse_options_header
+except ImportError:  # python-multipart < 0.0.13
+    from multipart.multipart import MultipartParser, parse_options_header
+
+
+class UploadTooLarge(Exception):
+    """
+    El archivo subido supera el tamaño máximo permitido.
+    """
+
+
+class InvalidUpload(Exception):
+    """
+    La petición no es un formulario multipart con un campo de archivo válido.
+    """
+
+
+async def spool_upload(body: AsyncIterator[bytes], content_type: str, target_dir: str, max_bytes: int,
+                       field_name: str = "file"):
+    """
+    Escribe en un archivo temporal único el archivo de un formulario multipart, a medida
+    que se recibe el cuerpo de la petición.
+
+    El cuerpo se procesa por bloques sin pasar por el UploadFile de Starlette, de modo que
+    el archivo se escribe en disco una sola vez, su hash SHA-256 se calcula durante la
+    escritura y la subida se corta en cuanto supera 'max_bytes'.
+
+    Args:
+        body (AsyncIterator[bytes]): Cuerpo de la petición (p. ej. request.stream())
+        content_type (str): Cabecera Content-Type de la petición
+        target_dir (str): Directorio del archivo temporal
+        max_bytes (int): Tamaño máximo del archivo
+        field_name (str, optional): Nombre del campo del formulario con el archivo
+
+    Returns:
+        tuple: (ruta del archivo temporal, hash SHA-256 del contenido, nombre original del archivo)
+
+    Raises:
+        UploadTooLarge: Si el archivo supera 'max_bytes'
+        InvalidUpload: Si la petición no es multipart o no contiene el campo del archivo
+    """
+
+    mime_type, options = parse_options_header(content_type or "")
+    boundary = options.get(b"boundary")
+    if mime_type != b"multipart/form-data" or not boundary:
+        raise InvalidUpload("Expected a multipart/form-data request")
+
+    state = {"header_field": b"", "header_value": b"", "headers": {}, "in_file": False, "file_name": None, "done": False}
+    file_hash, size, pending = hashlib.sha256(), 0, []
+
+    def on_part_begin():
+        state["headers"] = {}
+        state["in_file"] = False
+
+    def on_header_field(data, start, end):
+        state["header_field"] += data[start:end]
+
+    def on_header_value(data, start, end):
+        state["header_value"] += data[start:end]
+
+    def on_header_end():
+        state["headers"][state["header_field"].lower()] = state["header_value"]
+        state["header_field"], state["header_value"] = b"", b""
+
+    def on_headers_finished():
+        _, disposition = parse_options_header(state["headers"].get(b"content-disposition", b""))
+        # Only the first file part with the expected name is kept; other fields are skipped
+        if not state["done"] and disposition.get(b"name") == field_name.encode() and b"filename" in disposition:
+            state["in_file"] = True
+            state["file_name"] = disposition[b"filename"].decode("utf-8", errors="replace")
+
+    def on_part_data(data, start, end):
+        nonlocal size
+        if state["in_file"]:
+            block = data[start:end]
+            size += len(block)
+            file_hash.update(block)
+            pending.append(block)
+
+    def on_part_end():
+        if state["in_file"]:
+            state["in_file"] = False
+            state["done"] = True
+
+    parser = MultipartParser(boundary, {
+        "on_part_begin": on_part_begin,
+        "on_header_field": on_header_field,
+        "on_header_value": on_header_value,
+        "on_header_end": on_header_end,
+        "on_headers_finished": on_headers_finished,
+        "on_part_data": on_part_data,
+        "on_part_end": on_part_end,
+    })
+
+    os.makedirs(target_dir, exist_ok=True)
+    # Unique file name, so concurrent uploads of the same document do not overwrite each other
+    upload_file = tempfile.NamedTemporaryFile(dir=target_dir, suffix=".pdf", delete=False)
+    try:
+        with upload_file:
+            async for chunk in body:
+                parser.write(chunk)
+                if size > max_bytes:
+                    raise UploadTooLarge(f"File larger than {max_bytes // (1024 * 1024)} MB")
+                if pending:
+                    blocks = b"".join(pending)
+                    pending.clear()
+                    await asyncio.to_thread(upload_file.write, blocks)
+            parser.finalize()
+        if not state["done"]:
+            raise InvalidUpload(f"Missing file field '{field_name}'")
+    except BaseException:
+        os.remove(upload_file.name)
+        raise
+    return upload_file.name, file_hash.hexdigest(), state["file_name"]
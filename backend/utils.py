@@ -1,20 +1,32 @@
 import os
+import json
+import threading
+from functools import lru_cache
 from dotenv import load_dotenv
 from typing import List
 import pathlib
 
+import httpx
+import litellm
+
 from langchain_openai import AzureOpenAIEmbeddings, OpenAIEmbeddings, ChatOpenAI
 from langchain_core.documents import Document
 
+from local_embeddings import HashingEmbeddings
+
 
 
 
 ## LOAD SECRETS
 
+_loaded_secrets_files = set()
+
 def load_secrets(secrets_files: List):
     """
     Carga las variables de entorno desde los archivos especificados.    
 
+    Cada archivo se lee una sola vez por proceso; las llamadas posteriores no tienen coste.
+
     Args:
         secrets_files (List): Lista de rutas a los archivos de secretos (.env)
 
@@ -27,42 +39,220 @@ def load_secrets(secrets_files: List):
     
     parent_dir = os.path.dirname(os.path.abspath(__file__))
     for secrets_file in secrets_files:
+        if secrets_file in _loaded_secrets_files:
+            continue
         secrets_file_path = os.path.join(parent_dir, '..', secrets_file)
         load_dotenv(secrets_file_path)
+        _loaded_secrets_files.add(secrets_file)
 
 ###############
 
 
 ## EMBEDDINGS MODEL
 
+def _azure_embeddings():
+    return AzureOpenAIEmbeddings(model=os.getenv("LLM_EMBEDDING_MODEL"))
+
+def _openai_embeddings():
+    return OpenAIEmbeddings()
+
+def _local_embeddings():
+    return HashingEmbeddings(dimensions=int(os.getenv("LOCAL_EMBEDDING_DIMENSIONS", "1024")))
+
+# Embeddings backends by name. The first name contained in the configured backend wins,
+# so 'azure' must stay before 'openai'.
+EMBEDDINGS_BACKENDS = {
+    "azure": _azure_embeddings,
+    "openai": _openai_embeddings,
+    "local": _local_embeddings,
+}
+
+def register_embeddings_backend(name: str, factory):
+    """
+    Registra un backend de embeddings adicional.
+
+    Args:
+        name (str): Nombre del backend (en minúsculas), seleccionable con EMBEDDINGS_BACKEND
+        factory: Función sin argumentos que retorna una instancia de langchain Embeddings
+    """
+    
+    EMBEDDINGS_BACKENDS[name.lower()] = factory
+    get_embeddings_model.cache_clear()
+
+@lru_cache(maxsize=None)
 def get_embeddings_model():
     """
     Inicializa y retorna un modelo de embeddings basado en la configuración del entorno.
 
-    Esta función determina qué tipo de modelo de embeddings usar (Azure OpenAI o OpenAI)
-    basándose en la variable de entorno LLM_MODEL. Configura las credenciales necesarias
-    y retorna el modelo de embeddings correspondiente.
+    Esta función determina qué backend de embeddings usar (Azure OpenAI, OpenAI o el modelo
+    local solo CPU) basándose en la variable de entorno EMBEDDINGS_BACKEND o, si no está
+    definida, en LLM_MODEL, y retorna el modelo de embeddings correspondiente.
 
     Returns:
-        Union[AzureOpenAIEmbeddings, OpenAIEmbeddings]: Instancia del modelo de embeddings configurado
+        Embeddings: Instancia del modelo de embeddings configurado
 
     Raises:
         EnvironmentError: Si las variables de entorno requeridas no están configuradas
 
     Note:
+        El cliente se crea una única vez por proceso y se reutiliza (junto con su pool
+        de conexiones HTTP) en todas las peticiones.
+
         Requiere que las siguientes variables de entorno estén configuradas:
-        - LLM_MODEL: Tipo de modelo a usar ('azure' u 'openai')
+        - LLM_MODEL o EMBEDDINGS_BACKEND: Backend a usar ('azure', 'openai' o 'local')
         - Para Azure: AZURE_OPENAI_API_KEY, AZURE_OPENAI_ENDPOINT, LLM_EMBEDDING_MODEL
         - Para OpenAI: OPENAI_API_KEY
+        - Para local (opcional): LOCAL_EMBEDDING_DIMENSIONS
     """
         
-    if "azure" in os.getenv("LLM_MODEL").lower():
-        os.environ["AZURE_OPENAI_API_KEY"] = os.getenv("AZURE_OPENAI_API_KEY")
-        os.environ["AZURE_OPENAI_ENDPOINT"] = os.getenv("AZURE_OPENAI_ENDPOINT")
-        cloud_embeddings = AzureOpenAIEmbeddings(
-            model=os.getenv("LLM_EMBEDDING_MODEL"),
-        )
-    elif "openai" in os.getenv("LLM_MODEL").lower():
-        os.environ["OPENAI_API_KEY"] = os.getenv("OPENAI_API_KEY")
-        cloud_embeddings = OpenAIEmbeddings()
-    return cloud_embeddings
+    backend = (os.getenv("EMBEDDINGS_BACKEND") or os.getenv("LLM_MODEL") or "").lower()
+    for name, factory in EMBEDDINGS_BACKENDS.items():
+        if name in backend:
+            return factory()
+    raise EnvironmentError(f"Backend de embeddings desconocido: '{backend}'")
+
+def embeddings_model_name(embeddings_model) -> str:
+    """
+    Retorna un identificador estable del modelo de embeddings.
+
+    Se utiliza como clave para persistir embeddings, de forma que vectores generados
+    con modelos distintos nunca se mezclen.
+
+    Args:
+        embeddings_model: Modelo de embeddings
+
+    Returns:
+        str: Nombre del modelo (p. ej. 'text-embedding-ada-002')
+    """
+    
+    return getattr(embeddings_model, "model", None) or type(embeddings_model).__name__
+
+###############
+
+
+## TOKENS
+
+@lru_cache(maxsize=None)
+def _get_tokenizer():
+    try:
+        import tiktoken
+        return tiktoken.get_encoding(os.getenv("TOKENIZER_ENCODING", "o200k_base"))
+    except Exception:
+        # Not installed, or the BPE file cannot be downloaded (offline host): the estimate
+        # is cached too, so the download is not retried on every call
+        return None
+
+def count_tokens(text: str) -> int:
+    """
+    Cuenta los tokens de un texto con el tokenizador del modelo (tiktoken).
+
+    Args:
+        text (str): Texto a medir
+
+    Returns:
+        int: Número de tokens
+
+    Note:
+        Si tiktoken no está instalado o no puede cargar su codificación (p. ej. sin acceso
+        a internet para descargarla) se usa una aproximación de 4 caracteres por token.
+    """
+    
+    tokenizer = _get_tokenizer()
+    if tokenizer is None:
+        return -(-len(text) // 4)
+    return len(tokenizer.encode(text, disallowed_special=()))
+
+def truncate_tokens(text: str, max_tokens: int) -> str:
+    """
+    Recorta un texto a sus primeros 'max_tokens' tokens (ver count_tokens).
+
+    Args:
+        text (str): Texto a recortar
+        max_tokens (int): Número máximo de tokens
+
+    Returns:
+        str: Texto recortado
+    """
+
+    tokenizer = _get_tokenizer()
+    if tokenizer is None:
+        return text[:max(max_tokens, 0) * 4]
+    return tokenizer.decode(tokenizer.encode(text, disallowed_special=())[:max(max_tokens, 0)])
+
+###############
+
+
+## JSON CONFIGS
+
+_json_configs = {}
+_json_configs_lock = threading.Lock()
+
+def load_json_config(file_name: str):
+    """
+    Carga un archivo JSON de configuración del directorio 'backend', cacheado en memoria.
+
+    El archivo solo se vuelve a leer de disco cuando cambia su fecha de modificación,
+    por lo que las ediciones se aplican en caliente sin reiniciar el servidor.
+
+    Args:
+        file_name (str): Nombre del archivo JSON (p. ej. 'variables_queries.json')
+
+    Returns:
+        Union[dict, list]: Contenido del JSON. No debe modificarse, es compartido entre peticiones.
+    """
+    
+    file_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), file_name)
+    mtime = os.path.getmtime(file_path)
+    with _json_configs_lock:
+        cached = _json_configs.get(file_path)
+        if cached is not None and cached[0] == mtime:
+            return cached[1]
+        with open(file_path, "r", encoding="utf-8") as f:
+            json_data = json.load(f)
+        _json_configs[file_path] = (mtime, json_data)
+        return json_data
+
+###############
+
+
+## RUNTIME
+
+_runtime_lock = threading.Lock()
+_runtime_initialized = False
+
+def init_runtime():
+    """
+    Inicializa una única vez por proceso los recursos compartidos de la aplicación.
+
+    Carga los secretos, crea los clientes HTTP con pool de conexiones que utiliza litellm
+    y construye el modelo de embeddings. Las llamadas posteriores no tienen coste.
+
+    Note:
+        El tamaño del pool se configura con HTTP_MAX_CONNECTIONS.
+    """
+    
+    global _runtime_initialized
+    with _runtime_lock:
+        if _runtime_initialized:
+            return
+        load_secrets([".env.file", ".env.secrets"])
+
+        max_connections = int(os.getenv("HTTP_MAX_CONNECTIONS", "20"))
+        limits = httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections)
+        litellm.client_session = httpx.Client(limits=limits, timeout=600)
+        litellm.aclient_session = httpx.AsyncClient(limits=limits, timeout=600)
+
+        get_embeddings_model()
+        _runtime_initialized = True
+
+async def close_runtime():
+    """
+    Cierra los clientes HTTP creados por init_runtime.
+    """
+    
+    global _runtime_initialized
+    if litellm.client_session is not None:
+        litellm.client_session.close()
+    if litellm.aclient_session is not None:
+        await litellm.aclient_session.aclose()
+    _runtime_initialized = False
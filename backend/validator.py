@@ -1,7 +1,8 @@
 import os
-from utils import load_secrets, get_embeddings_model
-from retriever import load_vectorstore, extract_top_documents, parse_document
+from utils import init_runtime, get_embeddings_model
+from retriever import load_vectorstore_by_name, extract_top_documents, parse_document
 from augmented_generator import llm_response
+from context_builder import context_token_budget
 from prompt_engineering import CHATBOT_PROMPT_SYSTEM, CHATBOT_PROMPT_USER
 
 
@@ -33,11 +34,11 @@ def validator_response(vectorstore_name: str, input_prompt: str, input_llm: str)
         )
     """
     
-    # First, load the secrets files to access environmental variables
-    load_secrets([".env.file", ".env.secrets"])
+    # Make sure secrets and shared clients are loaded (no-op after app startup)
+    init_runtime()
 
     # Load vectorstore
-    vectorstore = load_vectorstore(embeddings_model=get_embeddings_model(), pdf_file_path=f"{vectorstore_name}.pdf")
+    vectorstore = load_vectorstore_by_name(embeddings_model=get_embeddings_model(), vectorstore_name=vectorstore_name)
 
     # Set number of docs to retrieve
     fetch_k = int(os.getenv("DOCUMENTS_TO_RETRIEVE"))
@@ -68,7 +69,10 @@ def generate_validator_response(vectorstore, input_prompt, input_llm, top_k, fet
     """
     
     top_documents = extract_top_documents(vectorstore, prompt_request=input_prompt, top_k=top_k, fetch_k=fetch_k)
-    llm_context = parse_document(top_documents)
+
+    # Context trimmed to what fits in LLM_MAX_PROMPT_TOKENS, dropping the least relevant chunks first
+    max_context_tokens = context_token_budget(CHATBOT_PROMPT_SYSTEM, CHATBOT_PROMPT_USER.format(question=input_llm, context=""))
+    llm_context = parse_document(top_documents, max_tokens=max_context_tokens)
 
     # Generate llm response
     prompt_user = CHATBOT_PROMPT_USER.format(question=input_llm, context=llm_context)
@@ -0,0 +1,105 @@
+import os
+import threading
+from collections import OrderedDict
+
+from langchain_community.vectorstores.faiss import FAISS
+
+
+# Process-wide LRU cache of loaded vectorstores: path -> (vectorstore, size in bytes)
+_cache = OrderedDict()
+_lock = threading.Lock()
+_stats = {"hits": 0, "misses": 0, "evictions": 0}
+
+
+def _cache_key(vectorstore_path: str) -> str:
+    return os.path.normcase(os.path.abspath(vectorstore_path))
+
+def _max_cache_bytes() -> int:
+    return int(float(os.getenv("VECTORSTORE_CACHE_MAX_MB", "512")) * 1024 * 1024)
+
+def estimate_vectorstore_size(vectorstore: FAISS) -> int:
+    """
+    Estima la memoria ocupada por un vectorstore FAISS.
+
+    Args:
+        vectorstore (FAISS): vector store FAISS
+
+    Returns:
+        int: Tamaño aproximado en bytes (vectores float32 más el texto del docstore)
+    """
+
+    vectors_size = vectorstore.index.ntotal * vectorstore.index.d * 4
+    texts_size = sum(len(document.page_content.encode("utf-8")) for document in vectorstore.docstore._dict.values())
+    return vectors_size + texts_size
+
+def get_cached_vectorstore(vectorstore_path: str):
+    """
+    Retorna el vectorstore cacheado para una ruta, o None si no está en memoria.
+
+    Args:
+        vectorstore_path (str): Ruta de la carpeta del vectorstore
+
+    Returns:
+        FAISS: Instancia del vector store, o None si no está cacheado
+    """
+
+    key = _cache_key(vectorstore_path)
+    with _lock:
+        if key in _cache:
+            _cache.move_to_end(key)
+            _stats["hits"] += 1
+            return _cache[key][0]
+        _stats["misses"] += 1
+        return None
+
+def cache_vectorstore(vectorstore_path: str, vectorstore: FAISS):
+    """
+    Guarda un vectorstore en la caché, desalojando los menos usados si se supera el presupuesto.
+
+    Args:
+        vectorstore_path (str): Ruta de la carpeta del vectorstore
+        vectorstore (FAISS): vector store FAISS
+
+    Note:
+        El presupuesto de memoria se configura con VECTORSTORE_CACHE_MAX_MB. Un vectorstore
+        mayor que el presupuesto completo no se cachea.
+    """
+
+    key = _cache_key(vectorstore_path)
+    size = estimate_vectorstore_size(vectorstore)
+    max_bytes = _max_cache_bytes()
+    if size > max_bytes:
+        return
+
+    with _lock:
+        _cache.pop(key, None)
+        _cache[key] = (vectorstore, size)
+        while sum(entry_size for _, entry_size in _cache.values()) > max_bytes:
+            _cache.popitem(last=False)
+            _stats["evictions"] += 1
+
+def invalidate_vectorstore(vectorstore_path: str):
+    """
+    Elimina de la caché el vectorstore de una ruta (p. ej. al borrar su carpeta).
+
+    Args:
+        vectorstore_path (str): Ruta de la carpeta del vectorstore
+    """
+
+    with _lock:
+        _cache.pop(_cache_key(vectorstore_path), None)
+
+def vectorstore_cache_stats() -> dict:
+    """
+    Retorna las estadísticas de uso de la caché de vectorstores.
+
+    Returns:
+        dict: Aciertos, fallos, desalojos, número de entradas y bytes ocupados
+    """
+
+    with _lock:
+        return {
+            **_stats,
+            "entries": len(_cache),
+            "size_bytes": sum(entry_size for _, entry_size in _cache.values()),
+        }
@@ -12,6 +12,8 @@ const Chatbot = ({ generatedSummaries, setGeneratedSummaries,
     const dropdownRef = useRef(null);
     // Ref to always see the bottom of conversation when new message is generated
     const chatContainerRef = useRef(null);
+    // Server-side chat session id of each conversation
+    const chatSessions = useRef({});
 
     const editTableNames = generatedSummaries.map(summary => summary.editableName);
 
@@ -109,8 +111,14 @@ const Chatbot = ({ generatedSummaries, setGeneratedSummaries,
                         vectorstore_name: matchingSummary.uploadFileName,
                         input_text: inputText,
                         chat_history: selectedConversation.fullConversation,
+                        session_id: chatSessions.current[selectedConversation.id],
                     })
                 });
+
+                const sessionId = response.headers.get('X-Chat-Session');
+                if (sessionId) {
+                    chatSessions.current[selectedConversation.id] = sessionId;
+                }
             
                 const reader = response.body.getReader();
                 const decoder = new TextDecoder('utf-8');
@@ -142,6 +150,7 @@ const Chatbot = ({ generatedSummaries, setGeneratedSummaries,
                 );
             
                 let responseText = '';
+                let sseBuffer = '';
             
                 // While streaming is not done, keep processing chunks
                 while (!done) {
@@ -149,8 +158,20 @@ const Chatbot = ({ generatedSummaries, setGeneratedSummaries,
                     done = readerDone;
             
                     if (value) {
-                        // Decode the chunk of response data
-                        const chunk = decoder.decode(value, { stream: !done });
+                        // Decode the chunk of response data and keep any incomplete server-sent event for the next read
+                        sseBuffer += decoder.decode(value, { stream: !done });
+                        const events = sseBuffer.split('\n\n');
+                        sseBuffer = events.pop();
+
+                        // Join the data lines of every complete message event
+                        const chunk = events
+                            .map(event => event.split('\n'))
+                            .filter(lines => !lines.some(line => line.startsWith('event:')))
+                            .map(lines => lines.filter(line => line.startsWith('data: ')).map(line => line.slice(6)).join('\n'))
+                            .join('');
+                        if (!chunk) {
+                            continue;
+                        }
                         responseText += chunk; // Append the chunk to the growing response text
             
                         // Update the specific message div in the conversation with the streamed chunk
@@ -0,0 +1,81 @@
+import pytest
+
+import chat_sessions
+from chat_sessions import get_session, record_turn, update_context, delete_session
+from chatbot import is_follow_up, context_covers, reformulation_prompt
+
+
+@pytest.fixture(autouse=True)
+def isolated_sessions(monkeypatch):
+    monkeypatch.setattr(chat_sessions, "_sessions", chat_sessions.OrderedDict())
+
+
+@pytest.mark.parametrize("question", [
+    "¿Y el plazo?",
+    "y cuál es el plazo de ejecución del contrato",
+    "¿Cuál es el importe total de eso en euros?",
+    "¿Quién es el responsable que firma este?",
+])
+def test_questions_depending_on_the_history_are_follow_ups(question):
+    assert is_follow_up(question)
+
+@pytest.mark.parametrize("question", [
+    "¿Cuál es el plazo de ejecución de este contrato?",
+    "¿Qué garantía definitiva exige esta licitación?",
+    "¿Cuál es el presupuesto base de su licitación?",
+])
+def test_standalone_questions_are_not_follow_ups(question):
+    assert not is_follow_up(question)
+
+def test_standalone_questions_skip_the_reformulation():
+    history = ["¿Cuál es el presupuesto?", "100.000 euros"]
+
+    assert reformulation_prompt("¿Cuál es el plazo de ejecución del contrato?", history) is None
+    assert reformulation_prompt("¿Y el plazo?", []) is None
+    assert reformulation_prompt("¿Y el plazo?", history) is not None
+
+def test_context_covers_requires_most_question_terms(monkeypatch):
+    monkeypatch.setenv("CHAT_CONTEXT_REUSE_OVERLAP", "0.7")
+    context = "El plazo de ejecución del contrato es de doce meses desde la firma."
+
+    assert context_covers("¿Cuál es el plazo de ejecución del contrato?", context)
+    assert not context_covers("¿Cuál es la garantía definitiva exigida?", context)
+
+
+def test_session_is_reused_for_the_same_vectorstore():
+    session = get_session(None, "pliego", ["¿Presupuesto?", "100.000 euros"])
+
+    assert get_session(session["session_id"], "pliego") is session
+    assert session["history"] == ["¿Presupuesto?", "100.000 euros"]
+    assert get_session(session["session_id"], "otro_pliego") is not session
+
+def test_history_keeps_the_last_turns(monkeypatch):
+    monkeypatch.setenv("CHAT_SESSION_MAX_TURNS", "2")
+    session = get_session(None, "pliego")
+
+    for turn in range(3):
+        record_turn(session, f"pregunta {turn}", f"respuesta {turn}")
+
+    assert session["history"] == ["pregunta 1", "respuesta 1", "pregunta 2", "respuesta 2"]
+
+def test_idle_and_excess_sessions_are_evicted(monkeypatch):
+    monkeypatch.setenv("CHAT_SESSIONS_MAX", "2")
+    first = get_session(None, "pliego")
+    second = get_session(None, "pliego")
+    third = get_session(None, "pliego")
+
+    assert first["session_id"] not in chat_sessions._sessions
+    assert {second["session_id"], third["session_id"]} == set(chat_sessions._sessions)
+
+    monkeypatch.setenv("CHAT_SESSION_IDLE_SECONDS", "60")
+    now = chat_sessions.time.time()
+    monkeypatch.setattr(chat_sessions.time, "time", lambda: now + 61)
+    assert get_session(second["session_id"], "pliego") is not second
+
+def test_context_is_stored_and_sessions_can_be_deleted():
+    session = get_session(None, "pliego")
+    update_context(session, "¿Plazo?", "doce meses")
+
+    assert (session["last_question"], session["context"]) == ("¿Plazo?", "doce meses")
+    assert delete_session(session["session_id"])
+    assert not delete_session(session["session_id"])
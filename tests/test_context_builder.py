@@ -0,0 +1,46 @@
+from langchain_core.documents import Document
+
+from context_builder import merge_spans, build_context
+from utils import count_tokens
+
+
+def chunk(text, page=0, start=0):
+    return Document(page_content=text, metadata={"page": page, "start_index": start})
+
+
+def test_merge_spans_joins_overlapping_chunks_without_repeating_text():
+    text = "El presupuesto base de licitación asciende a 100.000 euros sin IVA."
+    docs = [chunk(text[20:], start=20), chunk(text[:30], start=0)]
+
+    spans = merge_spans(docs)
+
+    assert [span["text"] for span in spans] == [text]
+    assert spans[0]["rank"] == 0
+
+def test_merge_spans_keeps_chunks_of_other_pages_apart_in_document_order():
+    docs = [chunk("segunda página", page=1), chunk("primera página", page=0)]
+
+    spans = merge_spans(docs)
+
+    assert [span["text"] for span in spans] == ["primera página", "segunda página"]
+    assert [span["rank"] for span in spans] == [1, 0]
+
+def test_merge_spans_drops_unpositioned_duplicates():
+    docs = [chunk("plazo de ejecución de doce meses"), Document(page_content="doce meses")]
+
+    assert [span["text"] for span in merge_spans(docs)] == ["plazo de ejecución de doce meses"]
+
+def test_build_context_selects_spans_by_relevance_within_budget():
+    relevant = "garantía definitiva del cinco por ciento"
+    filler = "texto de relleno sin relación con la pregunta " * 5
+    docs = [chunk(relevant, page=2), chunk(filler, page=0)]
+
+    context = build_context(docs, max_tokens=count_tokens(relevant))
+
+    assert context == relevant
+
+def test_build_context_without_budget_keeps_every_span(monkeypatch):
+    monkeypatch.delenv("CONTEXT_MAX_TOKENS", raising=False)
+    docs = [chunk("b", page=1), chunk("a", page=0)]
+
+    assert build_context(docs) == "a\nb"
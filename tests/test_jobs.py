@@ -0,0 +1,86 @@
+import threading
+
+import pytest
+
+import jobs
+from jobs import submit_extraction_job, get_job, cancel_job, JobCancelled
+
+
+@pytest.fixture(autouse=True)
+def isolated_jobs(monkeypatch, tmp_path):
+    monkeypatch.setattr(jobs, "JOBS_DIR", str(tmp_path))
+    monkeypatch.setattr(jobs, "_jobs", {})
+
+def fake_extractor(pdf_file_path, progress_callback=None, file_name=None):
+    progress_callback({"stage": "ingestion", "status": "started"})
+    progress_callback({"stage": "variable", "variable": "Plazo", "answer": "12 meses", "completed": 1, "total": 1})
+    return {"Plazo": "12 meses"}
+
+
+def test_job_result_is_served_from_disk_after_eviction(monkeypatch):
+    monkeypatch.setattr(jobs, "tender_data_extractor", fake_extractor)
+    monkeypatch.setenv("JOBS_MAX_FINISHED", "1")
+
+    first_id, first = submit_extraction_job("a.pdf", "a.pdf")
+    first.result(timeout=10)
+    second_id, second = submit_extraction_job("b.pdf", "b.pdf")
+    second.result(timeout=10)
+
+    assert first_id not in jobs._jobs
+    assert second_id in jobs._jobs
+    job = get_job(first_id)
+    assert job["status"] == jobs.COMPLETED
+    assert job["result"] == {"Plazo": "12 meses"}
+    assert job["progress"] == {"completed": 1, "total": 1, "stage": "variable"}
+
+def test_get_unknown_job_returns_none():
+    assert get_job("missing") is None
+
+def test_cancelled_job_stops_at_next_progress_event(monkeypatch):
+    started, release = threading.Event(), threading.Event()
+    def blocking_extractor(pdf_file_path, progress_callback=None, file_name=None):
+        progress_callback({"stage": "ingestion", "status": "started"})
+        started.set()
+        release.wait(timeout=10)
+        progress_callback({"stage": "ingestion", "status": "completed"})
+        return {}
+    monkeypatch.setattr(jobs, "tender_data_extractor", blocking_extractor)
+    cleaned = []
+
+    job_id, future = submit_extraction_job("a.pdf", "a.pdf", cleanup=lambda: cleaned.append(job_id))
+    started.wait(timeout=10)
+    assert cancel_job(job_id)
+    release.set()
+
+    with pytest.raises(JobCancelled):
+        future.result(timeout=10)
+    assert get_job(job_id)["status"] == jobs.CANCELLED
+    assert cleaned == [job_id]
+    assert not cancel_job(job_id)
+
+def test_failed_job_records_the_error(monkeypatch):
+    def failing_extractor(pdf_file_path, progress_callback=None, file_name=None):
+        raise ValueError("PDF sin texto")
+    monkeypatch.setattr(jobs, "tender_data_extractor", failing_extractor)
+
+    job_id, future = submit_extraction_job("a.pdf", "a.pdf")
+
+    with pytest.raises(ValueError):
+        future.result(timeout=10)
+    assert get_job(job_id)["status"] == jobs.FAILED
+    assert get_job(job_id)["error"] == "PDF sin texto"
+
+def test_cleanup_runs_when_the_job_cannot_be_persisted(monkeypatch):
+    monkeypatch.setattr(jobs, "tender_data_extractor", fake_extractor)
+    def failing_persist(job):
+        raise OSError("disk full")
+    monkeypatch.setattr(jobs, "_persist", failing_persist)
+    cleaned = []
+
+    job_id, future = submit_extraction_job("a.pdf", "a.pdf", cleanup=lambda: cleaned.append(job_id))
+
+    with pytest.raises(OSError):
+        future.result(timeout=10)
+    assert cleaned == [job_id]
+    # Not written to disk, so it stays in memory
+    assert get_job(job_id)["status"] == jobs.COMPLETED
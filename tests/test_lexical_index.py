@@ -0,0 +1,52 @@
+from langchain_community.vectorstores.faiss import FAISS
+
+from lexical_index import tokenize, build_lexical_index, save_lexical_index, load_lexical_index, bm25_search, reciprocal_rank_fusion
+from local_embeddings import HashingEmbeddings
+
+
+TEXTS = [
+    "El presupuesto base de licitación es de 120.000 euros.",
+    "La garantía definitiva será del 5% del importe de adjudicación.",
+    "El plazo de ejecución del contrato es de doce meses.",
+]
+
+
+def build_vectorstore():
+    embeddings_model = HashingEmbeddings(dimensions=64)
+    return FAISS.from_texts(TEXTS, embeddings_model)
+
+
+def test_tokenize_lowercases_and_strips_accents():
+    assert tokenize("Licitación PÚBLICA nº 2024/15") == ["licitacion", "publica", "no", "2024", "15"]
+
+def test_bm25_search_ranks_exact_term_matches_first():
+    vectorstore = build_vectorstore()
+    lexical_index = build_lexical_index(vectorstore)
+
+    results = bm25_search(lexical_index, "garantía definitiva", k=3)
+
+    assert len(results) == 1
+    docstore_id, score = results[0]
+    assert vectorstore.docstore.search(docstore_id).page_content == TEXTS[1]
+    assert score > 0
+
+def test_bm25_search_finds_numbers_verbatim():
+    vectorstore = build_vectorstore()
+
+    (docstore_id, _), = bm25_search(build_lexical_index(vectorstore), "120.000", k=3)
+
+    assert vectorstore.docstore.search(docstore_id).page_content == TEXTS[0]
+
+def test_lexical_index_round_trips_through_disk(tmp_path):
+    lexical_index = build_lexical_index(build_vectorstore())
+
+    save_lexical_index(str(tmp_path), lexical_index)
+
+    assert load_lexical_index(str(tmp_path)) == lexical_index
+    assert [path.name for path in tmp_path.iterdir()] == ["lexical_index.json"]
+
+def test_load_lexical_index_of_old_vectorstore_returns_none(tmp_path):
+    assert load_lexical_index(str(tmp_path)) is None
+
+def test_reciprocal_rank_fusion_favours_documents_ranked_high_in_both_lists():
+    assert reciprocal_rank_fusion([["a", "b", "c"], ["b", "c", "a"]]) == ["b", "a", "c"]
@@ -0,0 +1,87 @@
+import functools
+
+import pytest
+
+import llm_cache
+import augmented_generator
+from llm_cache import cache_key, MemoryLRUCache, SQLiteCache, get_llm_cache
+from augmented_generator import llm_response, is_cache_hit
+
+
+@pytest.fixture
+def memory_cache(monkeypatch):
+    monkeypatch.setenv("LLM_CACHE_BACKEND", "memory")
+    monkeypatch.setattr(llm_cache, "_cache", None)
+    return get_llm_cache()
+
+@pytest.fixture
+def mocked_completion(monkeypatch):
+    calls = []
+    completion = functools.partial(augmented_generator.completion, mock_response="Respuesta simulada")
+    def counting_completion(**request):
+        calls.append(request)
+        return completion(**request)
+    monkeypatch.setattr(augmented_generator, "completion", counting_completion)
+    return calls
+
+def stream_text(stream):
+    return "".join(chunk["choices"][0]["delta"].get("content") or "" for chunk in stream if chunk["choices"])
+
+
+def test_cache_key_ignores_dict_order():
+    request = {"model": "m", "messages": [{"role": "user", "content": "hola"}], "temperature": 0}
+
+    assert cache_key(request) == cache_key(dict(reversed(list(request.items()))))
+    assert cache_key(request) != cache_key({**request, "temperature": 1})
+
+def test_memory_cache_evicts_least_recently_used():
+    cache = MemoryLRUCache(max_entries=2, ttl_seconds=0)
+    cache.set("a", {"value": 1})
+    cache.set("b", {"value": 2})
+    cache.get("a")
+    cache.set("c", {"value": 3})
+
+    assert cache.get("a") == {"value": 1}
+    assert cache.get("b") is None
+    assert cache.get("c") == {"value": 3}
+
+def test_memory_cache_expires_entries(monkeypatch):
+    cache = MemoryLRUCache(max_entries=10, ttl_seconds=60)
+    cache.set("a", {"value": 1})
+
+    now = llm_cache.time.time()
+    monkeypatch.setattr(llm_cache.time, "time", lambda: now + 61)
+
+    assert cache.get("a") is None
+
+def test_sqlite_cache_persists_and_evicts(tmp_path):
+    db_path = str(tmp_path / "llm_responses.sqlite")
+    cache = SQLiteCache(max_entries=2, ttl_seconds=0, db_path=db_path)
+    cache.set("a", {"value": 1})
+    cache.set("b", {"value": 2})
+    cache.set("c", {"value": 3})
+
+    reopened = SQLiteCache(max_entries=2, ttl_seconds=0, db_path=db_path)
+    assert reopened.get("a") is None
+    assert reopened.get("c") == {"value": 3}
+
+def test_get_llm_cache_is_disabled_by_default(monkeypatch):
+    monkeypatch.setenv("LLM_CACHE_BACKEND", "none")
+
+    assert get_llm_cache() is None
+
+def test_identical_requests_are_served_from_cache(memory_cache, mocked_completion):
+    first = llm_response("Eres un asistente", "¿Cuál es el plazo?")
+    second = llm_response("Eres un asistente", "¿Cuál es el plazo?")
+
+    assert len(mocked_completion) == 1
+    assert not is_cache_hit(first)
+    assert is_cache_hit(second)
+    assert second.choices[0].message.content == "Respuesta simulada"
+
+def test_streamed_responses_are_cached_once_complete(memory_cache, mocked_completion):
+    first = stream_text(llm_response("s", "u", stream=True))
+    second = stream_text(llm_response("s", "u", stream=True))
+
+    assert len(mocked_completion) == 1
+    assert first == second == "Respuesta simulada"
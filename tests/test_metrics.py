@@ -0,0 +1,108 @@
+import json
+import asyncio
+import logging
+import functools
+
+import pytest
+from fastapi import FastAPI
+from fastapi.responses import StreamingResponse
+from fastapi.testclient import TestClient
+
+import metrics
+import augmented_generator
+from main import InstrumentRequests
+from metrics import span, start_request_context, end_request_context, summarize_spans
+
+
+def value(name, **labels):
+    return metrics._values.get(metrics._key(name, labels), 0)
+
+def observations(name, **labels):
+    return metrics._histograms.get(metrics._key(name, labels), {"count": 0})["count"]
+
+@pytest.fixture
+def app():
+    app = FastAPI()
+    app.add_middleware(InstrumentRequests)
+
+    @app.get("/stream")
+    async def stream():
+        async def body():
+            for part in ("a", "b"):
+                with span("test_stage"):
+                    await asyncio.sleep(0)
+                yield part
+        return StreamingResponse(body())
+
+    @app.get("/fail")
+    async def fail():
+        raise RuntimeError("boom")
+
+    return app
+
+
+def test_streaming_request_is_measured_once_its_body_is_sent(app, caplog):
+    in_flight = value("rag_http_requests_in_flight")
+    requests = value("rag_http_requests_total", method="GET", path="/stream", status=200)
+
+    with caplog.at_level(logging.INFO, logger="rag.requests"):
+        response = TestClient(app).get("/stream")
+
+    assert response.text == "ab"
+    assert value("rag_http_requests_in_flight") == in_flight
+    assert value("rag_http_requests_total", method="GET", path="/stream", status=200) == requests + 1
+    log = json.loads(caplog.records[-1].getMessage())
+    assert log["path"] == "/stream"
+    assert log["stages"]["test_stage"]["count"] == 2
+
+def test_failed_request_is_counted_as_500(app):
+    in_flight = value("rag_http_requests_in_flight")
+    failures = value("rag_http_requests_total", method="GET", path="/fail", status=500)
+
+    response = TestClient(app, raise_server_exceptions=False).get("/fail")
+
+    assert response.status_code == 500
+    assert value("rag_http_requests_in_flight") == in_flight
+    assert value("rag_http_requests_total", method="GET", path="/fail", status=500) == failures + 1
+
+def test_cancelled_request_does_not_leak_the_in_flight_gauge():
+    async def never_responds(scope, receive, send):
+        await asyncio.Event().wait()
+
+    async def run():
+        in_flight = value("rag_http_requests_in_flight")
+        scope = {"type": "http", "method": "GET", "path": "/"}
+        task = asyncio.ensure_future(InstrumentRequests(never_responds)(scope, None, None))
+        await asyncio.sleep(0)
+        assert value("rag_http_requests_in_flight") == in_flight + 1
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+        return in_flight
+
+    in_flight = asyncio.run(run())
+    assert value("rag_http_requests_in_flight") == in_flight
+
+def test_spans_are_collected_for_the_current_request():
+    request_context, token = start_request_context()
+    try:
+        with span("search"):
+            pass
+        with span("search"):
+            pass
+    finally:
+        end_request_context(token)
+
+    assert summarize_spans(request_context["spans"])["search"]["count"] == 2
+
+def test_streamed_llm_span_ends_when_the_stream_is_consumed(monkeypatch):
+    monkeypatch.setenv("LLM_CACHE_BACKEND", "none")
+    monkeypatch.setattr(augmented_generator, "completion", functools.partial(augmented_generator.completion, mock_response="hola"))
+    calls = observations("rag_stage_duration_seconds", stage="llm_response")
+
+    stream = augmented_generator.llm_response("s", "u", stream=True)
+    assert observations("rag_stage_duration_seconds", stage="llm_response") == calls
+    for _ in stream:
+        pass
+
+    assert observations("rag_stage_duration_seconds", stage="llm_response") == calls + 1
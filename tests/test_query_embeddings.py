@@ -0,0 +1,48 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+import embedding_cache
+from local_embeddings import HashingEmbeddings
+from retriever import load_query_embeddings
+
+
+class CountingEmbeddings(HashingEmbeddings):
+    def __init__(self):
+        super().__init__(dimensions=16)
+        self.embedded = []
+
+    def embed_documents(self, texts):
+        self.embedded.extend(texts)
+        return super().embed_documents(texts)
+
+
+@pytest.fixture
+def cache_dir(monkeypatch, tmp_path):
+    monkeypatch.setattr(embedding_cache, "EMBEDDINGS_CACHE_DIR", str(tmp_path))
+    return tmp_path
+
+
+def test_only_new_queries_are_embedded(cache_dir):
+    embeddings_model = CountingEmbeddings()
+    first = load_query_embeddings(embeddings_model, ["plazo", "presupuesto"])
+
+    second = load_query_embeddings(embeddings_model, ["presupuesto", "garantía", "plazo"])
+
+    assert embeddings_model.embedded == ["plazo", "presupuesto", "garantía"]
+    assert list(second) == ["presupuesto", "garantía", "plazo"]
+    assert second["plazo"] == first["plazo"]
+
+def test_concurrent_writers_keep_every_query_and_leave_no_temp_files(cache_dir):
+    embeddings_model = HashingEmbeddings(dimensions=16)
+    batches = [[f"consulta {batch}-{query}" for query in range(5)] for batch in range(8)]
+
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        list(pool.map(lambda queries: load_query_embeddings(embeddings_model, queries), batches))
+
+    (cache_file,) = os.listdir(cache_dir)
+    assert cache_file.startswith("queries_") and cache_file.endswith(".json")
+    counting_model = CountingEmbeddings()
+    load_query_embeddings(counting_model, [query for queries in batches for query in queries])
+    assert counting_model.embedded == []
@@ -0,0 +1,103 @@
+import pytest
+from langchain_core.documents import Document
+from litellm import ModelResponse
+
+import tender_extractor
+from augmented_generator import cached_model_response
+from context_builder import TokenBudget, TokenBudgetExceeded, build_context, prompt_token_limit
+from tender_extractor import budgeted_llm_call
+from utils import count_tokens
+
+
+def test_unused_tokens_return_to_the_remaining_calls():
+    budget = TokenBudget(1000, calls=4)
+
+    allowance = budget.reserve()
+    budget.release(allowance, 100)
+
+    assert allowance == 250
+    assert budget.reserve() == 900 // 3
+
+def test_unlimited_budget_reserves_nothing():
+    budget = TokenBudget(0, calls=3)
+
+    assert budget.reserve() is None
+
+def test_split_budgets_extra_calls_against_their_own_share():
+    budget = TokenBudget(1000, calls=2)
+
+    share = budget.split()
+    share.add_calls(2)
+    allowances = [share.reserve() for _ in range(3)]
+    for allowance in allowances:
+        share.release(allowance, allowance)
+    share.close()
+
+    assert sum(allowances) <= 500
+    # The share was fully used, so the other call keeps its own half
+    assert budget.reserve() == 500
+
+def test_exhausted_share_is_still_a_limit():
+    budget = TokenBudget(10, calls=1)
+    budget.release(budget.reserve(), 10)
+
+    share = budget.split()
+
+    assert share.reserve() == 0
+    assert prompt_token_limit(0) == 0
+
+def test_build_context_truncates_the_most_relevant_span_when_it_alone_exceeds_the_budget():
+    long_span = " ".join(f"cláusula {number} del pliego administrativo" for number in range(200))
+    docs = [Document(page_content=long_span, metadata={"page": 0, "start_index": 0}),
+            Document(page_content="otra página", metadata={"page": 1, "start_index": 0})]
+
+    context = build_context(docs, max_tokens=50)
+
+    assert context
+    assert long_span.startswith(context)
+    assert count_tokens(context) <= 50
+
+
+@pytest.fixture
+def run(monkeypatch):
+    llm_calls = []
+    monkeypatch.setattr(tender_extractor, "record_llm_call", lambda run_id, llm_call: llm_calls.append(llm_call))
+    monkeypatch.delenv("LLM_MAX_PROMPT_TOKENS", raising=False)
+    monkeypatch.delenv("CONTEXT_MAX_TOKENS", raising=False)
+    return {"run_id": "run", "llm_calls": [], "token_budget": TokenBudget(10_000, calls=1)}
+
+def model_response(content: str) -> ModelResponse:
+    return ModelResponse(choices=[{"message": {"role": "assistant", "content": content}}],
+                         usage={"prompt_tokens": 40, "completion_tokens": 2, "total_tokens": 42})
+
+def test_prompt_over_the_call_allowance_is_not_sent(monkeypatch, run):
+    run["token_budget"] = TokenBudget(5, calls=1)
+    def unexpected_call(**kwargs):
+        raise AssertionError("the prompt should not be sent")
+    monkeypatch.setattr(tender_extractor, "llm_response", unexpected_call)
+
+    with pytest.raises(TokenBudgetExceeded):
+        budgeted_llm_call(run, ["Plazo"], "Eres un asistente experto en licitaciones públicas", lambda context: f"Contexto: {context}", [])
+
+    assert run["token_budget"].remaining == 5
+    assert run["llm_calls"] == []
+
+def test_sent_call_records_reported_usage_and_charges_the_budget(monkeypatch, run):
+    monkeypatch.setattr(tender_extractor, "llm_response", lambda **kwargs: model_response("12 meses"))
+    docs = [Document(page_content="El plazo es de 12 meses.", metadata={"page": 0, "start_index": 0})]
+
+    answer, llm_call = budgeted_llm_call(run, ["Plazo"], "sistema", lambda context: f"Contexto: {context}", docs)
+
+    assert answer == "12 meses"
+    assert (llm_call["prompt_tokens"], llm_call["completion_tokens"], llm_call["cached"]) == (40, 2, False)
+    assert run["token_budget"].remaining == 10_000 - llm_call["counted_prompt_tokens"]
+
+def test_cached_call_consumes_no_tokens_or_budget(monkeypatch, run):
+    cached = cached_model_response(model_response("12 meses").model_dump())
+    monkeypatch.setattr(tender_extractor, "llm_response", lambda **kwargs: cached)
+
+    _, llm_call = budgeted_llm_call(run, ["Plazo"], "sistema", lambda context: f"Contexto: {context}", [])
+
+    assert llm_call["cached"]
+    assert (llm_call["prompt_tokens"], llm_call["completion_tokens"]) == (0, 0)
+    assert run["token_budget"].remaining == 10_000
@@ -0,0 +1,34 @@
+import logging
+
+import trace_store
+from trace_store import start_run, record_sample, record_llm_call, flush_traces, list_runs, load_run_samples
+
+
+def test_runs_are_listed_with_their_samples_and_token_usage(monkeypatch, tmp_path):
+    monkeypatch.setattr(trace_store, "TRACES_DIR", str(tmp_path))
+
+    run_id = start_run("pliego.pdf")
+    record_sample(run_id, "Plazo", {"question": "¿Plazo?", "answer": "12 meses"})
+    record_llm_call(run_id, {"variables": ["Plazo"], "prompt_tokens": 100, "completion_tokens": 10})
+
+    (run,) = list_runs()
+    assert run["run_id"] == run_id
+    assert run["file_name"] == "pliego.pdf"
+    assert (run["samples"], run["llm_calls"], run["prompt_tokens"], run["completion_tokens"]) == (1, 1, 100, 10)
+    assert load_run_samples([run_id])[0]["sample"]["answer"] == "12 meses"
+
+def test_writer_keeps_running_after_a_batch_fails(monkeypatch, tmp_path, caplog):
+    # A file where the traces directory should be makes the batch fail
+    blocked_dir = tmp_path / "blocked"
+    blocked_dir.write_text("")
+    monkeypatch.setattr(trace_store, "TRACES_DIR", str(blocked_dir))
+
+    with caplog.at_level(logging.ERROR, logger="rag.traces"):
+        start_run("perdido.pdf")
+        flush_traces()
+    assert "Could not write" in caplog.text
+
+    monkeypatch.setattr(trace_store, "TRACES_DIR", str(tmp_path / "traces"))
+    run_id = start_run("pliego.pdf")
+
+    assert [run["run_id"] for run in list_runs()] == [run_id]
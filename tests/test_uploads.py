@@ -0,0 +1,99 @@
+import os
+import asyncio
+import hashlib
+
+import pytest
+from fastapi.testclient import TestClient
+
+import main
+from uploads import spool_upload, UploadTooLarge, InvalidUpload
+
+
+BOUNDARY = "----test-boundary"
+CONTENT_TYPE = f"multipart/form-data; boundary={BOUNDARY}"
+PDF_CONTENT = b"%PDF-1.4\n" + bytes(range(256)) * 40
+
+
+def multipart_body(content: bytes, field_name: str = "file", file_name: str = "pliego.pdf") -> bytes:
+    return (
+        f"--{BOUNDARY}\r\n"
+        f'Content-Disposition: form-data; name="comment"\r\n\r\n'
+        f"sin archivo\r\n"
+        f"--{BOUNDARY}\r\n"
+        f'Content-Disposition: form-data; name="{field_name}"; filename="{file_name}"\r\n'
+        f"Content-Type: application/pdf\r\n\r\n"
+    ).encode() + content + f"\r\n--{BOUNDARY}--\r\n".encode()
+
+async def chunked(body: bytes, size: int = 7):
+    for start in range(0, len(body), size):
+        yield body[start:start + size]
+
+def spool(body: bytes, target_dir, max_bytes: int = 10 * 1024 * 1024, content_type: str = CONTENT_TYPE):
+    return asyncio.run(spool_upload(chunked(body), content_type, str(target_dir), max_bytes))
+
+
+def test_spool_upload_writes_the_file_and_hashes_it(tmp_path):
+    path, content_hash, file_name = spool(multipart_body(PDF_CONTENT), tmp_path)
+
+    with open(path, "rb") as f:
+        assert f.read() == PDF_CONTENT
+    assert content_hash == hashlib.sha256(PDF_CONTENT).hexdigest()
+    assert file_name == "pliego.pdf"
+    assert os.path.dirname(path) == str(tmp_path)
+
+def test_spool_upload_stops_when_the_file_is_too_large(tmp_path):
+    with pytest.raises(UploadTooLarge):
+        spool(multipart_body(PDF_CONTENT), tmp_path, max_bytes=1024)
+
+    assert os.listdir(tmp_path) == []
+
+def test_spool_upload_requires_the_file_field(tmp_path):
+    with pytest.raises(InvalidUpload):
+        spool(multipart_body(PDF_CONTENT, field_name="document"), tmp_path)
+
+    assert os.listdir(tmp_path) == []
+
+def test_spool_upload_rejects_non_multipart_requests(tmp_path):
+    with pytest.raises(InvalidUpload):
+        spool(b"{}", tmp_path, content_type="application/json")
+
+
+@pytest.fixture
+def submitted(monkeypatch):
+    jobs = []
+    def fake_submit(pdf_file_path, file_name, cleanup=None, **extractor_kwargs):
+        with open(pdf_file_path, "rb") as f:
+            jobs.append({"content": f.read(), "file_name": file_name, **extractor_kwargs})
+        cleanup()
+        return "job-id", None
+    monkeypatch.setattr(main, "submit_extraction_job", fake_submit)
+    return jobs
+
+def test_upload_endpoint_submits_the_spooled_pdf(submitted):
+    response = TestClient(main.app).post("/jobs/get_resume", files={"file": ("pliego.pdf", PDF_CONTENT, "application/pdf")})
+
+    assert response.status_code == 200
+    assert response.json()["job_id"] == "job-id"
+    assert submitted[0]["content"] == PDF_CONTENT
+    assert submitted[0]["file_name"] == "pliego.pdf"
+    assert submitted[0]["content_hash"] == hashlib.sha256(PDF_CONTENT).hexdigest()
+
+def test_upload_endpoint_rejects_a_declared_oversized_body(monkeypatch, submitted):
+    monkeypatch.setenv("UPLOAD_MAX_MB", "0.001")
+    body = multipart_body(PDF_CONTENT * 10)
+
+    response = TestClient(main.app).post("/jobs/get_resume", content=body, headers={"Content-Type": CONTENT_TYPE})
+
+    assert response.status_code == 413
+    assert submitted == []
+
+def test_upload_endpoint_rejects_an_oversized_chunked_body(monkeypatch, submitted):
+    monkeypatch.setenv("UPLOAD_MAX_MB", "0.001")
+
+    def body():
+        yield multipart_body(PDF_CONTENT)
+
+    response = TestClient(main.app).post("/jobs/get_resume", content=body(), headers={"Content-Type": CONTENT_TYPE})
+
+    assert response.status_code == 413
+    assert submitted == []
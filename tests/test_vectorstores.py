@@ -0,0 +1,89 @@
+import os
+import shutil
+from concurrent.futures import ThreadPoolExecutor
+
+import fitz
+import pytest
+
+import retriever
+import embedding_cache
+import vectorstore_cache
+from local_embeddings import HashingEmbeddings
+from retriever import load_vectorstore, load_vectorstore_by_name, load_identity, resolve_vectorstore_path, VectorstoreMismatch
+
+
+@pytest.fixture(autouse=True)
+def isolated_storage(monkeypatch, tmp_path):
+    monkeypatch.setattr(retriever, "VECTORSTORES_DIR", str(tmp_path / "vectorstores"))
+    monkeypatch.setattr(retriever, "ALIASES_FILE", str(tmp_path / "vectorstores" / "aliases.json"))
+    monkeypatch.setattr(embedding_cache, "EMBEDDINGS_CACHE_DIR", str(tmp_path / "embeddings_cache"))
+    monkeypatch.setattr(embedding_cache, "CHUNK_EMBEDDINGS_DB", str(tmp_path / "embeddings_cache" / "chunk_embeddings.sqlite"))
+    monkeypatch.setattr(embedding_cache, "_schema_ready", False)
+
+@pytest.fixture(autouse=True, scope="module")
+def parse_pool():
+    # The page extraction processes are started once for the whole module
+    yield
+    retriever.shutdown_parse_pool()
+
+@pytest.fixture
+def pdf_file_path(tmp_path):
+    path = str(tmp_path / "pliego.pdf")
+    with fitz.open() as pdf:
+        for page_number in range(3):
+            pdf.new_page().insert_text((72, 72), f"Página {page_number}: el plazo de ejecución es de doce meses.")
+        pdf.save(path)
+    return path
+
+
+def test_vectorstore_records_its_identity(pdf_file_path):
+    embeddings_model = HashingEmbeddings(dimensions=32)
+
+    load_vectorstore(embeddings_model, pdf_file_path, "pliego")
+
+    identity = load_identity(resolve_vectorstore_path("pliego"))
+    assert identity["embeddings_model"] == "local-hashing-32"
+    assert load_vectorstore_by_name(embeddings_model, "pliego").index.d == 32
+
+def test_vectorstore_of_another_embeddings_model_is_rejected(pdf_file_path):
+    load_vectorstore(HashingEmbeddings(dimensions=32), pdf_file_path, "pliego")
+
+    with pytest.raises(VectorstoreMismatch):
+        load_vectorstore_by_name(HashingEmbeddings(dimensions=16), "pliego")
+
+def test_alias_follows_a_vectorstore_rebuilt_with_the_current_model(pdf_file_path):
+    load_vectorstore(HashingEmbeddings(dimensions=32), pdf_file_path, "pliego")
+    current_model = HashingEmbeddings(dimensions=16)
+    load_vectorstore(current_model, pdf_file_path, "pliego_copia")
+
+    assert load_vectorstore_by_name(current_model, "pliego").index.d == 16
+    assert resolve_vectorstore_path("pliego") == resolve_vectorstore_path("pliego_copia")
+
+def test_missing_vectorstore_folder_is_not_found(pdf_file_path):
+    embeddings_model = HashingEmbeddings(dimensions=32)
+    load_vectorstore(embeddings_model, pdf_file_path, "pliego")
+    vectorstore_path = resolve_vectorstore_path("pliego")
+    shutil.rmtree(vectorstore_path)
+    vectorstore_cache.invalidate_vectorstore(vectorstore_path)
+
+    with pytest.raises(FileNotFoundError):
+        load_vectorstore_by_name(embeddings_model, "pliego")
+    with pytest.raises(FileNotFoundError):
+        load_vectorstore_by_name(embeddings_model, "desconocido")
+
+def test_concurrent_requests_build_the_vectorstore_once(monkeypatch, pdf_file_path):
+    embeddings_model = HashingEmbeddings(dimensions=32)
+    builds = []
+    build_vectorstore = retriever.build_vectorstore
+    def counting_build(*args):
+        builds.append(args)
+        return build_vectorstore(*args)
+    monkeypatch.setattr(retriever, "build_vectorstore", counting_build)
+
+    with ThreadPoolExecutor(max_workers=4) as pool:
+        vectorstores = list(pool.map(lambda name: load_vectorstore(embeddings_model, pdf_file_path, name), ["a", "b", "c", "d"]))
+
+    assert len(builds) == 1
+    assert all(vectorstore is vectorstores[0] for vectorstore in vectorstores)
+    # Only the published folder is left, no temporary build folder
+    assert sorted(os.listdir(retriever.VECTORSTORES_DIR)) == sorted(["aliases.json", os.path.basename(resolve_vectorstore_path("a"))])